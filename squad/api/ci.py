@@ -4,6 +4,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
 from squad.http import auth_submit, read_file_upload, auth_user_from_request
+from squad.http import InvalidUpload, UploadTooLarge
 from squad.ci.tasks import submit
 from squad.ci.models import Backend, TestJob
 
@@ -32,7 +33,12 @@ def submit_job(request, group_slug, project_slug, version, environment_slug):
     # definition can be received as a file upload or as a POST parameter
     definition = None
     if 'definition' in request.FILES:
-        definition = read_file_upload(request.FILES['definition'])
+        try:
+            definition = read_file_upload(request.FILES['definition'])
+        except UploadTooLarge as e:
+            return HttpResponse(str(e), status=413)
+        except InvalidUpload as e:
+            return HttpResponseBadRequest(str(e))
     else:
         definition = request.POST.get('definition')
 
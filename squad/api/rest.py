@@ -6,8 +6,10 @@ from django.core import exceptions as core_exceptions
 from django.core.validators import validate_email
 from django.contrib.auth.models import User
 from squad.api.filters import ComplexFilterBackend
-from squad.core.models import Annotation, Group, Project, ProjectStatus, Build, TestRun, Environment, Test, Metric, MetricThreshold, EmailTemplate, KnownIssue, PatchSource, Suite, SuiteMetadata, DelayedReport, Subscription
+from squad.http import file_response
+from squad.core.models import Annotation, Group, Project, ProjectStatus, Build, TestRun, Environment, Test, Metric, MetricThreshold, EmailTemplate, KnownIssue, PatchSource, Suite, SuiteMetadata, DelayedReport, Subscription, StatusChange
 from squad.core.tasks import prepare_report, update_delayed_report
+from squad.core.utils import parse_name
 from squad.ci.models import Backend, TestJob
 from django.http import HttpResponse
 from django.urls import reverse
@@ -418,6 +420,21 @@ class ProjectViewSet(viewsets.ModelViewSet):
         )
         return Response(serializer.data)
 
+    @detail_route(methods=['get'], suffix='regressions')
+    def regressions(self, request, pk=None):
+        """
+        List of regressions in all builds of the current project, most
+        recent builds first.
+        """
+        regressions = StatusChange.objects.feed(self.get_object(), StatusChange.REGRESSION)
+        test_name = request.query_params.get("test_name", None)
+        if test_name is not None:
+            suite, name = parse_name(test_name)
+            regressions = regressions.filter(metadata__kind='test', metadata__suite=suite, metadata__name=name)
+        page = self.paginate_queryset(regressions)
+        serializer = StatusChangeSerializer(page, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
     @detail_route(methods=['post'], suffix='subscribe')
     def subscribe(self, request, pk=None):
         subscriber_email = request.data.get("email", None)
@@ -451,14 +468,16 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
 
 class ProjectStatusSerializer(serializers.HyperlinkedModelSerializer):
+    regressions = serializers.SerializerMethodField()
+    fixes = serializers.SerializerMethodField()
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        if instance.regressions is not None:
-            ret['regressions'] = json.dumps(instance.get_regressions())
-        if instance.fixes is not None:
-            ret['fixes'] = json.dumps(instance.get_fixes())
-        return ret
+    def get_regressions(self, instance):
+        regressions = instance.get_regressions()
+        return regressions and json.dumps(regressions) or None
+
+    def get_fixes(self, instance):
+        fixes = instance.get_fixes()
+        return fixes and json.dumps(fixes) or None
 
     class Meta:
         model = ProjectStatus
@@ -487,6 +506,16 @@ class ProjectStatusSerializer(serializers.HyperlinkedModelSerializer):
                   'fixes')
 
 
+class StatusChangeSerializer(serializers.ModelSerializer):
+    build = serializers.HyperlinkedRelatedField(source='status.build', view_name='build-detail', read_only=True)
+    environment = serializers.HyperlinkedRelatedField(view_name='environment-detail', read_only=True)
+    test = serializers.CharField(source='full_name', read_only=True)
+
+    class Meta:
+        model = StatusChange
+        fields = ('build', 'environment', 'test', 'kind')
+
+
 class ProjectStatusViewSet(viewsets.ModelViewSet):
     queryset = ProjectStatus.objects
     serializer_class = ProjectStatusSerializer
@@ -585,6 +614,21 @@ class BuildViewSet(ModelViewSet):
         except ProjectStatus.DoesNotExist:
             raise NotFound()
 
+    @detail_route(methods=['get'], suffix='regressions')
+    def regressions(self, request, pk=None):
+        return self.__status_changes__(request, StatusChange.REGRESSION)
+
+    @detail_route(methods=['get'], suffix='fixes')
+    def fixes(self, request, pk=None):
+        return self.__status_changes__(request, StatusChange.FIX)
+
+    def __status_changes__(self, request, kind):
+        changes = StatusChange.objects.filter(status__build=self.get_object(), kind=kind).select_related('status__build')
+        changes = changes.order_by('environment__slug', 'metadata__suite', 'metadata__name')
+        page = self.paginate_queryset(changes)
+        serializer = StatusChangeSerializer(page, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
     @detail_route(methods=['get'], suffix='test runs')
     def testruns(self, request, pk=None):
         testruns = self.get_object().test_runs.order_by('-id')
@@ -732,7 +776,7 @@ class TestRunSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = TestRun
-        fields = '__all__'
+        exclude = ('tests_file_blob', 'metrics_file_blob', 'log_file_blob', 'metadata_file_blob')
 
 
 class SuiteSerializer(serializers.ModelSerializer):
@@ -765,7 +809,7 @@ class TestSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Test
-        exclude = ('test_run',)
+        exclude = ('test_run', 'build', 'environment', 'project')
 
 
 class TestViewSet(ModelViewSet):
@@ -777,7 +821,7 @@ class TestViewSet(ModelViewSet):
     ordering = ('id',)
 
     def get_queryset(self):
-        return self.queryset.filter(test_run__build__project__in=self.get_project_ids())
+        return self.queryset.filter(project_id__in=self.get_project_ids())
 
 
 class MetricSerializer(serializers.ModelSerializer):
@@ -786,7 +830,14 @@ class MetricSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Metric
-        exclude = ('id', 'suite', 'test_run', 'measurements')
+        exclude = ('id', 'suite', 'test_run', 'measurements', 'build', 'environment', 'project')
+
+
+def testrun_file_response(request, testrun, name, content_type):
+    length, digest = testrun.file_info(name)
+    if length is None:
+        return HttpResponse('', content_type=content_type)
+    return file_response(request, testrun.open_file(name), content_type, length=length, digest=digest)
 
 
 class TestRunViewSet(ModelViewSet):
@@ -819,22 +870,22 @@ class TestRunViewSet(ModelViewSet):
     @detail_route(methods=['get'])
     def tests_file(self, request, pk=None):
         testrun = self.get_object()
-        return HttpResponse(testrun.tests_file, content_type='application/json')
+        return testrun_file_response(request, testrun, 'tests_file', 'application/json')
 
     @detail_route(methods=['get'])
     def metrics_file(self, request, pk=None):
         testrun = self.get_object()
-        return HttpResponse(testrun.metrics_file, content_type='application/json')
+        return testrun_file_response(request, testrun, 'metrics_file', 'application/json')
 
     @detail_route(methods=['get'])
     def metadata_file(self, request, pk=None):
         testrun = self.get_object()
-        return HttpResponse(testrun.metadata_file, content_type='application/json')
+        return testrun_file_response(request, testrun, 'metadata_file', 'application/json')
 
     @detail_route(methods=['get'])
     def log_file(self, request, pk=None):
         testrun = self.get_object()
-        return HttpResponse(testrun.log_file, content_type='text/plain')
+        return testrun_file_response(request, testrun, 'log_file', 'text/plain')
 
     @detail_route(methods=['get'], suffix='tests')
     def tests(self, request, pk=None):
@@ -18,6 +18,8 @@ urlpatterns = [
     url(r'^auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^createbuild/(%s)/(%s)/(%s)' % ((slug_pattern,) * 3), views.create_build),
     url(r'^submit/(%s)/(%s)/(%s)/(%s)' % ((slug_pattern,) * 4), views.add_test_run),
+    url(r'^submitbatch/(%s)/(%s)/(%s)' % ((slug_pattern,) * 3), views.add_test_runs),
+    url(r'^submission/([0-9]+)', views.submission_status),
     url(r'^submitjob/(%s)/(%s)/(%s)/(%s)' % ((slug_pattern,) * 4), ci.submit_job),
     url(r'^watchjob/(%s)/(%s)/(%s)/(%s)' % ((slug_pattern,) * 4), ci.watch_job),
     url(r'^data/(%s)/(%s)' % ((slug_pattern,) * 2), data.get),
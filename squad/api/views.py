@@ -1,20 +1,34 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 import json
 import logging
+import os
+import shutil
+import tarfile
+import tempfile
 
 
-from squad.http import read_file_upload
+from squad.http import read_file_upload, open_file_upload, file_upload_name
+from squad.http import InvalidUpload, UploadTooLarge, TooManyFiles
 from squad.http import auth_submit
+from squad.http import auth_user_from_request
 
 
 from squad.core.models import Build
 from squad.core.models import PatchSource
+from squad.core.models import Submission
+from squad.core.models import slug_validator
 
 
 from squad.core.tasks import CreateBuild
 from squad.core.tasks import ReceiveTestRun
+from squad.core.tasks import ReceiveTestRunBatch
+from squad.core.tasks import SubmitTestRun
 from squad.core.tasks import exceptions
 
 
@@ -51,6 +65,17 @@ def create_build(request, group_slug, project_slug, version):
     return HttpResponse('', status=201)
 
 
+def is_async(request):
+    """
+    Asynchronous processing is requested either with a true-ish `async`
+    parameter, or with a `Prefer: respond-async` header (RFC 7240).
+    """
+    if request.POST.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    prefer = request.META.get('HTTP_PREFER', '')
+    return 'respond-async' in [p.strip() for p in prefer.split(',')]
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 @auth_submit
@@ -68,12 +93,29 @@ def add_test_run(request, group_slug, project_slug, version, environment_slug):
         'log_file': 'log',
         'metadata_file': 'metadata',
     }
-    for key, field in uploads.items():
-        if field in request.FILES:
-            f = request.FILES[field]
-            test_run_data[key] = read_file_upload(f).decode('utf-8')
-        elif field in request.POST:
-            test_run_data[key] = request.POST[field]
+    try:
+        for key, field in uploads.items():
+            if field in request.FILES:
+                f = request.FILES[field]
+                if key == 'log_file':
+                    # logs can be huge; avoid holding them in memory here
+                    test_run_data[key] = open_file_upload(f)
+                else:
+                    test_run_data[key] = read_file_upload(f).decode('utf-8')
+            elif field in request.POST:
+                test_run_data[key] = request.POST[field]
+
+        if 'attachment' in request.FILES:
+            attachments = {}
+            for f in request.FILES.getlist('attachment'):
+                # attachments are kept byte for byte, unless the client
+                # explicitly sends them with a compressed content type
+                attachments[file_upload_name(f, by_extension=False)] = open_file_upload(f, by_extension=False)
+            test_run_data['attachments'] = attachments
+    except UploadTooLarge as e:
+        return HttpResponse(str(e), status=413)
+    except (InvalidUpload, UnicodeDecodeError) as e:
+        return HttpResponse(str(e), status=400)
 
     if 'metadata_file' not in test_run_data:
         metadata = {}
@@ -83,11 +125,9 @@ def add_test_run(request, group_slug, project_slug, version, environment_slug):
         if metadata:
             test_run_data['metadata_file'] = json.dumps(metadata)
 
-    if 'attachment' in request.FILES:
-        attachments = {}
-        for f in request.FILES.getlist('attachment'):
-            attachments[f.name] = read_file_upload(f)
-        test_run_data['attachments'] = attachments
+    if is_async(request):
+        submission = SubmitTestRun(project)(**test_run_data)
+        return HttpResponse(submission.id, status=202)
 
     receive = ReceiveTestRun(project)
 
@@ -98,3 +138,128 @@ def add_test_run(request, group_slug, project_slug, version, environment_slug):
         return HttpResponse(str(e), status=400)
 
     return HttpResponse('', status=201)
+
+
+BATCH_FILES = {
+    'metadata.json': 'metadata_file',
+    'metrics.json': 'metrics_file',
+    'tests.json': 'tests_file',
+    'log.txt': 'log_file',
+}
+
+
+def __extract__(archive, member):
+    """
+    Copies an archive member into a temporary file, which is kept in memory
+    only if it is small.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    shutil.copyfileobj(archive.extractfile(member), spool)
+    spool.seek(0)
+    return spool
+
+
+def read_batch_archive(upload):
+    """
+    Reads a tar archive laid out like the input of the import_data command,
+    except for the build level: ENVIRONMENT/JOB/FILE. Returns a list of
+    dictionaries with ReceiveTestRun arguments, one for each test run.
+
+    The archive can have at most SQUAD_MAX_BATCH_FILES members, and their
+    total size is limited by SQUAD_MAX_UPLOAD_SIZE, like a single file. Logs
+    and attachments are extracted to temporary files, and passed on as file
+    objects, so that only the (small) JSON files are held in memory.
+    """
+    max_size = settings.SQUAD_MAX_UPLOAD_SIZE
+    max_files = settings.SQUAD_MAX_BATCH_FILES
+    archive_file = open_file_upload(upload)
+    try:
+        archive = tarfile.open(fileobj=archive_file, mode='r:*')
+    except tarfile.TarError as e:
+        raise InvalidUpload("%s: invalid archive (%s)" % (upload.name, e))
+
+    test_runs = {}
+    total_size = 0
+    with archive:
+        for count, member in enumerate(archive, 1):
+            if max_files and count > max_files:
+                raise TooManyFiles(upload, max_files)
+            path = os.path.normpath(member.name).split(os.sep)
+            if not member.isfile() or len(path) != 3:
+                continue
+            total_size += member.size
+            if max_size and total_size > max_size:
+                raise UploadTooLarge(upload, max_size)
+            environment_slug, job, filename = path
+            try:
+                slug_validator(environment_slug)
+            except ValidationError:
+                raise InvalidUpload("%s: invalid environment name" % member.name)
+
+            data = test_runs.setdefault((environment_slug, job), {
+                'environment_slug': environment_slug,
+                'attachments': {},
+            })
+            key = BATCH_FILES.get(filename)
+            if key == 'log_file':
+                data[key] = __extract__(archive, member)
+            elif key:
+                data[key] = archive.extractfile(member).read().decode('utf-8')
+            else:
+                data['attachments'][filename] = __extract__(archive, member)
+
+    for (environment_slug, job), data in test_runs.items():
+        if 'metadata_file' not in data:
+            data['metadata_file'] = json.dumps({'job_id': job})
+
+    return [test_runs[k] for k in sorted(test_runs.keys())]
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@auth_submit
+def add_test_runs(request, group_slug, project_slug, version):
+    project = request.project
+
+    if 'archive' not in request.FILES:
+        return HttpResponse("archive is required", status=400)
+
+    try:
+        test_runs = read_batch_archive(request.FILES['archive'])
+    except UploadTooLarge as e:
+        return HttpResponse(str(e), status=413)
+    except (InvalidUpload, UnicodeDecodeError) as e:
+        return HttpResponse(str(e), status=400)
+
+    # the whole batch is received synchronously, in a single transaction;
+    # its size is bounded by SQUAD_MAX_BATCH_FILES and SQUAD_MAX_UPLOAD_SIZE
+    receive = ReceiveTestRunBatch(project)
+    try:
+        testruns = receive(version, test_runs)
+    except exceptions.invalid_input as e:
+        logger.warning(request.get_full_path() + ": " + str(e))
+        return HttpResponse(str(e), status=400)
+
+    return HttpResponse(len(testruns), status=201)
+
+
+@require_http_methods(["GET"])
+def submission_status(request, submission_id):
+    submission = get_object_or_404(Submission.objects.select_related('project'), pk=submission_id)
+    user = auth_user_from_request(request, request.user)
+    if not submission.project.accessible_to(user):
+        raise PermissionDenied()
+
+    data = {
+        'id': submission.id,
+        'status': submission.status,
+        'created_at': submission.created_at,
+        'processed_at': submission.processed_at,
+        'error_message': submission.error_message,
+        'testrun': None,
+    }
+    if submission.test_run_id:
+        data['testrun'] = request.build_absolute_uri(
+            reverse('testrun-detail', args=[submission.test_run_id])
+        )
+    return JsonResponse(data)
@@ -8,7 +8,7 @@ from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 
 
-from squad.core.tasks import ReceiveTestRun, UpdateProjectStatus
+from squad.core.tasks import ReceiveTestRun, ScheduleStatusUpdate
 from squad.core.models import Project, Build, TestRun, slug_validator
 from squad.core.plugins import apply_plugins
 from squad.core.tasks.exceptions import InvalidMetadata
@@ -116,7 +116,7 @@ class Backend(models.Model):
 
                 self.__postprocess_testjob__(test_job)
 
-                UpdateProjectStatus()(testrun)
+                ScheduleStatusUpdate()(testrun)
             except InvalidMetadata as exception:
                 # mark test job as fetched to prevent resubmission
                 # on next fetch attempt
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+
+from squad.core.models import Suite, SuiteMetadata
+
+
+# Cached objects can be changed or deleted by any process, and every process
+# has its own cache. So every change is recorded by incrementing a
+# "generation" counter in Django's cache, which must be shared by all
+# processes (see CACHES in the settings), and each process drops all of its
+# cached objects when it sees that the generation has changed. To keep the
+# round trips to the shared cache down, the generation is only checked once
+# per batch of lookups (see refresh()), and not for every key.
+GENERATION_KEY = 'squad.core.cache.generation'
+
+
+def generation():
+    return shared_cache.get(GENERATION_KEY, 0)
+
+
+def __next_generation__():
+    if not shared_cache.add(GENERATION_KEY, 1, timeout=None):
+        try:
+            shared_cache.incr(GENERATION_KEY)
+        except ValueError:  # expired in the meantime
+            shared_cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+class ModelCache(object):
+    """
+    A bounded, process-local LRU cache of model instances.
+
+    Objects are only stored once the current database transaction commits, so
+    that rows created by a transaction that ends up being rolled back never
+    make it into the cache. Hits and misses are counted so that the cache can
+    be sized appropriately; see `info()`.
+
+    The cache is emptied whenever objects are changed or deleted, in any
+    process, as of the next call to `refresh()`; see `invalidate_all()`.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data__ = OrderedDict()
+        self.__keys__ = {}  # pk → key
+        self.__generation__ = None
+
+    def refresh(self, current):
+        """
+        Empties the cache if the generation is not ``current`` anymore.
+        """
+        if current != self.__generation__:
+            self.clear()
+            self.__generation__ = current
+
+    def get(self, key):
+        obj = self.__data__.get(key)
+        if obj is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__data__.move_to_end(key)
+        return obj
+
+    def add(self, key, obj):
+        if self.maxsize <= 0:
+            return
+        loaded_generation = self.__generation__
+        transaction.on_commit(lambda: self.__store__(key, obj, loaded_generation))
+
+    def __store__(self, key, obj, loaded_generation):
+        if self.__generation__ != loaded_generation:
+            # obj could have been changed by another process since it was
+            # loaded
+            return
+        self.discard(key)
+        self.__data__[key] = obj
+        self.__keys__[obj.pk] = key
+        while len(self.__data__) > self.maxsize:
+            _, old = self.__data__.popitem(last=False)
+            self.__keys__.pop(old.pk, None)
+
+    def discard(self, key):
+        obj = self.__data__.pop(key, None)
+        if obj is not None:
+            self.__keys__.pop(obj.pk, None)
+
+    def invalidate(self, obj):
+        key = self.__keys__.get(obj.pk)
+        if key is not None:
+            self.discard(key)
+
+    def clear(self):
+        self.__data__.clear()
+        self.__keys__.clear()
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.__data__),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self.__data__)
+
+
+# (project_id, suite slug) → Suite
+suites = ModelCache(settings.SQUAD_SUITE_CACHE_SIZE)
+
+# (kind, suite slug, name) → SuiteMetadata
+suite_metadata = ModelCache(settings.SQUAD_SUITE_CACHE_SIZE)
+
+
+def info():
+    return {
+        'suites': suites.info(),
+        'suite_metadata': suite_metadata.info(),
+    }
+
+
+def clear():
+    suites.clear()
+    suite_metadata.clear()
+
+
+def refresh():
+    """
+    Empties the caches if objects were changed or deleted by any process
+    since the last call. Must be called before each batch of lookups; this
+    is the only time the shared cache is read.
+    """
+    if suites.maxsize <= 0 and suite_metadata.maxsize <= 0:
+        return
+    current = generation()
+    suites.refresh(current)
+    suite_metadata.refresh(current)
+
+
+def invalidate_all():
+    """
+    Empties the caches of all processes, once the current transaction
+    commits. This must be called after changing or deleting suites or suite
+    metadata behind the back of the ORM, e.g. with bulk updates.
+    """
+    clear()
+    transaction.on_commit(__next_generation__)
+
+
+def __invalidate_suite__(sender, instance, created=False, **kwargs):
+    if not created:
+        suites.invalidate(instance)
+        transaction.on_commit(__next_generation__)
+
+
+def __invalidate_suite_metadata__(sender, instance, created=False, **kwargs):
+    if not created:
+        suite_metadata.invalidate(instance)
+        transaction.on_commit(__next_generation__)
+
+
+post_save.connect(__invalidate_suite__, sender=Suite)
+post_delete.connect(__invalidate_suite__, sender=Suite)
+post_save.connect(__invalidate_suite_metadata__, sender=SuiteMetadata)
+post_delete.connect(__invalidate_suite_metadata__, sender=SuiteMetadata)
@@ -1,10 +1,147 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
-from django.db.models import F
+from collections.abc import Mapping, Sequence
+from heapq import merge
+import json
+
+
+from django.db.models import Exists, NullBooleanField, OuterRef, Q, Subquery
 
 
 from squad.core.utils import parse_name
 from squad.core import models
-from squad.core.utils import join_name
+from squad.core.utils import join_name, split_list
+
+
+# test statuses, as stored in BuildResults
+STATUSES = (None, 'pass', 'fail', 'xfail', 'skip')
+
+
+def status_code(result, has_known_issues):
+    if result:
+        return 1
+    elif result is None:
+        return 4
+    elif has_known_issues:
+        return 3
+    else:
+        return 2
+
+
+class BuildResults(object):
+    """
+    The test results of a build, in compact arrays sorted by test (metadata
+    id). There is one entry in each array for each test and environment:
+    ``tests`` has the metadata id of the test, ``environments`` the index of
+    the environment name in TestComparison.environment_names, and
+    ``statuses`` the index of the status in STATUSES. This takes a few bytes
+    per test, instead of the hundreds taken by dictionaries of strings.
+
+    ``tests`` is an iterable of (metadata id, test run id, result,
+    has_known_issues) tuples, sorted by metadata id and test run, so that
+    the result from the latest test run wins.
+    """
+
+    def __init__(self, tests, environment_of):
+        self.tests = array('q')
+        self.environments = array('H')
+        self.statuses = array('b')
+
+        current = None
+        row = {}
+        for test, test_run_id, result, has_known_issues in tests:
+            if test != current:
+                self.__append__(current, row)
+                current = test
+                row = {}
+            row[environment_of[test_run_id]] = status_code(result, has_known_issues)
+        self.__append__(current, row)
+
+    def __append__(self, test, row):
+        for environment in sorted(row):
+            self.tests.append(test)
+            self.environments.append(environment)
+            self.statuses.append(row[environment])
+
+    def row(self, test):
+        """
+        Returns the results of a test, as a mapping between environment
+        index and status index.
+        """
+        start = bisect_left(self.tests, test)
+        end = bisect_right(self.tests, test, start)
+        return {self.environments[i]: self.statuses[i] for i in range(start, end)}
+
+    def unique_tests(self):
+        previous = None
+        for test in self.tests:
+            if test != previous:
+                yield test
+                previous = test
+
+
+class ComparisonResults(Mapping):
+    """
+    The body of the results table of a TestComparison, as a read-only
+    mapping of test name to the results of that test. Rows are only built
+    when they are accessed; ``items()`` returns a sequence that can be
+    sliced, so that a page of the table can be displayed without building
+    the others.
+    """
+
+    def __init__(self, comparison):
+        self.comparison = comparison
+
+        tests = list(comparison.__all_tests__())
+        names = comparison.__get_names__(tests)
+        self.tests = array('q', sorted(tests, key=lambda t: names[t]))
+
+    def __len__(self):
+        return len(self.tests)
+
+    def __iter__(self):
+        for name, _ in self.items():
+            yield name
+
+    def __getitem__(self, name):
+        suite, test = parse_name(name)
+        ids = models.SuiteMetadata.objects.filter(kind='test', suite=suite, name=test).values_list('id', flat=True)
+        for i in ids:
+            row = self.comparison.__row__(i)
+            if row:
+                return row
+        raise KeyError(name)
+
+    def items(self):
+        return ComparisonRows(self)
+
+
+class ComparisonRows(Sequence):
+    """
+    The (test name, results) pairs of a ComparisonResults.
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    def __len__(self):
+        return len(self.results.tests)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.__rows__(self.results.tests[index])
+        return self.__rows__([self.results.tests[index]])[0]
+
+    def __iter__(self):
+        for chunk in split_list(self.results.tests, 500):
+            for row in self.__rows__(chunk):
+                yield row
+
+    def __rows__(self, tests):
+        comparison = self.results.comparison
+        names = comparison.__get_names__(tests)
+        return [(names[test], comparison.__row__(test)) for test in tests]
 
 
 class TestComparison(object):
@@ -39,61 +176,231 @@ class TestComparison(object):
     mapping, between Environment (the column) and the test result (the cells in
     the table). So results[testname][env] gives you the value of the cell at
     (testname, env)
+
+    If `environments` is given, only test runs from those environments are
+    compared.
+
+    The table is only loaded when needed: regressions and fixes between
+    the last two builds are computed by the database, so only the tests
+    whose status changed are ever loaded. When it is loaded, the results of
+    each build are kept in compact arrays (see BuildResults), and `results`
+    only builds the rows that are actually accessed.
     """
 
-    def __init__(self, *builds):
+    def __init__(self, *builds, environments=None):
         self.builds = list(builds)
-        self.environments = OrderedDict()
-        self.all_environments = set()
-        self.results = OrderedDict()
-        self.__intermittent__ = {}
+        self.only_environments = environments
+        self.__extracted__ = False
+        self.__test_run_list__ = None
+        self.__stored__ = None
+
+    @property
+    def environments(self):
+        self.__extract_environments__()
+        return self.__environments__
+
+    @property
+    def all_environments(self):
+        self.__extract_environments__()
+        return self.__all_environments__
+
+    @property
+    def results(self):
+        self.__extract_results__()
+        return self.__results__
 
+    @results.setter
+    def results(self, results):
         self.__extract_results__()
+        self.__results__ = results
 
     @classmethod
     def compare_builds(cls, *builds):
         builds = [b for b in builds if b]
         return cls(*builds)
 
+    @classmethod
+    def between(cls, baseline, target):
+        """
+        Compares ``target`` against ``baseline``, using the persistent store
+        of comparisons (see BuildComparison): regressions, fixes and the diff
+        are computed at most once after each update to the status of either
+        build, and loaded from the database otherwise. Meant for a build and
+        its baseline only; use compare_builds for ad-hoc comparisons.
+        """
+        comparison = cls(baseline, target)
+        comparison.__stored__ = models.BuildComparison.get(baseline, target)
+        return comparison
+
+    def __from_store__(self, field, compute, dump, load):
+        stored = self.__stored__
+        if stored is None:
+            return compute()
+
+        value = getattr(stored, field)
+        if value is not None:
+            return load(value)
+
+        result = compute()
+        setattr(stored, field, dump(result))
+        # unless the stored comparison was emptied in the meantime
+        models.BuildComparison.objects.filter(
+            pk=stored.pk,
+            computed_at=stored.computed_at,
+        ).update(**{field: getattr(stored, field)})
+        return result
+
+    @staticmethod
+    def __load_json__(value):
+        return json.loads(value, object_pairs_hook=OrderedDict)
+
+    def __dump_diff__(self, diff):
+        return json.dumps([
+            [test, [[self.builds.index(build), env, status] for (build, env), status in results.items()]]
+            for test, results in diff.items()
+        ])
+
+    def __load_diff__(self, value):
+        return OrderedDict(
+            (test, OrderedDict(((self.builds[build], env), status) for build, env, status in results))
+            for test, results in json.loads(value)
+        )
+
     @classmethod
     def compare_projects(cls, *projects):
         builds = [p.builds.last() for p in projects]
         return cls.compare_builds(*builds)
 
-    def __extract_results__(self):
+    def __test_runs__(self):
         test_runs = models.TestRun.objects.filter(
             build__in=self.builds,
-        ).prefetch_related(
-            'build',
-            'environment',
         )
+        if self.only_environments is not None:
+            test_runs = test_runs.filter(environment__in=self.only_environments)
+        return test_runs
+
+    def __extract_environments__(self):
+        if self.__test_run_list__ is not None:
+            return
+
+        test_runs = list(self.__test_runs__().select_related('environment'))
+        self.__test_run_list__ = test_runs
+
+        self.__environments__ = OrderedDict()
         for build in self.builds:
-            self.environments[build] = set()
+            self.__environments__[build] = set()
         for test_run in test_runs:
-            build = test_run.build
-            environment = test_run.environment
-            self.all_environments.add(str(environment))
-            self.environments[build].add(str(environment))
-            self.__extract_test_results__(test_run)
-        self.results = OrderedDict(sorted(self.results.items()))
+            for build in self.builds:
+                if build.id == test_run.build_id:
+                    self.__environments__[build].add(str(test_run.environment))
+        self.__all_environments__ = set(str(test_run.environment) for test_run in test_runs)
+        for build in self.builds:
+            self.__environments__[build] = sorted(self.__environments__[build])
+
+    def __extract_results__(self):
+        if self.__extracted__:
+            return
+        self.__extracted__ = True
+
+        self.__extract_environments__()
+        test_runs = self.__test_run_list__
+
+        self.environment_names = sorted(self.__all_environments__)
+        index = {name: i for i, name in enumerate(self.environment_names)}
+        environment_of = {test_run.id: index[str(test_run.environment)] for test_run in test_runs}
+
+        self.__build_results__ = {}
         for build in self.builds:
-            self.environments[build] = sorted(self.environments[build])
+            if build.id in self.__build_results__:
+                continue
+            test_runs = self.__test_runs__().filter(build_id=build.id)
+            tests = models.Test.objects.filter(
+                test_run__in=test_runs,
+                metadata__isnull=False,
+            ).order_by(
+                'metadata_id',
+                'test_run_id',
+                'id',
+            ).values_list('metadata_id', 'test_run_id', 'result', 'has_known_issues')
+            tests = merge(tests.iterator(), self.__legacy_tests__(test_runs), key=lambda t: t[:2])
+            self.__build_results__[build.id] = BuildResults(tests, environment_of)
 
-    def __extract_test_results__(self, test_run):
-        tests = test_run.tests.annotate(
-            suite_slug=F('suite__slug')
+        self.__results__ = ComparisonResults(self)
+
+    @staticmethod
+    def __legacy_tests__(test_runs):
+        """
+        Same as the test results passed to BuildResults, for tests stored
+        without metadata, which are identified by their suite and name
+        instead.
+        """
+        tests = list(
+            models.Test.objects.filter(
+                test_run__in=test_runs,
+                metadata__isnull=True,
+            ).order_by('test_run_id', 'id').values_list('suite__slug', 'name', 'test_run_id', 'result', 'has_known_issues')
         )
-        for test in tests.iterator():
-            key = (test_run.build, str(test_run.environment))
-            test_full_name = join_name(test.suite_slug, test.name)
-            if test_full_name not in self.results:
-                self.results[test_full_name] = OrderedDict()
-            self.results[test_full_name][key] = test.status
-            if test.has_known_issues:
-                for issue in test.known_issues.all():
-                    if issue.intermittent:
-                        env = str(test_run.environment)
-                        self.__intermittent__[(test_full_name, env)] = True
+        if not tests:
+            return []
+
+        metadata = {}
+        for chunk in split_list(list(set((suite, name) for suite, name, _, _, _ in tests)), 500):
+            q = Q()
+            for suite, name in chunk:
+                q |= Q(suite=suite, name=name)
+            metadata.update(
+                ((suite, name), i)
+                for i, suite, name in models.SuiteMetadata.objects.filter(q, kind='test').values_list('id', 'suite', 'name')
+            )
+        return sorted(
+            (metadata[(suite, name)], test_run_id, result, has_known_issues)
+            for suite, name, test_run_id, result, has_known_issues in tests
+            if (suite, name) in metadata
+        )
+
+    def __all_tests__(self):
+        """
+        Iterates over the ids (of the metadata) of all tests in the
+        comparison, in ascending order.
+        """
+        previous = None
+        for test in merge(*[results.unique_tests() for results in self.__build_results__.values()]):
+            if test != previous:
+                yield test
+                previous = test
+
+    def __row__(self, test):
+        """
+        Returns the results of a test, as a mapping between (build,
+        environment name) and status.
+        """
+        row = OrderedDict()
+        for build in self.builds:
+            for environment, status in sorted(self.__build_results__[build.id].row(test).items()):
+                row[(build, self.environment_names[environment])] = STATUSES[status]
+        return row
+
+    def __get_intermittent__(self):
+        """
+        Returns the (test name, environment name) pairs of the tests with
+        intermittent known issues, from a single query over the known issues
+        of the tests in the compared test runs.
+        """
+        through = models.Test.known_issues.through
+        pairs = through.objects.filter(
+            test__test_run__in=self.__test_runs__(),
+            test__has_known_issues=True,
+            knownissue__intermittent=True,
+        ).order_by().values_list('test__metadata_id', 'test__test_run__environment_id').distinct()
+        pairs = list(pairs)
+
+        names = self.__get_names__(set(metadata_id for metadata_id, _ in pairs))
+        environments = models.Environment.objects.in_bulk(set(env_id for _, env_id in pairs))
+        intermittent = {}
+        for metadata_id, env_id in pairs:
+            if metadata_id in names:
+                intermittent[(names[metadata_id], str(environments[env_id]))] = True
+        return intermittent
 
     __diff__ = None
 
@@ -103,21 +410,32 @@ class TestComparison(object):
         Returns a subset of the rows, containing only the rows where results
         differ between the builds.
         """
-        if self.__diff__ is not None:
-            return self.__diff__
+        if self.__diff__ is None:
+            self.__diff__ = self.__from_store__('diff', self.__compute_diff__, self.__dump_diff__, self.__load_diff__)
+        return self.__diff__
 
-        d = OrderedDict()
-        for test, results in self.results.items():
+    def __compute_diff__(self):
+        self.__extract_results__()
+        columns = [
+            (self.__build_results__[build.id], [self.environment_names.index(e) for e in self.environments[build]])
+            for build in self.builds
+        ]
+        changed = []
+        for test in self.__all_tests__():
             previous = None
-            for build in self.builds:
-                current = [results.get((build, e)) for e in self.environments[build]]
+            for results, environments in columns:
+                row = results.row(test)
+                current = [row.get(e, 0) for e in environments]
                 if previous and previous != current:
-                    d[test] = results
+                    changed.append(test)
                     break
                 previous = current
 
-        self.__diff__ = d
-        return self.__diff__
+        names = self.__get_names__(changed)
+        d = OrderedDict()
+        for test in sorted(changed, key=lambda t: names[t]):
+            d[names[test]] = self.__row__(test)
+        return d
 
     __regressions__ = None
     __fixes__ = None
@@ -125,18 +443,31 @@ class TestComparison(object):
     @property
     def regressions(self):
         if self.__regressions__ is None:
-            self.__regressions__ = self.__status_changes__(('pass', 'fail'))
+            self.__regressions__ = self.__from_store__('regressions', self.__compute_regressions__, json.dumps, self.__load_json__)
         return self.__regressions__
 
+    def __compute_regressions__(self):
+        if self.__extracted__:
+            return self.__status_changes__(('pass', 'fail'))
+        else:
+            return self.__status_changes_in_database__(regressions=True)
+
     @property
     def fixes(self):
         if self.__fixes__ is None:
-            self.__fixes__ = self.__status_changes__(
+            self.__fixes__ = self.__from_store__('fixes', self.__compute_fixes__, json.dumps, self.__load_json__)
+        return self.__fixes__
+
+    def __compute_fixes__(self):
+        if self.__extracted__:
+            intermittent = self.__get_intermittent__()
+            return self.__status_changes__(
                 ('fail', 'pass'),
                 ('xfail', 'pass'),
-                predicate=lambda test, env: (test, env) not in self.__intermittent__
+                predicate=lambda test, env: (test, env) not in intermittent
             )
-        return self.__fixes__
+        else:
+            return self.__status_changes_in_database__(regressions=False)
 
     def __status_changes__(self, *transitions, predicate=lambda test, env: True):
         if len(self.builds) < 2:
@@ -158,6 +489,103 @@ class TestComparison(object):
 
         return comparisons
 
+    def __status_changes_in_database__(self, regressions):
+        """
+        Same as __status_changes__, for regressions (pass → fail) or fixes
+        (fail/xfail → pass, unless there is an intermittent known issue for
+        the test), but done by the database: the tests of each environment
+        of the last build are joined with the tests of the build before it,
+        and only the ones that changed are returned.
+        """
+        changes = self.__changed_tests__(regressions)
+        names = self.__get_names__(set(metadata_id for _, _, metadata_id in changes))
+        comparisons = OrderedDict()
+        for env in sorted(set(env for env, _, _ in changes)):
+            comparisons[env] = sorted(set(names[metadata_id] for e, _, metadata_id in changes if e == env))
+        return comparisons
+
+    def changed_tests(self, regressions=True):
+        """
+        Returns the regressions (or the fixes) in the last build, as a list
+        of (environment id, test metadata id) pairs, where the environments
+        are the ones of the last build.
+        """
+        return [(environment_id, metadata_id) for _, environment_id, metadata_id in self.__changed_tests__(regressions)]
+
+    def __changed_tests__(self, regressions):
+        """
+        Returns (environment name, environment id, metadata id) tuples for
+        the tests of the last build that regressed (or were fixed).
+
+        Environments are matched across builds by name, as in the results
+        table; there are only a few of them, so that is done here.
+        """
+        if len(self.builds) < 2:
+            return []
+
+        after = self.builds[-1]  # last
+        before = self.builds[-2]  # second to last
+
+        environments = {}
+        for build_id, environment in self.__environments_by_build__():
+            environments.setdefault(str(environment), {}).setdefault(build_id, []).append(environment.id)
+
+        changes = []
+        for env, ids in environments.items():
+            if after.id not in ids or before.id not in ids:
+                continue
+
+            tests = models.Test.objects.filter(
+                build_id=after.id,
+                environment_id__in=ids[after.id],
+            )
+            newer = models.Test.objects.filter(
+                build_id=after.id,
+                environment_id__in=ids[after.id],
+                metadata_id=OuterRef('metadata_id'),
+            ).filter(Q(test_run_id__gt=OuterRef('test_run_id')) | Q(test_run_id=OuterRef('test_run_id'), id__gt=OuterRef('id')))
+            previous = models.Test.objects.filter(
+                build_id=before.id,
+                environment_id__in=ids[before.id],
+                metadata_id=OuterRef('metadata_id'),
+            ).order_by('-test_run_id', '-id').values('result')[:1]
+            tests = tests.annotate(
+                superseded=Exists(newer),
+                previous_result=Subquery(previous, output_field=NullBooleanField()),
+            ).filter(superseded=False)
+
+            if regressions:
+                tests = tests.filter(previous_result=True, result=False).exclude(has_known_issues=True)
+            else:
+                intermittent = models.Test.objects.filter(
+                    build_id__in=list(ids.keys()),
+                    environment_id__in=[i for build_ids in ids.values() for i in build_ids],
+                    metadata_id=OuterRef('metadata_id'),
+                    has_known_issues=True,
+                    known_issues__intermittent=True,
+                )
+                tests = tests.filter(previous_result=False, result=True).annotate(
+                    intermittent=Exists(intermittent),
+                ).filter(intermittent=False)
+
+            changes += [(env, environment_id, metadata_id) for environment_id, metadata_id in tests.order_by().values_list('environment_id', 'metadata_id')]
+
+        return changes
+
+    def __environments_by_build__(self):
+        test_runs = self.__test_runs__().order_by().values_list('build_id', 'environment_id').distinct()
+        pairs = list(test_runs)
+        environments = models.Environment.objects.in_bulk(set(env_id for _, env_id in pairs))
+        return [(build_id, environments[env_id]) for build_id, env_id in pairs]
+
+    @staticmethod
+    def __get_names__(metadata_ids):
+        names = {}
+        for chunk in split_list(metadata_ids, 500):
+            metadata = models.SuiteMetadata.objects.filter(id__in=chunk).values_list('id', 'suite', 'name')
+            names.update({i: join_name(suite, name) for i, suite, name in metadata})
+        return names
+
     @property
     def regressions_grouped_by_suite(self):
         return self.__status_changes_by_suite__()
@@ -14,9 +14,15 @@ def parse_test_result(value):
     return test_result_mapping.get(v, None)
 
 
+def decode(data):
+    if isinstance(data, (str, bytes)):
+        return json.loads(data)
+    return data
+
+
 class JSONTestDataParser(object):
     """
-    Parser for test data as JSON string
+    Parser for test data as JSON string, or as an already decoded dictionary
     """
 
     @staticmethod
@@ -24,7 +30,7 @@ class JSONTestDataParser(object):
         if test_data is None or test_data == '':
             return []
 
-        input_data = json.loads(test_data)
+        input_data = decode(test_data)
         data = []
         for key, value in input_data.items():
             group_name, test_name = parse_name(key)
@@ -46,7 +52,7 @@ def parse_metric(value):
 
 class JSONMetricDataParser(object):
     """
-    Parser for JSON metric data
+    Parser for JSON metric data, or for already decoded metric data
     """
 
     @staticmethod
@@ -54,7 +60,7 @@ class JSONMetricDataParser(object):
         if json_text is None or json_text == '':
             return []
 
-        input_data = json.loads(json_text)
+        input_data = decode(json_text)
         data = []
 
         for key, value in input_data.items():
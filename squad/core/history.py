@@ -3,7 +3,7 @@ from django.core.paginator import Paginator
 
 
 from squad.core.utils import parse_name
-from squad.core.models import Test
+from squad.core.models import SuiteMetadata, Test
 
 
 class TestResult(object):
@@ -35,12 +35,20 @@ class TestHistory(object):
             builds = self.paginator.page(page)
 
         suite = project.suites.get(slug=suite)
-
-        tests = Test.objects.filter(
-            suite=suite,
+        metadata_id = SuiteMetadata.objects.filter(
+            kind='test',
+            suite=suite.slug,
             name=test_name,
-            test_run__build__in=builds,
-        )
+        ).values_list('id', flat=True).first()
+
+        if metadata_id is None:
+            # the test was never run
+            tests = Test.objects.none()
+        else:
+            tests = Test.objects.filter(
+                metadata_id=metadata_id,
+                build__in=builds,
+            )
         Test.prefetch_related(tests)
 
         environments = OrderedDict()
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+from squad.core.models import TestRun, Test, Metric
+
+
+class Command(BaseCommand):
+
+    help = """Copy the build, environment and project of each test run into
+    its tests and metrics, for data received before those were stored with
+    them. Can be interrupted and restarted at any time."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='Number of test runs updated per transaction (default: 100)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = TestRun.objects.select_related('build').only(
+            'id',
+            'environment_id',
+            'build_id',
+            'build__project_id',
+        ).order_by('id')
+
+        tests = 0
+        metrics = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                for testrun in batch:
+                    keys = {
+                        'build_id': testrun.build_id,
+                        'environment_id': testrun.environment_id,
+                        'project_id': testrun.build.project_id,
+                    }
+                    tests += Test.objects.filter(test_run_id=testrun.id, build_id=None).update(**keys)
+                    metrics += Metric.objects.filter(test_run_id=testrun.id, build_id=None).update(**keys)
+            last_id = batch[-1].id
+        self.stdout.write('Updated %d tests and %d metrics' % (tests, metrics))
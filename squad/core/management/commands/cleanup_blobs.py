@@ -0,0 +1,55 @@
+import time
+
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+from squad.core import storage
+from squad.core.models import TestRun, Attachment
+from squad.core.utils import split_list
+
+
+class Command(BaseCommand):
+
+    help = """Remove blobs that are no longer referenced by any test run or
+    attachment from the blob store (see SQUAD_BLOB_STORE)."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            dest='min_age',
+            type=int,
+            default=24,
+            help='Only remove blobs stored at least this many hours ago, so '
+            'that blobs of test runs being received are kept (default: 24)',
+        )
+
+    def handle(self, *args, **options):
+        store = storage.get_store()
+        if store is None:
+            raise CommandError('SQUAD_BLOB_STORE is not set')
+
+        min_age = options['min_age'] * 3600
+        cutoff = time.time() - min_age
+        candidates = list(store.keys(older_than=min_age))
+
+        removed = 0
+        for chunk in split_list(candidates, 500):
+            referenced = set()
+            for name in TestRun.FILES:
+                field = name + '_blob'
+                referenced.update(TestRun.objects.filter(**{field + '__in': chunk}).values_list(field, flat=True))
+            referenced.update(Attachment.objects.filter(blob__in=chunk).values_list('blob', flat=True))
+
+            for key in chunk:
+                if key in referenced:
+                    continue
+                # the blob may have been stored again, for a test run whose
+                # reference to it was not committed yet when checked above
+                stored_at = store.stored_at(key)
+                if stored_at is None or stored_at > cutoff:
+                    continue
+                store.delete(key)
+                removed += 1
+
+        self.stdout.write('Removed %d unreferenced blobs' % removed)
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+
+from squad.core import storage
+from squad.core.models import TestRun, Attachment
+
+
+class Command(BaseCommand):
+
+    help = """Move test run files and attachments that are stored in the
+    database into the blob store (see SQUAD_BLOB_STORE). Can be interrupted
+    and restarted at any time."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='Number of objects moved per transaction (default: 100)',
+        )
+
+    def handle(self, *args, **options):
+        if storage.get_store() is None:
+            raise CommandError('SQUAD_BLOB_STORE is not set')
+
+        batch_size = options['batch_size']
+        test_runs = self.migrate_test_runs(batch_size)
+        attachments = self.migrate_attachments(batch_size)
+        self.stdout.write('Moved files of %d test runs and %d attachments' % (test_runs, attachments))
+
+    def migrate_test_runs(self, batch_size):
+        in_database = Q()
+        for name in TestRun.FILES:
+            in_database |= Q(**{name + '__isnull': False})
+        queryset = TestRun.objects.filter(in_database).defer(None).order_by('id')
+
+        fields = list(TestRun.FILES) + [name + '_blob' for name in TestRun.FILES]
+        count = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                for testrun in batch:
+                    for name in TestRun.FILES:
+                        contents = getattr(testrun, name)
+                        if contents is not None:
+                            testrun.set_file(name, contents)
+                    testrun.save(update_fields=fields)
+            last_id = batch[-1].id
+            count += len(batch)
+        return count
+
+    def migrate_attachments(self, batch_size):
+        queryset = Attachment.objects.filter(blob__isnull=True).order_by('id')
+        count = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                for attachment in batch:
+                    attachment.set_data(bytes(attachment.data or b''))
+                    attachment.save(update_fields=['data', 'blob', 'length'])
+            last_id = batch[-1].id
+            count += len(batch)
+        return count
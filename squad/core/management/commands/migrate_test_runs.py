@@ -3,6 +3,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
+from squad.core import cache
 from squad.core.models import Project, Build, Environment, Status, Test, Metric
 from squad.core.tasks import UpdateProjectStatus
 
@@ -105,3 +106,7 @@ class Command(BaseCommand):
                     suite=suite,
                     test_run__build__project_id=new_project.id,
                 ).update(suite=new_suite)
+
+        # suites and tests were moved around with bulk updates, which bypass
+        # the cache invalidation based on model signals
+        cache.invalidate_all()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0120_buildsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Submission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=100)),
+                ('environment_slug', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(null=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('tests_file', models.TextField(null=True)),
+                ('metrics_file', models.TextField(null=True)),
+                ('log_file', models.TextField(null=True)),
+                ('metadata_file', models.TextField(null=True)),
+                ('completed', models.BooleanField(default=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='core.Project')),
+                ('test_run', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.TestRun')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SubmissionAttachment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=1024)),
+                ('data', models.BinaryField(default=None)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='core.Submission')),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0121_submission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='blob',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='log_file_blob',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='metadata_file_blob',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='metrics_file_blob',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='tests_file_blob',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='data',
+            field=models.BinaryField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0122_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='buildsummary',
+            name='metrics_count',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='projectstatus',
+            name='baseline',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.Build'),
+        ),
+        migrations.AddField(
+            model_name='projectstatus',
+            name='metrics_count',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0123_incremental_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingStatusUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_requested_at', models.DateTimeField()),
+                ('last_requested_at', models.DateTimeField()),
+                ('build', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_status_update', to='core.Build')),
+            ],
+        ),
+    ]
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from array import array
+import sys
+
+from django.db import migrations, models, transaction
+from django.db.models import Case, Value, When
+
+
+# each metric takes 3 query parameters in the UPDATE; SQLite allows at most
+# 999 per query
+CHUNK_SIZE = 300
+
+
+def pack(measurements):
+    values = array('d', [float(n) for n in measurements.split(',')] if measurements else [])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack(data):
+    values = array('d', bytes(data or b''))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return ','.join(str(v) for v in values)
+
+
+def convert(apps, source, target, function):
+    """
+    Converts the metrics one chunk at a time, with a single UPDATE per
+    chunk, each in its own transaction, so that converting a large table
+    holds neither a huge transaction nor one query per metric.
+    """
+    Metric = apps.get_model('core', 'Metric')
+    output_field = Metric._meta.get_field(target).clone()
+    last_id = 0
+    while True:
+        chunk = list(
+            Metric.objects.filter(id__gt=last_id).order_by('id').values_list('id', source)[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        values = Case(
+            *[When(id=metric_id, then=Value(function(value), output_field=output_field)) for metric_id, value in chunk],
+            output_field=output_field
+        )
+        with transaction.atomic():
+            Metric.objects.filter(id__in=[metric_id for metric_id, _ in chunk]).update(**{target: values})
+        last_id = chunk[-1][0]
+
+
+def pack_measurements(apps, schema_editor):
+    convert(apps, 'measurements', 'packed_measurements', pack)
+
+
+def unpack_measurements(apps, schema_editor):
+    convert(apps, 'packed_measurements', 'measurements', unpack)
+
+
+class Migration(migrations.Migration):
+
+    # the data conversion commits each chunk separately
+    atomic = False
+
+    dependencies = [
+        ('core', '0124_pending_status_update'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='metric',
+            name='measurements',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metric',
+            name='packed_measurements',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(
+            pack_measurements,
+            reverse_code=unpack_measurements,
+        ),
+        migrations.RemoveField(
+            model_name='metric',
+            name='measurements',
+        ),
+        migrations.RenameField(
+            model_name='metric',
+            old_name='packed_measurements',
+            new_name='measurements',
+        ),
+        migrations.AlterField(
+            model_name='metric',
+            name='measurements',
+            field=models.BinaryField(),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0125_pack_metric_measurements'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metric',
+            name='build',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Build'),
+        ),
+        migrations.AddField(
+            model_name='metric',
+            name='environment',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Environment'),
+        ),
+        migrations.AddField(
+            model_name='metric',
+            name='project',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Project'),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='build',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Build'),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='environment',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Environment'),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='project',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Project'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['metadata', 'environment'], name='core_metric_metadat_41cfe3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['build', 'metadata'], name='core_test_build_i_56cb1d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['metadata', 'environment', 'build'], name='core_test_metadat_fb3824_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['project', 'id'], name='core_test_project_f79d27_idx'),
+        ),
+    ]
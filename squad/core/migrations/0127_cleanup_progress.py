@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0126_denormalize_test_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleanupProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.DateTimeField(null=True)),
+                ('running_until', models.DateTimeField(null=True)),
+                ('last_run_at', models.DateTimeField(null=True)),
+                ('builds_removed', models.IntegerField(default=0)),
+                ('rows_removed', models.BigIntegerField(default=0)),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cleanup_progress', to='core.Project')),
+            ],
+        ),
+    ]
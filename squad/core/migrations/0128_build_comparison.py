@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0127_cleanup_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildComparison',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('computed_at', models.DateTimeField()),
+                ('regressions', models.TextField(null=True)),
+                ('fixes', models.TextField(null=True)),
+                ('diff', models.TextField(null=True)),
+                ('baseline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Build')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Build')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='buildcomparison',
+            unique_together=set([('baseline', 'target')]),
+        ),
+    ]
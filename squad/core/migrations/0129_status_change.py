@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0128_build_comparison'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('regression', 'Regression'), ('fix', 'Fix')], max_length=10)),
+                ('environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Environment')),
+                ('metadata', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.SuiteMetadata')),
+                ('project', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Project')),
+                ('status', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='core.ProjectStatus')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='statuschange',
+            index=models.Index(fields=['status', 'kind'], name='core_status_status__12ad98_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statuschange',
+            index=models.Index(fields=['project', 'kind', 'status', 'id'], name='core_status_project_28ffe8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statuschange',
+            index=models.Index(fields=['metadata', 'kind', 'status'], name='core_status_metadat_6ba524_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import yaml
+
+
+from squad.core.utils import parse_name
+
+
+def populate_status_changes(apps, schema_editor):
+    ProjectStatus = apps.get_model('core', 'ProjectStatus')
+    StatusChange = apps.get_model('core', 'StatusChange')
+    Environment = apps.get_model('core', 'Environment')
+    SuiteMetadata = apps.get_model('core', 'SuiteMetadata')
+
+    statuses = ProjectStatus.objects.exclude(regressions=None, fixes=None).select_related('build')
+    for status in statuses.iterator():
+        project_id = status.build.project_id
+        environments = {}
+        for environment in Environment.objects.filter(project_id=project_id):
+            environments.setdefault(environment.name or environment.slug, environment)
+
+        changes = []
+        for kind, field in (('regression', status.regressions), ('fix', status.fixes)):
+            if not field:
+                continue
+            for env, tests in yaml.load(field, Loader=yaml.Loader).items():
+                environment = environments.get(env)
+                if environment is None:
+                    continue
+                for test in tests:
+                    suite, name = parse_name(test)
+                    metadata, _ = SuiteMetadata.objects.get_or_create(kind='test', suite=suite, name=name)
+                    changes.append(StatusChange(
+                        status=status,
+                        project_id=project_id,
+                        environment=environment,
+                        metadata=metadata,
+                        kind=kind,
+                    ))
+        StatusChange.objects.bulk_create(changes, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0129_status_change'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            populate_status_changes,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
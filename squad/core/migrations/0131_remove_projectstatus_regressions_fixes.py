@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:46
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0130_populate_status_changes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='projectstatus',
+            name='fixes',
+        ),
+        migrations.RemoveField(
+            model_name='projectstatus',
+            name='regressions',
+        ),
+    ]
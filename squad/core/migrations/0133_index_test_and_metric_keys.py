@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0132_submission_processing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['build', 'metadata'], name='core_metric_build_i_ccdfcf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['environment'], name='core_metric_environ_fa761f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['project'], name='core_metric_project_a4b989_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['environment'], name='core_test_environ_6a55df_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import json
-import yaml
+import sys
+from array import array
 from collections import OrderedDict
 from hashlib import sha1
 import re
@@ -7,7 +8,7 @@ import re
 
 from django.db import models
 from django.db import transaction
-from django.db.models import Q, Count, Sum, Case, When
+from django.db.models import Q, Count, Sum, Case, When, Exists, OuterRef, Subquery
 from django.db.models.query import prefetch_related_objects
 from django.contrib.auth.models import User
 from django.conf import settings
@@ -20,9 +21,10 @@ from django.utils.translation import ugettext as _
 from django.utils.translation import ugettext_lazy as N_
 from simple_history.models import HistoricalRecords
 
-from squad.core.utils import parse_name, join_name, yaml_validator, jinja2_validator
+from squad.core.utils import parse_name, join_name, yaml_validator, jinja2_validator, read_bytes, read_text
+from squad.core import storage
 from squad.core.comparison import TestComparison
-from squad.core.statistics import geomean
+from squad.core.statistics import geomean, log_sum, combine_geomean
 from squad.core.plugins import Plugin
 from squad.core.plugins import PluginListField
 from squad.core.plugins import PluginField
@@ -407,34 +409,32 @@ class Build(models.Model):
 
         # XXX note that by using test_jobs here, we are adding an implicit
         # dependency on squad.ci, what in theory violates our architecture.
-        testjobs = self.test_jobs
-        if testjobs.count() > 0:
-            if testjobs.filter(fetched=False).count() > 0:
-                # a build that has pending CI jobs is NOT finished
-                reasons.append("There are unfinished CI jobs")
-            else:
-                # carry on, and check whether the number of expected test runs
-                # per environment is satisfied.
-                pass
+        pending_testjobs = self.test_jobs.filter(fetched=False)
 
         # builds with no CI jobs are finished when each environment has
         # received the expected amount of test runs
-        testruns = {
-            e.id: {
-                'name': str(e),
-                'expected': e.expected_test_runs,
-                'received': 0
-            }
-            for e in self.project.environments.all()
-        }
-
-        for t in self.test_runs.filter(completed=True).all():
-            testruns[t.environment_id]['received'] += 1
+        received = TestRun.objects.filter(
+            build_id=self.id,
+            environment_id=OuterRef('id'),
+            completed=True,
+        ).order_by().values('environment_id').annotate(n=Count('id')).values('n')
+        environments = self.project.environments.annotate(
+            received=Subquery(received, output_field=models.IntegerField()),
+            pending_testjobs=Exists(pending_testjobs),
+        ).order_by('id')
+        environments = list(environments.values_list('name', 'slug', 'expected_test_runs', 'received', 'pending_testjobs'))
 
-        for env, count in testruns.items():
-            expected = count['expected']
-            received = count['received']
-            env_name = count['name']
+        if environments:
+            pending = environments[0][4]
+        else:
+            pending = pending_testjobs.exists()
+        if pending:
+            # a build that has pending CI jobs is NOT finished
+            reasons.append("There are unfinished CI jobs")
+
+        for name, slug, expected, received, _pending in environments:
+            received = received or 0
+            env_name = name or slug
             if expected == 0:
                 continue
             if received == 0:
@@ -485,6 +485,33 @@ class BuildPlaceholder(models.Model):
         unique_together = ('project', 'version',)
 
 
+class PendingStatusUpdate(models.Model):
+    """
+    Marks a build whose status (ProjectStatus and BuildSummary) needs to be
+    recomputed because new test runs arrived. There is at most one per build,
+    so a burst of test runs leads to a single recomputation.
+    """
+    build = models.OneToOneField(Build, related_name='pending_status_update')
+    first_requested_at = models.DateTimeField()
+    last_requested_at = models.DateTimeField()
+
+
+class CleanupProgress(models.Model):
+    """
+    Tracks the removal of the expired builds of a project (see
+    squad.core.tasks.cleanup_project). ``position`` is the creation date up
+    to which expired builds have been removed in the current pass, and
+    ``running_until`` marks a cleanup that is in progress, so that there is
+    only one at a time for each project.
+    """
+    project = models.OneToOneField(Project, related_name='cleanup_progress')
+    position = models.DateTimeField(null=True)
+    running_until = models.DateTimeField(null=True)
+    last_run_at = models.DateTimeField(null=True)
+    builds_removed = models.IntegerField(default=0)
+    rows_removed = models.BigIntegerField(default=0)
+
+
 class DelayedReport(models.Model):
     build = models.ForeignKey(Build, related_name="delayed_reports")
     baseline = models.ForeignKey('ProjectStatus', related_name="delayed_report_baselines", null=True, blank=True)
@@ -558,6 +585,15 @@ class TestRun(models.Model):
     log_file = models.TextField(null=True)
     metadata_file = models.TextField(null=True)
 
+    # keys of the above files in the blob store, when there is one. See
+    # squad.core.storage.
+    tests_file_blob = models.CharField(max_length=64, null=True)
+    metrics_file_blob = models.CharField(max_length=64, null=True)
+    log_file_blob = models.CharField(max_length=64, null=True)
+    metadata_file_blob = models.CharField(max_length=64, null=True)
+
+    FILES = ('tests_file', 'metrics_file', 'log_file', 'metadata_file')
+
     # custom manager to skip potentially large fields by default
     objects = TestRunManager()
 
@@ -581,9 +617,77 @@ class TestRun(models.Model):
         if not self.datetime:
             self.datetime = timezone.now()
         if self.__metadata__:
-            self.metadata_file = json.dumps(self.__metadata__)
+            self.set_file('metadata_file', json.dumps(self.__metadata__))
         super(TestRun, self).save(*args, **kwargs)
 
+    def set_file(self, name, contents):
+        """
+        Sets the contents of one of the data files (see FILES). They are put
+        in the blob store if there is one, or in the database otherwise.
+        ``contents`` is text, UTF-8 encoded bytes, a binary file-like object
+        with UTF-8 text, or None. File-like objects are streamed into the
+        blob store; only without one are they read into memory.
+        """
+        store = storage.get_store()
+        if contents is None or store is None:
+            setattr(self, name, read_text(contents))
+            setattr(self, name + '_blob', None)
+        else:
+            if isinstance(contents, str):
+                contents = contents.encode('utf-8')
+            key, _ = store.put(contents)
+            setattr(self, name, None)
+            setattr(self, name + '_blob', key)
+
+    def get_file(self, name):
+        """
+        Returns the contents of one of the data files as text, or None.
+        """
+        key = getattr(self, name + '_blob')
+        if key:
+            return storage.get_store().read(key).decode('utf-8')
+        return getattr(self, name)
+
+    def open_file(self, name):
+        """
+        Returns a binary file-like object with the contents of one of the
+        data files. Files in the blob store are streamed from it, and files
+        in the database are read from it a piece at a time (see
+        storage.DatabaseFile); they are never loaded as a whole.
+        """
+        key = getattr(self, name + '_blob')
+        if key:
+            return storage.get_store().open(key)
+        return storage.DatabaseFile(TestRun.objects.filter(pk=self.pk), name)
+
+    def has_file(self, name):
+        if getattr(self, name + '_blob'):
+            return True
+        if name in self.get_deferred_fields():
+            # don't load a potentially very large field just to check it
+            return TestRun.objects.filter(pk=self.pk, **{name + '__isnull': False}).exists()
+        return getattr(self, name) is not None
+
+    def file_info(self, name):
+        """
+        Returns a tuple with the length and a tag that identifies the
+        version of one of the data files (to be used as an ETag), or (None,
+        None) if there is no such file. Neither reads the file: for files in
+        the blob store the tag is their key, and for files in the database
+        the length is computed by the database.
+        """
+        key = getattr(self, name + '_blob')
+        if key:
+            return storage.get_store().size(key), key
+        length = TestRun.objects.filter(pk=self.pk).annotate(
+            file_length=storage.ByteLength(name),
+        ).values_list('file_length', flat=True).get()
+        if length is None:
+            return None, None
+        # files in the database are never changed, only moved to the
+        # blob store, which changes their tag
+        return length, '%s-%d-%d' % (name, self.pk, length)
+
     @property
     def project(self):
         return self.build.project
@@ -593,8 +697,9 @@ class TestRun(models.Model):
     @property
     def metadata(self):
         if self.__metadata__ is None:
-            if self.metadata_file:
-                self.__metadata__ = json.loads(self.metadata_file)
+            metadata_file = self.get_file('metadata_file')
+            if metadata_file:
+                self.__metadata__ = json.loads(metadata_file)
             else:
                 self.__metadata__ = {}
         return self.__metadata__
@@ -606,9 +711,88 @@ class TestRun(models.Model):
 class Attachment(models.Model):
     test_run = models.ForeignKey(TestRun, related_name='attachments')
     filename = models.CharField(null=False, max_length=1024)
-    data = models.BinaryField(default=None)
+    data = models.BinaryField(default=None, null=True)
     length = models.IntegerField(default=None)
 
+    # key of the data in the blob store, when there is one
+    blob = models.CharField(max_length=64, null=True)
+
+    def set_data(self, data):
+        """
+        Sets the attachment contents, from either bytes or a binary file-like
+        object. Like TestRun files, they go to the blob store if there is one.
+        """
+        store = storage.get_store()
+        if store is None:
+            self.data = read_bytes(data)
+            self.length = len(self.data)
+            self.blob = None
+        else:
+            self.blob, self.length = store.put(data)
+            self.data = None
+
+    def open(self):
+        if self.blob:
+            return storage.get_store().open(self.blob)
+        return storage.DatabaseFile(Attachment.objects.filter(pk=self.pk), 'data')
+
+    @property
+    def digest(self):
+        """
+        Tag that identifies the version of the contents, to be used as an
+        ETag, without reading them (see TestRun.file_info).
+        """
+        if self.blob:
+            return self.blob
+        return 'attachment-%d-%d' % (self.pk, self.length)
+
+
+class Submission(models.Model):
+    """
+    A test run submitted for asynchronous processing. The submitted data is
+    kept here until a background worker turns it into a TestRun; after that
+    only the outcome is kept, so that the submitter can poll for it.
+    """
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    project = models.ForeignKey(Project, related_name='submissions')
+    version = models.CharField(max_length=100)
+    environment_slug = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True)
+
+    status = models.CharField(
+        max_length=16,
+        choices=(
+            (QUEUED, N_('Queued')),
+            (PROCESSING, N_('Processing')),
+            (DONE, N_('Done')),
+            (FAILED, N_('Failed')),
+        ),
+        default=QUEUED,
+    )
+    error_message = models.TextField(null=True, blank=True)
+    test_run = models.ForeignKey(TestRun, null=True, related_name='+', on_delete=models.SET_NULL)
+
+    # submitted data, discarded after processing
+    tests_file = models.TextField(null=True)
+    metrics_file = models.TextField(null=True)
+    log_file = models.TextField(null=True)
+    metadata_file = models.TextField(null=True)
+    completed = models.BooleanField(default=True)
+
+    def __str__(self):
+        return '#%d (%s)' % (self.id, self.status)
+
+
+class SubmissionAttachment(models.Model):
+    submission = models.ForeignKey(Submission, related_name='attachments')
+    filename = models.CharField(null=False, max_length=1024)
+    data = models.BinaryField(default=None)
+
 
 class SuiteMetadata(models.Model):
     suite = models.CharField(max_length=256, db_index=True)
@@ -669,6 +853,13 @@ class SuiteVersion(models.Model):
 class Test(models.Model):
     test_run = models.ForeignKey(TestRun, related_name='tests')
     suite = models.ForeignKey(Suite)
+
+    # copied from the test run, so that the most common queries do not need to
+    # join test runs and builds; see the backfill_test_keys command.
+    build = models.ForeignKey(Build, null=True, related_name='+', db_index=False)
+    environment = models.ForeignKey(Environment, null=True, related_name='+', db_index=False)
+    project = models.ForeignKey(Project, null=True, related_name='+', db_index=False)
+
     metadata = models.ForeignKey(
         SuiteMetadata,
         null=True,
@@ -681,6 +872,14 @@ class Test(models.Model):
     known_issues = models.ManyToManyField('KnownIssue')
     has_known_issues = models.NullBooleanField()
 
+    def save(self, *args, **kwargs):
+        # metadata identifies the test across test runs (and projects); it is
+        # what history and comparisons look tests up by
+        if self.metadata_id is None:
+            self.metadata, _ = SuiteMetadata.objects.get_or_create(kind='test', suite=self.suite.slug, name=self.name)
+        set_test_run_keys(self)
+        super(Test, self).save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -727,11 +926,10 @@ class Test(models.Model):
 
         date = self.test_run.build.datetime
         previous_tests = Test.objects.filter(
-            suite=self.suite,
-            name=self.name,
-            test_run__build__datetime__lt=date,
-            test_run__environment=self.test_run.environment,
-        ).exclude(id=self.id).order_by("-test_run__build__datetime")
+            metadata_id=self.metadata_id,
+            environment_id=self.test_run.environment_id,
+            build__datetime__lt=date,
+        ).exclude(id=self.id).order_by("-build__datetime")
         since = None
         count = 0
         last_different = None
@@ -747,6 +945,24 @@ class Test(models.Model):
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['build', 'metadata']),
+            models.Index(fields=['metadata', 'environment', 'build']),
+            models.Index(fields=['project', 'id']),
+            models.Index(fields=['environment']),
+        ]
+
+
+def set_test_run_keys(obj):
+    """
+    Fills in the build, environment and project of a test or metric from its
+    test run.
+    """
+    if obj.build_id is None:
+        test_run = obj.test_run
+        obj.build_id = test_run.build_id
+        obj.environment_id = test_run.environment_id
+        obj.project_id = test_run.build.project_id
 
 
 class MetricManager(models.Manager):
@@ -759,6 +975,12 @@ class MetricManager(models.Manager):
 class Metric(models.Model):
     test_run = models.ForeignKey(TestRun, related_name='metrics')
     suite = models.ForeignKey(Suite)
+
+    # copied from the test run, like in Test
+    build = models.ForeignKey(Build, null=True, related_name='+', db_index=False)
+    environment = models.ForeignKey(Environment, null=True, related_name='+', db_index=False)
+    project = models.ForeignKey(Project, null=True, related_name='+', db_index=False)
+
     metadata = models.ForeignKey(
         SuiteMetadata,
         null=True,
@@ -767,17 +989,46 @@ class Metric(models.Model):
     )
     name = models.CharField(max_length=100)
     result = models.FloatField()
-    measurements = models.TextField()  # comma-separated float numbers
+    measurements = models.BinaryField()  # packed little-endian float64 (see pack_measurements)
     is_outlier = models.BooleanField(default=False)
 
     objects = MetricManager()
 
+    def save(self, *args, **kwargs):
+        if self.metadata_id is None:
+            self.metadata, _ = SuiteMetadata.objects.get_or_create(kind='metric', suite=self.suite.slug, name=self.name)
+        set_test_run_keys(self)
+        super(Metric, self).save(*args, **kwargs)
+
     @property
     def measurement_list(self):
-        if self.measurements:
-            return [float(n) for n in self.measurements.split(',')]
-        else:
-            return []
+        return Metric.parse_measurements(self.measurements).tolist()
+
+    @property
+    def measurement_array(self):
+        return Metric.parse_measurements(self.measurements)
+
+    @staticmethod
+    def pack_measurements(values):
+        data = array('d', values)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        return data.tobytes()
+
+    @staticmethod
+    def parse_measurements(measurements):
+        """
+        Returns the packed measurements as a sequence of floats that supports
+        the buffer protocol (so it can be passed e.g. to numpy.frombuffer).
+        On little-endian machines, the data is not copied.
+        """
+        if not measurements:
+            return memoryview(b'').cast('d')
+        if sys.byteorder == 'big':
+            data = array('d', bytes(measurements))
+            data.byteswap()
+            return memoryview(data)
+        return memoryview(measurements).cast('d')
 
     @property
     def full_name(self):
@@ -786,6 +1037,14 @@ class Metric(models.Model):
     def __str__(self):
         return '%s: %f' % (self.name, self.result)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['metadata', 'environment']),
+            models.Index(fields=['build', 'metadata']),
+            models.Index(fields=['environment']),
+            models.Index(fields=['project']),
+        ]
+
 
 class StatusManager(models.Manager):
 
@@ -888,6 +1147,7 @@ class ProjectStatus(models.Model, TestSummaryBase):
     approved = models.BooleanField(default=False)
 
     metrics_summary = models.FloatField(null=True)
+    metrics_count = models.IntegerField(null=True)
     has_metrics = models.BooleanField(default=False)
 
     tests_pass = models.IntegerField(default=0)
@@ -899,16 +1159,9 @@ class ProjectStatus(models.Model, TestSummaryBase):
     test_runs_completed = models.IntegerField(default=0)
     test_runs_incomplete = models.IntegerField(default=0)
 
-    regressions = models.TextField(
-        null=True,
-        blank=True,
-        validators=[yaml_validator]
-    )
-    fixes = models.TextField(
-        null=True,
-        blank=True,
-        validators=[yaml_validator]
-    )
+    # the build against which regressions and fixes (see StatusChange) were
+    # computed
+    baseline = models.ForeignKey('Build', null=True, related_name='+', on_delete=models.SET_NULL)
 
     class Meta:
         verbose_name_plural = "Project statuses"
@@ -926,20 +1179,9 @@ class ProjectStatus(models.Model, TestSummaryBase):
         test_runs_total = build.test_runs.count()
         test_runs_completed = build.test_runs.filter(completed=True).count()
         test_runs_incomplete = build.test_runs.filter(completed=False).count()
-        regressions = None
-        fixes = None
 
-        previous_build = Build.objects.filter(
-            status__finished=True,
-            datetime__lt=build.datetime,
-            project=build.project,
-        ).order_by('datetime').last()
-        if previous_build is not None:
-            comparison = TestComparison(previous_build, build)
-            if comparison.regressions:
-                regressions = yaml.dump(comparison.regressions)
-            if comparison.fixes:
-                fixes = yaml.dump(comparison.fixes)
+        previous_build = cls.__previous_build__(build)
+        regressions, fixes = cls.__compare__(previous_build, build)
 
         finished, _ = build.finished
         data = {
@@ -948,18 +1190,20 @@ class ProjectStatus(models.Model, TestSummaryBase):
             'tests_xfail': test_summary.tests_xfail,
             'tests_skip': test_summary.tests_skip,
             'metrics_summary': metrics_summary.value,
+            'metrics_count': metrics_summary.count,
             'has_metrics': metrics_summary.has_metrics,
             'last_updated': now,
             'finished': finished,
             'test_runs_total': test_runs_total,
             'test_runs_completed': test_runs_completed,
             'test_runs_incomplete': test_runs_incomplete,
-            'regressions': regressions,
-            'fixes': fixes
+            'baseline': previous_build,
         }
 
         status, created = cls.objects.get_or_create(build=build, defaults=data)
-        if not created and test_summary.tests_total >= status.tests_total:
+        if created:
+            status.__save_changes__(regressions, fixes)
+        elif test_summary.tests_total >= status.tests_total:
             # XXX the test above for the new total number of tests prevents
             # results that arrived earlier, but are only being processed now,
             # from overwriting a ProjectStatus created by results that arrived
@@ -969,19 +1213,98 @@ class ProjectStatus(models.Model, TestSummaryBase):
             status.tests_xfail = test_summary.tests_xfail
             status.tests_skip = test_summary.tests_skip
             status.metrics_summary = metrics_summary.value
+            status.metrics_count = metrics_summary.count
             status.has_metrics = metrics_summary.has_metrics
             status.last_updated = now
-            finished, _ = build.finished
             status.finished = finished
             status.build = build
             status.test_runs_total = test_runs_total
             status.test_runs_completed = test_runs_completed
             status.test_runs_incomplete = test_runs_incomplete
-            status.regressions = regressions
-            status.fixes = fixes
+            status.baseline = previous_build
+            status.save()
+            status.__save_changes__(regressions, fixes)
+        return status
+
+    @classmethod
+    def add_test_run(cls, testrun):
+        """
+        Updates the ProjectStatus of the build of a test run that has just
+        been received, by adding the results of that test run to the stored
+        counters instead of recomputing them over the whole build. Regressions
+        and fixes are only recomputed for the environment of the test run.
+
+        Falls back to create_or_update() when that is not possible, e.g. if
+        the test run repeats tests from previous test runs in the same
+        environment, or if the stored status does not account for all of the
+        previous test runs in the build.
+        """
+        build = testrun.build
+        with transaction.atomic():
+            status, _ = cls.objects.select_for_update().get_or_create(build=build)
+            delta = TestRunDelta(testrun)
+            if not delta.applies_to(status, build.test_runs):
+                return cls.create_or_update(build)
+
+            delta.apply(status)
+            status.last_updated = timezone.now()
+            status.finished, _ = build.finished
+
+            previous_build = cls.__previous_build__(build)
+            if previous_build is not None and previous_build.id == status.baseline_id:
+                environment = testrun.environment
+            else:
+                environment = None
+            regressions, fixes = cls.__compare__(previous_build, build, environment)
+            status.baseline = previous_build
             status.save()
+            status.__save_changes__(regressions, fixes, environment)
         return status
 
+    @staticmethod
+    def __previous_build__(build):
+        return Build.objects.filter(
+            status__finished=True,
+            datetime__lt=build.datetime,
+            project=build.project,
+        ).order_by('datetime').last()
+
+    @staticmethod
+    def __compare__(previous_build, build, environment=None):
+        """
+        Returns the regressions and fixes in ``build`` relative to
+        ``previous_build``, as lists of (environment id, test metadata id)
+        pairs. If ``environment`` is given, only that environment is
+        compared.
+        """
+        if previous_build is None:
+            return [], []
+
+        environments = environment and [environment] or None
+        comparison = TestComparison(previous_build, build, environments=environments)
+        return comparison.changed_tests(regressions=True), comparison.changed_tests(regressions=False)
+
+    def __save_changes__(self, regressions, fixes, environment=None):
+        """
+        Replaces the stored regressions and fixes with the given ones (see
+        __compare__); if ``environment`` is given, only the ones in that
+        environment.
+        """
+        project_id = self.build.project_id
+        with transaction.atomic():
+            changes = StatusChange.objects.filter(status=self)
+            if environment is not None:
+                changes = changes.filter(environment=environment)
+            changes.delete()
+            StatusChange.objects.bulk_create(
+                [
+                    StatusChange(status=self, project_id=project_id, environment_id=environment_id, metadata_id=metadata_id, kind=kind)
+                    for kind, tests in ((StatusChange.REGRESSION, regressions), (StatusChange.FIX, fixes))
+                    for environment_id, metadata_id in tests
+                ],
+                batch_size=500,
+            )
+
     def __str__(self):
         return "%s, build %s" % (self.build.project, self.build.version)
 
@@ -992,16 +1315,24 @@ class ProjectStatus(models.Model, TestSummaryBase):
             build__project=self.build.project,
         ).order_by('build__datetime').last()
 
-    def __get_yaml_field__(self, field_value):
-        if field_value is not None:
-            return yaml.load(field_value, Loader=yaml.Loader)
-        return {}
+    def __get_changes__(self, kind):
+        changes = {}
+        for change in self.changes.all():
+            if change.kind == kind:
+                changes.setdefault(str(change.environment), set()).add(change.full_name)
+        return OrderedDict((env, sorted(tests)) for env, tests in sorted(changes.items()))
 
     def get_regressions(self):
-        return self.__get_yaml_field__(self.regressions)
+        """
+        Returns the regressions in this build, as a dictionary with the
+        names of the tests that regressed in each environment, like
+        TestComparison.regressions. For large numbers of regressions, or to
+        paginate them, use ``changes`` directly.
+        """
+        return self.__get_changes__(StatusChange.REGRESSION)
 
     def get_fixes(self):
-        return self.__get_yaml_field__(self.fixes)
+        return self.__get_changes__(StatusChange.FIX)
 
     def get_exceeded_thresholds(self):
         # Return a list of all (threshold, metric) objects for those
@@ -1023,6 +1354,106 @@ class ProjectStatus(models.Model, TestSummaryBase):
         return thresholds_exceeded
 
 
+class StatusChangeManager(models.Manager):
+
+    def get_queryset(self):
+        return super(StatusChangeManager, self).get_queryset().select_related('environment', 'metadata')
+
+    def feed(self, project, kind='regression'):
+        """
+        Returns the regressions (or fixes) in all builds of ``project``,
+        most recent first.
+        """
+        return self.filter(project=project, kind=kind).select_related('status__build').order_by('-status_id', '-id')
+
+
+class StatusChange(models.Model):
+    """
+    A regression or a fix of a test in an environment, in the build of a
+    ProjectStatus relative to its baseline.
+    """
+    REGRESSION = 'regression'
+    FIX = 'fix'
+    KINDS = (
+        (REGRESSION, N_('Regression')),
+        (FIX, N_('Fix')),
+    )
+
+    status = models.ForeignKey(ProjectStatus, related_name='changes', db_index=False)
+    # copied from the build, for the project-wide feed
+    project = models.ForeignKey(Project, related_name='+', db_index=False)
+    environment = models.ForeignKey(Environment, related_name='+')
+    metadata = models.ForeignKey(SuiteMetadata, related_name='+', db_index=False)
+    kind = models.CharField(max_length=10, choices=KINDS)
+
+    objects = StatusChangeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'kind']),
+            models.Index(fields=['project', 'kind', 'status', 'id']),
+            models.Index(fields=['metadata', 'kind', 'status']),
+        ]
+
+    @property
+    def full_name(self):
+        return join_name(self.metadata.suite, self.metadata.name)
+
+
+class BuildComparison(models.Model):
+    """
+    Persistent store for the comparison of a build against its baseline
+    (see TestComparison.between), so that it is computed only once, and not
+    once by each user of it (notifications, reports etc). Only pairs in
+    which both builds have a ProjectStatus are stored; ad-hoc comparisons
+    are never persisted.
+
+    Regressions, fixes and the diff are stored as JSON, each one as soon as
+    it is first needed. They are discarded when the status of either build
+    is updated after ``computed_at``.
+    """
+    baseline = models.ForeignKey(Build, related_name='+')
+    target = models.ForeignKey(Build, related_name='+')
+    computed_at = models.DateTimeField()
+    regressions = models.TextField(null=True)
+    fixes = models.TextField(null=True)
+    diff = models.TextField(null=True)
+
+    class Meta:
+        unique_together = ('baseline', 'target')
+
+    @classmethod
+    def get(cls, baseline, target):
+        """
+        Returns the stored comparison of ``target`` against ``baseline``,
+        emptied if it is out of date, or None if the pair is not to be stored
+        because either build has no status yet. Nothing is written when the
+        stored comparison is up to date.
+        """
+        builds = set([baseline.id, target.id])
+        last_updated = list(
+            ProjectStatus.objects.filter(build_id__in=builds).values_list('last_updated', flat=True)
+        )
+        if len(last_updated) < len(builds) or None in last_updated:
+            return None
+
+        now = timezone.now()
+        stored = cls.objects.filter(baseline=baseline, target=target).first()
+        if stored is None:
+            stored, _ = cls.objects.get_or_create(
+                baseline=baseline,
+                target=target,
+                defaults={'computed_at': now},
+            )
+        elif max(last_updated) > stored.computed_at:
+            stored.computed_at = now
+            stored.regressions = None
+            stored.fixes = None
+            stored.diff = None
+            stored.save()
+        return stored
+
+
 class NotificationDelivery(models.Model):
 
     status = models.ForeignKey('ProjectStatus', related_name='deliveries')
@@ -1054,43 +1485,64 @@ class InvalidTestStatus(Exception):
 
 
 class TestSummary(TestSummaryBase):
-    def __init__(self, build, environment=None):
-        self.tests_pass = 0
-        self.tests_fail = 0
-        self.tests_xfail = 0
-        self.tests_skip = 0
-        self.failures = OrderedDict()
+    """
+    Test counts for a build (or for one environment in it). Each test is
+    counted once per environment, with the result from the latest test run
+    winning. The counting is done by the database, so the tests are never
+    loaded into memory; the failures are only loaded when accessed.
+    """
 
-        query_set = build.test_runs
+    def __init__(self, build, environment=None):
+        tests = Test.objects.filter(test_run__build_id=build.id)
         if environment:
-            query_set = query_set.filter(environment=environment)
-        test_runs = query_set.prefetch_related(
-            'environment',
-            'tests',
-            'tests__suite'
-        ).order_by('id')
+            tests = tests.filter(test_run__environment_id=environment.id)
+
+        newer = Test.objects.filter(
+            test_run__build_id=build.id,
+            test_run__environment_id=OuterRef('test_run__environment_id'),
+            suite_id=OuterRef('suite_id'),
+            name=OuterRef('name'),
+        ).filter(Q(test_run_id__gt=OuterRef('test_run_id')) | Q(test_run_id=OuterRef('test_run_id'), id__gt=OuterRef('id')))
+        self.tests = tests.annotate(superseded=Exists(newer)).filter(superseded=False)
+
+        counts = self.tests.aggregate(
+            tests_pass=Count(Case(When(result=True, then=1))),
+            tests_fail=Count(Case(When(Q(result=False) & ~Q(has_known_issues=True), then=1))),
+            tests_xfail=Count(Case(When(result=False, has_known_issues=True, then=1))),
+            tests_skip=Count(Case(When(result=None, then=1))),
+        )
+        self.tests_pass = counts['tests_pass']
+        self.tests_fail = counts['tests_fail']
+        self.tests_xfail = counts['tests_xfail']
+        self.tests_skip = counts['tests_skip']
 
-        tests = OrderedDict()
-        for run in test_runs.all():
-            for test in run.tests.all():
-                tests[(run.environment, test.suite, test.name)] = test
-
-        for context, test in tests.items():
-            if test.status == 'pass':
-                self.tests_pass += 1
-            elif test.status == 'fail':
-                self.tests_fail += 1
-            elif test.status == 'xfail':
-                self.tests_xfail += 1
-            elif test.status == 'skip':
-                self.tests_skip += 1
-            else:
-                raise InvalidTestStatus(test.status)
-            if test.status == 'fail':
+    @property
+    def failing_tests(self):
+        """
+        The failing tests, as a queryset that can be sliced to get the
+        failures one page at a time.
+        """
+        return self.tests.filter(
+            Q(result=False) & ~Q(has_known_issues=True)
+        ).select_related('suite').prefetch_related(
+            'test_run',
+            'test_run__environment',
+        ).order_by('test_run_id', 'name', 'id')
+
+    __failures__ = None
+
+    @property
+    def failures(self):
+        """
+        The failing tests, grouped by environment slug.
+        """
+        if self.__failures__ is None:
+            failures = OrderedDict()
+            for test in self.failing_tests:
                 env = test.test_run.environment.slug
-                if env not in self.failures:
-                    self.failures[env] = []
-                self.failures[env].append(test)
+                failures.setdefault(env, []).append(test)
+            self.__failures__ = failures
+        return self.__failures__
 
 
 class MetricsSummary(object):
@@ -1102,6 +1554,7 @@ class MetricsSummary(object):
         metrics = queryset.all()
         values = [m.result for m in metrics]
         self.value = geomean(values)
+        self.count, _ = log_sum(values)
         self.has_metrics = len(values) > 0
 
 
@@ -1109,6 +1562,7 @@ class BuildSummary(models.Model, TestSummaryBase):
     build = models.ForeignKey(Build, related_name='metrics_summary')
     environment = models.ForeignKey(Environment)
     metrics_summary = models.FloatField(null=True)
+    metrics_count = models.IntegerField(null=True)
     has_metrics = models.BooleanField(default=False)
 
     tests_pass = models.IntegerField(default=0)
@@ -1134,6 +1588,7 @@ class BuildSummary(models.Model, TestSummaryBase):
 
         data = {
             'metrics_summary': metrics_summary.value,
+            'metrics_count': metrics_summary.count,
             'has_metrics': metrics_summary.has_metrics,
             'tests_pass': test_summary.tests_pass,
             'tests_fail': test_summary.tests_fail,
@@ -1147,6 +1602,7 @@ class BuildSummary(models.Model, TestSummaryBase):
         summary, created = cls.objects.get_or_create(build=build, environment=environment, defaults=data)
         if not created:
             summary.metrics_summary = metrics_summary.value
+            summary.metrics_count = metrics_summary.count
             summary.has_metrics = metrics_summary.has_metrics
             summary.tests_pass = test_summary.tests_pass
             summary.tests_fail = test_summary.tests_fail
@@ -1158,6 +1614,100 @@ class BuildSummary(models.Model, TestSummaryBase):
             summary.save()
         return summary
 
+    @classmethod
+    def add_test_run(cls, testrun):
+        """
+        Updates the BuildSummary for the build/environment of a test run that
+        has just been received, by adding the results of that test run to the
+        stored counters. Falls back to create_or_update() under the same
+        conditions as ProjectStatus.add_test_run().
+        """
+        build = testrun.build
+        environment = testrun.environment
+        with transaction.atomic():
+            summary, _ = cls.objects.select_for_update().get_or_create(build=build, environment=environment)
+            delta = TestRunDelta(testrun)
+            if not delta.applies_to(summary, build.test_runs.filter(environment=environment)):
+                return cls.create_or_update(build, environment)
+            delta.apply(summary)
+            summary.save()
+        return summary
+
+
+class TestRunDelta(object):
+    """
+    The contribution of a single test run to the summaries of its build: the
+    test counts from its overall Status, and the metric values in a form that
+    can be folded into a geometric mean.
+    """
+
+    def __init__(self, testrun):
+        self.testrun = testrun
+        self.tests_pass = 0
+        self.tests_fail = 0
+        self.tests_xfail = 0
+        self.tests_skip = 0
+
+        status = testrun.status.filter(suite=None).first()
+        if status:
+            self.tests_pass = status.tests_pass
+            self.tests_fail = status.tests_fail
+            self.tests_xfail = status.tests_xfail
+            self.tests_skip = status.tests_skip
+
+        values = list(testrun.metrics.values_list('result', flat=True))
+        self.has_metrics = len(values) > 0
+        self.metrics_count, self.metrics_log_sum = log_sum(values)
+
+    def applies_to(self, summary, test_runs):
+        """
+        Returns whether this delta can be added to ``summary``, which must
+        account for all of the test runs in ``test_runs`` except this one.
+
+        Test summaries only count each test once per environment, with the
+        latest result winning, so the delta can't be used if the test run
+        repeats tests from other test runs in the same environment, or
+        contains repeated tests itself.
+        """
+        if not self.testrun.status_recorded:
+            return False
+        if summary.test_runs_total != test_runs.count() - 1:
+            return False
+        if summary.metrics_count is None and summary.test_runs_total > 0:
+            # stored before metrics_count existed
+            return False
+
+        tests = self.testrun.tests
+        repeated = tests.values('suite_id', 'name').annotate(n=Count('id')).filter(n__gt=1)
+        if repeated.exists():
+            return False
+        previous = Test.objects.filter(
+            test_run__build_id=self.testrun.build_id,
+            test_run__environment_id=self.testrun.environment_id,
+            suite_id=OuterRef('suite_id'),
+            name=OuterRef('name'),
+        ).exclude(test_run_id=self.testrun.id)
+        return not tests.annotate(seen=Exists(previous)).filter(seen=True).exists()
+
+    def apply(self, summary):
+        summary.tests_pass += self.tests_pass
+        summary.tests_fail += self.tests_fail
+        summary.tests_xfail += self.tests_xfail
+        summary.tests_skip += self.tests_skip
+        summary.metrics_summary = combine_geomean(
+            summary.metrics_summary,
+            summary.metrics_count or 0,
+            self.metrics_count,
+            self.metrics_log_sum,
+        )
+        summary.metrics_count = (summary.metrics_count or 0) + self.metrics_count
+        summary.has_metrics = summary.has_metrics or self.has_metrics
+        summary.test_runs_total += 1
+        if self.testrun.completed:
+            summary.test_runs_completed += 1
+        else:
+            summary.test_runs_incomplete += 1
+
 
 class Subscription(models.Model):
     project = models.ForeignKey(Project, related_name='subscriptions')
@@ -31,10 +31,10 @@ class Notification(object):
     @property
     def comparison(self):
         if self.__comparison__ is None:
-            self.__comparison__ = TestComparison.compare_builds(
-                self.previous_build,
-                self.build,
-            )
+            if self.previous_build is None:
+                self.__comparison__ = TestComparison.compare_builds(self.build)
+            else:
+                self.__comparison__ = TestComparison.between(self.previous_build, self.build)
         return self.__comparison__
 
     @property
@@ -56,9 +56,13 @@ class Notification(object):
     def important_metadata(self):
         return self.build.important_metadata
 
+    __summary__ = None
+
     @property
     def summary(self):
-        return self.build.test_summary
+        if self.__summary__ is None:
+            self.__summary__ = self.build.test_summary
+        return self.__summary__
 
     @property
     def recipients(self):
@@ -0,0 +1,233 @@
+"""
+Removal of the data of builds older than the data retention period of their
+project (see Project.data_retention_days).
+
+Deleting a build through the ORM loads every one of its tests, metrics and
+statuses into memory before deleting them one batch at a time, which does
+not scale to builds with hundreds of thousands of tests, let alone to all the
+builds of a project for a whole period. Here the per-test data is instead
+removed with set-based DELETE statements of a bounded number of rows each,
+every one in its own transaction, and only the builds and test runs
+themselves, which are few, go through the ORM.
+
+Builds are grouped in periods according to their creation date. Whole
+periods in which all builds have expired are removed together; the builds
+in the period that is only partially expired are removed individually.
+Either way, removal can be interrupted and resumed.
+"""
+
+from collections import OrderedDict
+
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+from squad.core.models import (
+    Attachment,
+    Build,
+    BuildPlaceholder,
+    Metric,
+    Status,
+    Test,
+    TestRun,
+)
+from squad.core.utils import split_list
+
+
+# length of the periods in which builds are removed together
+PERIOD = timezone.timedelta(days=1)
+
+# maximum number of objects handled by a single query
+BATCH_SIZE = 500
+
+# maximum number of rows deleted by a single transaction
+DELETE_BATCH_SIZE = 10000
+
+
+def period_start(date):
+    """
+    Returns the start of the period that contains ``date``.
+    """
+    date = date.astimezone(timezone.utc)
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def __quote__(name):
+    return connection.ops.quote_name(name)
+
+
+def __dependents__(test_runs):
+    """
+    Returns the tables holding the data of the given test runs (a queryset
+    of their ids), as (model, column, subquery) tuples, where the subquery
+    selects the values of ``column`` in the rows to delete. They are listed
+    in the order in which they must be deleted.
+    """
+    test_runs_sql, params = test_runs.query.sql_with_params()
+
+    tests_sql = 'SELECT %s FROM %s WHERE %s IN (%s)' % (
+        __quote__(Test._meta.pk.column),
+        __quote__(Test._meta.db_table),
+        __quote__(Test._meta.get_field('test_run').column),
+        test_runs_sql,
+    )
+    known_issues = Test.known_issues.through
+    dependents = [
+        (known_issues, known_issues._meta.get_field('test').column, tests_sql),
+    ]
+    for model in (Test, Metric, Status, Attachment):
+        dependents.append((model, model._meta.get_field('test_run').column, test_runs_sql))
+    return dependents, params
+
+
+def __batch_delete_statements__(test_runs, batch_size):
+    """
+    Returns the statements that delete the data of the given test runs, as
+    (model, sql, params) tuples, in the order in which they must be
+    executed. Each statement only deletes up to ``batch_size`` rows, so
+    each one must be repeated until it deletes less than that. The ids to
+    delete are selected through a derived table, since MySQL supports
+    neither LIMIT in IN subqueries nor subqueries over the table being
+    deleted from.
+    """
+    dependents, params = __dependents__(test_runs)
+    statements = []
+    for model, column, subquery in dependents:
+        table = __quote__(model._meta.db_table)
+        pk = __quote__(model._meta.pk.column)
+        sql = 'DELETE FROM %s WHERE %s IN (SELECT %s FROM (SELECT %s FROM %s WHERE %s IN (%s) LIMIT %d) AS batch)' % (
+            table,
+            pk,
+            pk,
+            pk,
+            table,
+            __quote__(column),
+            subquery,
+            batch_size,
+        )
+        statements.append((model, sql, params))
+    return statements
+
+
+def __delete_objects__(builds, deleted):
+    _, objects = builds.delete()
+    for model in (TestRun, Build):
+        deleted[model] = objects.get(model._meta.label, 0)
+
+
+class Budget(object):
+    """
+    How much a deletion may still do: a number of rows and/or a deadline.
+    Either can be None, for no limit.
+    """
+
+    def __init__(self, rows=None, deadline=None):
+        self.rows = rows
+        self.deadline = deadline
+
+    def spend(self, rows):
+        if self.rows is not None:
+            self.rows -= rows
+
+    @property
+    def exhausted(self):
+        if self.rows is not None and self.rows <= 0:
+            return True
+        return self.deadline is not None and timezone.now() >= self.deadline
+
+
+def __delete_data__(test_runs, batch_size, progress, budget):
+    """
+    Deletes the data of the given test runs (a queryset of their ids),
+    table by table, children first, in batches of at most ``batch_size``
+    rows, each one in its own transaction. Stops between batches once
+    ``budget`` is exhausted. Returns a dictionary with the number of rows
+    deleted for each model, and whether all the data is gone.
+    """
+    deleted = OrderedDict()
+    for model, sql, params in __batch_delete_statements__(test_runs, batch_size):
+        deleted[model] = 0
+        while True:
+            if budget and budget.exhausted:
+                return deleted, False
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                count = cursor.rowcount
+            deleted[model] += count
+            if budget:
+                budget.spend(count)
+            if progress and count:
+                progress(model, deleted[model])
+            if count < batch_size:
+                break
+    return deleted, True
+
+
+def delete_builds(builds, batch_size=DELETE_BATCH_SIZE, progress=None, budget=None):
+    """
+    Deletes the given builds (a queryset) together with all their data, and
+    leaves a placeholder for each of them so that their versions are not
+    reused. The data is deleted in batches, like in delete_build, and
+    ``progress`` and ``budget`` work the same way. Returns a dictionary with
+    the number of rows deleted for each model.
+    """
+    build_ids = builds.order_by().values('id')
+    test_runs = TestRun.objects.filter(build_id__in=build_ids).order_by().values('id')
+    deleted, complete = __delete_data__(test_runs, batch_size, progress, budget)
+    if not complete:
+        return deleted
+
+    with transaction.atomic():
+        entries = list(builds.order_by().values_list('id', 'project_id', 'version'))
+        placeholders = []
+        for chunk in split_list(entries, BATCH_SIZE):
+            existing = set(
+                BuildPlaceholder.objects.filter(
+                    project_id__in=set(project_id for _, project_id, _ in chunk),
+                    version__in=[version for _, _, version in chunk],
+                ).values_list('project_id', 'version')
+            )
+            placeholders += [
+                BuildPlaceholder(project_id=project_id, version=version)
+                for _, project_id, version in chunk
+                if (project_id, version) not in existing
+            ]
+        BuildPlaceholder.objects.bulk_create(placeholders, batch_size=BATCH_SIZE)
+
+        # only builds and test runs are left, plus the few objects attached
+        # to them (statuses, summaries, jobs etc), which the ORM takes care of
+        __delete_objects__(Build.objects.filter(id__in=[build_id for build_id, _, _ in entries]), deleted)
+
+    return deleted
+
+
+def delete_build(build, batch_size=DELETE_BATCH_SIZE, progress=None, budget=None):
+    """
+    Deletes a build together with all its data, leaving a placeholder for
+    it, like deleting it through the ORM would, but without ever loading its
+    tests, metrics etc into memory.
+
+    The data of the build is deleted table by table, children first, in
+    batches of at most ``batch_size`` rows, each one in its own
+    transaction, so that no single transaction gets too large. If this is
+    interrupted, calling it again picks up where it stopped. The build
+    itself and its placeholder are only deleted/created at the very end.
+
+    If given, ``progress`` is called after each batch with the model of
+    the rows deleted, and the number of them deleted so far. If given,
+    ``budget`` (a Budget) is charged with the rows of each batch, and once
+    it is exhausted no further batches are run; the build is then left in
+    place, and the returned dictionary has no entry for Build. Returns a
+    dictionary with the number of rows deleted for each model.
+    """
+    test_runs = TestRun.objects.filter(build_id=build.id).order_by().values('id')
+    deleted, complete = __delete_data__(test_runs, batch_size, progress, budget)
+    if not complete:
+        return deleted
+
+    with transaction.atomic():
+        BuildPlaceholder.objects.create(project_id=build.project_id, version=build.version)
+        __delete_objects__(Build.objects.filter(id=build.id), deleted)
+
+    return deleted
@@ -28,3 +28,29 @@ def geomean(values):
     for v in values:
         log_sum = log_sum + log(v)
     return exp(log_sum / n)
+
+
+def log_sum(values):
+    """
+    Returns the number of values taken into account by geomean(), and the sum
+    of their logarithms. Together with combine_geomean(), this allows updating
+    a geometric mean as new values arrive, without going over the old ones
+    again.
+    """
+    values = [v for v in values if v > 0]
+    return len(values), sum(log(v) for v in values)
+
+
+def combine_geomean(value, count, new_count, new_log_sum):
+    """
+    Returns the geometric mean of ``count`` values whose geometric mean is
+    ``value``, plus ``new_count`` values the sum of whose logarithms is
+    ``new_log_sum``.
+    """
+    n = count + new_count
+    if n == 0:
+        return 0
+    total = new_log_sum
+    if count > 0:
+        total += count * log(value)
+    return exp(total / n)
@@ -0,0 +1,302 @@
+"""
+Content-addressed storage for large test run data (logs, raw tests/metrics/
+metadata files, and attachments).
+
+Blobs are identified by the SHA-256 of their (uncompressed) contents, so
+storing the same data twice, e.g. identical boot logs, only keeps one copy.
+Database rows only keep the blob key.
+
+The storage backend is selected by the SQUAD_BLOB_STORE setting, which holds
+the dotted path of a BlobStore subclass. When it is not set, data is kept in
+the database as before; DatabaseFile then reads it a piece at a time.
+"""
+
+import gzip
+import hashlib
+import os
+import struct
+import tempfile
+import time
+
+
+from django.conf import settings
+from django.db.models import BinaryField, Func, IntegerField, Value
+from django.utils.module_loading import import_string
+
+
+CHUNK_SIZE = 64 * 1024
+
+# the gzip trailer only has the uncompressed length modulo 2^32
+GZIP_MAX_SIZE = 2 ** 32
+
+
+class BlobStore(object):
+    """
+    Base class for blob stores. Subclasses must implement all the methods
+    below.
+    """
+
+    def put(self, data):
+        """
+        Stores ``data``, which can be a bytes object or a binary file-like
+        object, and returns a tuple with the key of the blob, and its
+        (uncompressed) length.
+        """
+        raise NotImplementedError
+
+    def open(self, key):
+        """
+        Returns a binary file-like object from which the contents of the
+        blob can be read.
+        """
+        raise NotImplementedError
+
+    def size(self, key):
+        """
+        Returns the (uncompressed) length of the blob.
+        """
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def keys(self, older_than=None):
+        """
+        Iterates over the keys of all stored blobs; if ``older_than`` (in
+        seconds) is given, only over those stored longer ago than that.
+        """
+        raise NotImplementedError
+
+    def stored_at(self, key):
+        """
+        Returns the time (a timestamp) at which the blob was stored, or
+        stored again, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Stores gzip-compressed blobs in the local directory given by the
+    SQUAD_BLOB_STORE_DIR setting. All processes (web and workers) must see
+    the same directory.
+
+    The length of a blob is read from the gzip trailer, which can only hold
+    lengths below 4GiB; the length of larger blobs is recorded in a separate
+    ``.size`` file next to them.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.SQUAD_BLOB_STORE_DIR
+
+    def __path__(self, key):
+        return os.path.join(self.directory, key[0:2], key[2:4], key + '.gz')
+
+    def __size_path__(self, key):
+        return os.path.join(self.directory, key[0:2], key[2:4], key + '.size')
+
+    def put(self, data):
+        if not hasattr(data, 'read'):
+            data = BytesReader(data)
+
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        length = 0
+        tmp = tempfile.NamedTemporaryFile(dir=self.directory, prefix='.tmp', delete=False)
+        try:
+            with gzip.GzipFile(fileobj=tmp, mode='wb') as compressed:
+                while True:
+                    chunk = data.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    length += len(chunk)
+                    compressed.write(chunk)
+            tmp.close()
+
+            key = digest.hexdigest()
+            path = self.__path__(key)
+            if os.path.exists(path):
+                os.unlink(tmp.name)
+                # refresh the timestamp so that the blob is not garbage
+                # collected while the new reference to it is being created
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if length >= GZIP_MAX_SIZE:
+                    # before the blob itself, so that it is never seen
+                    # without it
+                    with open(self.__size_path__(key), 'w') as f:
+                        f.write(str(length))
+                os.replace(tmp.name, path)
+        except BaseException:
+            tmp.close()
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+            raise
+
+        return key, length
+
+    def open(self, key):
+        return gzip.open(self.__path__(key), 'rb')
+
+    def size(self, key):
+        try:
+            with open(self.__size_path__(key)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            pass
+        # the gzip trailer ends with the uncompressed length
+        with open(self.__path__(key), 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            return struct.unpack('<I', f.read(4))[0]
+
+    def exists(self, key):
+        return os.path.exists(self.__path__(key))
+
+    def delete(self, key):
+        for path in (self.__path__(key), self.__size_path__(key)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def stored_at(self, key):
+        try:
+            return os.path.getmtime(self.__path__(key))
+        except FileNotFoundError:
+            return None
+
+    def keys(self, older_than=None):
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for f in files:
+                if f.startswith('.') or not f.endswith('.gz'):
+                    continue
+                if older_than is not None:
+                    mtime = os.path.getmtime(os.path.join(root, f))
+                    if now - mtime < older_than:
+                        continue
+                yield f[:-len('.gz')]
+
+
+class BytesReader(object):
+    """
+    Minimal file-like wrapper around a bytes object that does not copy it.
+    """
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.data) - self.position
+        chunk = self.data[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk.tobytes()
+
+
+class ByteLength(Func):
+    """
+    Length in bytes of a text or binary column, computed by the database.
+    """
+    function = 'LENGTH'
+    output_field = IntegerField()
+
+    def as_postgresql(self, compiler, connection):
+        return self.as_sql(compiler, connection, function='OCTET_LENGTH')
+
+    def as_sqlite(self, compiler, connection):
+        return self.as_sql(compiler, connection, template='LENGTH(CAST(%(expressions)s AS BLOB))')
+
+
+class ByteSubstr(Func):
+    """
+    The ``length`` bytes of a text or binary column that start at
+    ``position`` (counting from 1), extracted by the database.
+    """
+    output_field = BinaryField()
+
+    def __init__(self, expression, position, length):
+        super(ByteSubstr, self).__init__(expression, Value(position), Value(length))
+
+    def __compile__(self, compiler, template):
+        column, position, length = self.source_expressions
+        sql, params = compiler.compile(column)
+        return template % sql, list(params) + [position.value, length.value]
+
+    def as_sql(self, compiler, connection):
+        return self.__compile__(compiler, 'SUBSTRING(CAST(%s AS BINARY), %%s, %%s)')
+
+    def as_sqlite(self, compiler, connection):
+        return self.__compile__(compiler, 'SUBSTR(CAST(%s AS BLOB), %%s, %%s)')
+
+    def as_postgresql(self, compiler, connection):
+        if self.source_expressions[0].output_field.get_internal_type() == 'BinaryField':
+            return self.__compile__(compiler, 'SUBSTRING(%s FROM %%s FOR %%s)')
+        return self.__compile__(compiler, "SUBSTRING(CONVERT_TO(%s, 'UTF8') FROM %%s FOR %%s)")
+
+
+class DatabaseFile(object):
+    """
+    Read-only binary file-like object over a text or binary column of the
+    single row selected by ``queryset``, that only ever fetches the pieces
+    that are actually read, so that large files kept in the database are
+    never loaded into memory as a whole.
+    """
+
+    def __init__(self, queryset, field):
+        self.queryset = queryset
+        self.field = field
+        self.position = 0
+
+    def seek(self, position):
+        self.position = position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        chunk = self.queryset.annotate(
+            file_chunk=ByteSubstr(self.field, self.position + 1, size),
+        ).values_list('file_chunk', flat=True).get()
+        chunk = bytes(chunk or b'')
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+__stores__ = {}
+
+
+def get_store():
+    """
+    Returns the configured blob store, or None if there is none.
+    """
+    path = settings.SQUAD_BLOB_STORE
+    if not path:
+        return None
+    key = (path, settings.SQUAD_BLOB_STORE_DIR)
+    if key not in __stores__:
+        __stores__[key] = import_string(path)()
+    return __stores__[key]
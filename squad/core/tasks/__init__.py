@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned
 from django.utils import timezone
 from collections import defaultdict
@@ -8,11 +9,15 @@ import uuid
 import yaml
 
 
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Case, When, Q
 
 
 from squad.celery import app as celery
+from squad.core import cache
+from squad.core import retention
 from squad.core.models import (
+    Attachment,
     TestRun,
     Suite,
     SuiteVersion,
@@ -23,16 +28,19 @@ from squad.core.models import (
     ProjectStatus,
     KnownIssue,
     Build,
-    BuildPlaceholder,
     BuildSummary,
+    CleanupProgress,
+    Environment,
+    PendingStatusUpdate,
     Project,
-    DelayedReport
+    DelayedReport,
+    Submission,
 )
 from squad.core.data import JSONTestDataParser, JSONMetricDataParser
 from squad.core.statistics import geomean
 from squad.core.notification import Notification
 from squad.core.plugins import apply_plugins
-from squad.core.utils import join_name
+from squad.core.utils import join_name, split_list, read_bytes, read_text, strip_nul
 from rest_framework import status
 from jinja2 import TemplateSyntaxError
 from . import exceptions
@@ -50,17 +58,40 @@ metric_parser = JSONMetricDataParser
 logger = logging.getLogger()
 
 
+# maximum number of objects handled by a single query during ingestion. Keeps
+# us below the limit of 999 parameters per statement in SQLite.
+BATCH_SIZE = 500
+
+
+class TestRunData(object):
+    """
+    The decoded contents of the JSON files of a test run submission, as
+    returned by ValidateTestRun. Each file is decoded only once; the decoded
+    data is then used both to create the test run and to parse its tests and
+    metrics, while the original text is only kept for storage.
+    """
+
+    def __init__(self, metadata=None, metrics=None, tests=None):
+        self.metadata = metadata
+        self.metrics = metrics
+        self.tests = tests
+
+
 class ValidateTestRun(object):
 
     def __call__(self, metadata_file=None, metrics_file=None, tests_file=None):
+        data = TestRunData()
+
         if metadata_file:
-            self.__validate_metadata__(metadata_file)
+            data.metadata = self.__validate_metadata__(metadata_file)
 
         if metrics_file:
-            self.__validate_metrics(metrics_file)
+            data.metrics = self.__validate_metrics(metrics_file)
 
         if tests_file:
-            self.__validate_tests__(tests_file)
+            data.tests = self.__validate_tests__(tests_file)
+
+        return data
 
     def __validate_metadata__(self, metadata_json):
         try:
@@ -76,6 +107,8 @@ class ValidateTestRun(object):
         elif '/' in metadata['job_id']:
             raise exceptions.InvalidMetadata('job_id cannot contain the "/" character')
 
+        return metadata
+
     def __validate_metrics(self, metrics_file):
         try:
             metrics = json.loads(metrics_file)
@@ -98,6 +131,8 @@ class ValidateTestRun(object):
                     if type(item) not in [int, float]:
                         raise exceptions.InvalidMetricsData.value(value)
 
+        return metrics
+
     def __validate_tests__(self, tests_file):
         try:
             tests = json.loads(tests_file)
@@ -107,6 +142,8 @@ class ValidateTestRun(object):
         if type(tests) != dict:
             raise exceptions.InvalidTestsData.type(tests)
 
+        return tests
+
 
 class ReceiveTestRun(object):
 
@@ -128,10 +165,10 @@ class ReceiveTestRun(object):
         environment, _ = self.project.environments.get_or_create(slug=environment_slug)
 
         validate = ValidateTestRun()
-        validate(metadata_file, metrics_file, tests_file)
+        test_run_data = validate(metadata_file, metrics_file, tests_file)
 
-        if metadata_file:
-            data = json.loads(metadata_file)
+        if test_run_data.metadata is not None:
+            data = test_run_data.metadata
 
             fields = self.SPECIAL_METADATA_FIELDS
             metadata_fields = {k: data[k] for k in fields if data.get(k)}
@@ -147,20 +184,26 @@ class ReceiveTestRun(object):
             metadata_fields['job_id'] = uuid.uuid4()
 
         if log_file:
-            log_file = log_file.replace("\x00", "")
+            # logs can be huge, so when they are files they are streamed
+            # into storage instead of being read into memory here
+            log_file = strip_nul(log_file)
 
-        testrun = build.test_runs.create(
+        testrun = TestRun(
+            build=build,
             environment=environment,
-            tests_file=tests_file,
-            metrics_file=metrics_file,
-            log_file=log_file,
-            metadata_file=metadata_file,
             completed=completed,
             **metadata_fields
         )
+        testrun.set_file('tests_file', tests_file)
+        testrun.set_file('metrics_file', metrics_file)
+        testrun.set_file('log_file', log_file)
+        testrun.set_file('metadata_file', metadata_file)
+        testrun.save()
 
         for f, data in attachments.items():
-            testrun.attachments.create(filename=f, data=data, length=len(data))
+            attachment = Attachment(test_run=testrun, filename=f)
+            attachment.set_data(data)
+            attachment.save()
 
         testrun.refresh_from_db()
 
@@ -169,17 +212,122 @@ class ReceiveTestRun(object):
             build.save()
 
         processor = ProcessTestRun()
-        processor(testrun)
+        processor(testrun, test_run_data)
 
         if self.update_project_status:
-            UpdateProjectStatus()(testrun)
-            UpdateBuildSummary()(testrun)
+            ScheduleStatusUpdate()(testrun)
 
         return testrun
 
 
-def get_suite(test_run, suite_name):
-    project = test_run.build.project
+class ReceiveTestRunBatch(object):
+    """
+    Receives several test runs for the same build at once. The test runs are
+    received in a single transaction, so either all of them are accepted or
+    none is, and the project status and the build summaries are only updated
+    once at the end.
+
+    Each element of ``test_runs`` is a dictionary with the arguments taken by
+    ReceiveTestRun, except for the build version.
+    """
+
+    def __init__(self, project):
+        self.project = project
+
+    def __call__(self, version, test_runs):
+        receive = ReceiveTestRun(self.project, update_project_status=False)
+        testruns = []
+        with transaction.atomic():
+            for i, data in enumerate(test_runs):
+                try:
+                    testruns.append(receive(version=version, **data))
+                except exceptions.invalid_input as e:
+                    raise type(e)("test run #%d (%s): %s" % (i + 1, data['environment_slug'], e))
+
+        if not testruns:
+            return testruns
+
+        environments = {t.environment_id: t.environment for t in testruns}
+        build = testruns[-1].build
+        for environment in environments.values():
+            BuildSummary.create_or_update(build, environment)
+        UpdateProjectStatus()(testruns[-1])
+
+        return testruns
+
+
+class SubmitTestRun(object):
+    """
+    Stores a test run submission for asynchronous processing, and schedules
+    it. Takes the same arguments as ReceiveTestRun; the submitted data is only
+    validated when the submission is processed.
+    """
+
+    def __init__(self, project):
+        self.project = project
+
+    def __call__(self, version, environment_slug, metadata_file=None, metrics_file=None, tests_file=None, log_file=None, attachments={}, completed=True):
+        with transaction.atomic():
+            submission = self.project.submissions.create(
+                version=version,
+                environment_slug=environment_slug,
+                metadata_file=metadata_file,
+                metrics_file=metrics_file,
+                tests_file=tests_file,
+                log_file=log_file and read_text(log_file),
+                completed=completed,
+            )
+            for f, data in attachments.items():
+                submission.attachments.create(filename=f, data=read_bytes(data))
+        process_submission.delay(submission.id)
+        return submission
+
+
+@celery.task
+def process_submission(submission_id):
+    # claim the submission, so that it is processed only once even if the
+    # task is delivered more than once
+    claimed = Submission.objects.filter(
+        pk=submission_id,
+        status=Submission.QUEUED,
+    ).update(status=Submission.PROCESSING)
+    if not claimed:
+        if not Submission.objects.filter(pk=submission_id).exists():
+            logger.error("Submission with ID: %s not found" % submission_id)
+        return
+    submission = Submission.objects.select_related('project').get(pk=submission_id)
+
+    receive = ReceiveTestRun(submission.project)
+    try:
+        submission.test_run = receive(
+            version=submission.version,
+            environment_slug=submission.environment_slug,
+            metadata_file=submission.metadata_file,
+            metrics_file=submission.metrics_file,
+            tests_file=submission.tests_file,
+            log_file=submission.log_file,
+            attachments={a.filename: bytes(a.data) for a in submission.attachments.all()},
+            completed=submission.completed,
+        )
+        submission.status = Submission.DONE
+    except exceptions.invalid_input as e:
+        submission.status = Submission.FAILED
+        submission.error_message = str(e)
+    except Exception as e:
+        logger.exception("Error processing submission %s" % submission_id)
+        submission.status = Submission.FAILED
+        submission.error_message = "Internal error: %s" % e
+
+    submission.processed_at = timezone.now()
+    submission.metadata_file = None
+    submission.metrics_file = None
+    submission.tests_file = None
+    submission.log_file = None
+    submission.save()
+    submission.attachments.all().delete()
+
+
+def __create_suite__(project, suite_name):
     metadata, _ = SuiteMetadata.objects.get_or_create(
         kind='suite',
         suite=suite_name,
@@ -190,13 +338,107 @@ def get_suite(test_run, suite_name):
         slug=suite_name,
         defaults={'metadata': metadata},
     )
+    cache.suites.add((project.id, suite_name), suite)
+    return suite
+
+
+def get_suite(test_run, suite_name):
+    project = test_run.build.project
+    cache.refresh()
+    suite = cache.suites.get((project.id, suite_name))
+    if suite is None:
+        suite = __create_suite__(project, suite_name)
     return suite
 
 
+def get_suites(test_run, suite_names):
+    """
+    Returns a dictionary mapping each of the given suite slugs to the
+    corresponding Suite in the test run project, creating the ones that don't
+    exist yet.
+    """
+    project = test_run.build.project
+    cache.refresh()
+    suites = {}
+    missing = []
+    for suite_name in set(suite_names):
+        suite = cache.suites.get((project.id, suite_name))
+        if suite is None:
+            missing.append(suite_name)
+        else:
+            suites[suite_name] = suite
+
+    for chunk in split_list(missing, BATCH_SIZE):
+        for suite in project.suites.filter(slug__in=chunk):
+            suites[suite.slug] = suite
+            cache.suites.add((project.id, suite.slug), suite)
+
+    for suite_name in missing:
+        if suite_name not in suites:
+            suites[suite_name] = __create_suite__(project, suite_name)
+    return suites
+
+
+def __lookup_suite_metadata__(kind, keys):
+    by_suite = defaultdict(list)
+    for suite, name in keys:
+        by_suite[suite].append(name)
+
+    metadata = {}
+    for suite, names in by_suite.items():
+        for chunk in split_list(names, BATCH_SIZE):
+            queryset = SuiteMetadata.objects.filter(kind=kind, suite=suite, name__in=chunk)
+            for m in queryset:
+                metadata[(m.suite, m.name)] = m
+                cache.suite_metadata.add((kind, m.suite, m.name), m)
+    return metadata
+
+
+def get_suite_metadata(kind, keys):
+    """
+    Returns a dictionary mapping each of the given (suite, name) tuples to the
+    corresponding SuiteMetadata object of the given kind. The missing ones are
+    created in bulk.
+    """
+    cache.refresh()
+    metadata = {}
+    uncached = []
+    for suite, name in set(keys):
+        m = cache.suite_metadata.get((kind, suite, name))
+        if m is None:
+            uncached.append((suite, name))
+        else:
+            metadata[(suite, name)] = m
+
+    metadata.update(__lookup_suite_metadata__(kind, uncached))
+
+    missing = [key for key in uncached if key not in metadata]
+    if missing:
+        try:
+            with transaction.atomic():
+                SuiteMetadata.objects.bulk_create(
+                    [SuiteMetadata(kind=kind, suite=suite, name=name) for suite, name in missing],
+                    batch_size=BATCH_SIZE,
+                )
+        except IntegrityError:
+            # some of them were created concurrently by someone else; fall
+            # back to creating them one by one
+            for suite, name in missing:
+                SuiteMetadata.objects.get_or_create(kind=kind, suite=suite, name=name)
+        # bulk_create does not set primary keys on all database backends
+        metadata.update(__lookup_suite_metadata__(kind, missing))
+
+    return metadata
+
+
 class ParseTestRunData(object):
 
     @staticmethod
-    def __call__(test_run):
+    def __call__(test_run, data=None):
+        """
+        ``data`` is the TestRunData that was obtained when validating the test
+        run files, if available; otherwise the stored files are decoded.
+        """
         if test_run.data_processed:
             return
 
@@ -205,43 +447,69 @@ class ParseTestRunData(object):
             issues.setdefault(issue.test_name, [])
             issues[issue.test_name].append(issue)
 
-        for test in test_parser()(test_run.tests_file):
-            suite = get_suite(
-                test_run,
-                test['group_name']
-            )
-            metadata, _ = SuiteMetadata.objects.get_or_create(suite=suite.slug, name=test['test_name'], kind='test')
-            full_name = join_name(suite.slug, test['test_name'])
-            test_issues = issues.get(full_name, [])
-            test = Test.objects.create(
-                test_run=test_run,
-                suite=suite,
-                metadata=metadata,
-                name=test['test_name'],
-                result=test['pass'],
-                has_known_issues=bool(test_issues),
-            )
-            for issue in test_issues:
-                test.known_issues.add(issue)
+        if data is None:
+            tests = test_parser()(test_run.get_file('tests_file'))
+            metrics = metric_parser()(test_run.get_file('metrics_file'))
+        else:
+            tests = test_parser()(data.tests)
+            metrics = metric_parser()(data.metrics)
 
-        for metric in metric_parser()(test_run.metrics_file):
-            suite = get_suite(
-                test_run,
-                metric['group_name']
-            )
-            metadata, _ = SuiteMetadata.objects.get_or_create(suite=suite.slug, name=metric['name'], kind='metric')
-            Metric.objects.create(
-                test_run=test_run,
-                suite=suite,
-                metadata=metadata,
-                name=metric['name'],
-                result=metric['result'],
-                measurements=','.join([str(m) for m in metric['measurements']]),
-            )
+        suites = get_suites(
+            test_run,
+            [t['group_name'] for t in tests] + [m['group_name'] for m in metrics],
+        )
+
+        project_id = test_run.build.project_id
+        tests_metadata = get_suite_metadata('test', [(t['group_name'], t['test_name']) for t in tests])
+        for chunk in split_list(tests, BATCH_SIZE):
+            Test.objects.bulk_create([
+                Test(
+                    test_run=test_run,
+                    build_id=test_run.build_id,
+                    environment_id=test_run.environment_id,
+                    project_id=project_id,
+                    suite=suites[test['group_name']],
+                    metadata=tests_metadata[(test['group_name'], test['test_name'])],
+                    name=test['test_name'],
+                    result=test['pass'],
+                    has_known_issues=(join_name(test['group_name'], test['test_name']) in issues),
+                )
+                for test in chunk
+            ])
+
+        if issues:
+            ParseTestRunData.__link_known_issues__(test_run, issues)
+
+        metrics_metadata = get_suite_metadata('metric', [(m['group_name'], m['name']) for m in metrics])
+        for chunk in split_list(metrics, BATCH_SIZE):
+            Metric.objects.bulk_create([
+                Metric(
+                    test_run=test_run,
+                    build_id=test_run.build_id,
+                    environment_id=test_run.environment_id,
+                    project_id=project_id,
+                    suite=suites[metric['group_name']],
+                    metadata=metrics_metadata[(metric['group_name'], metric['name'])],
+                    name=metric['name'],
+                    result=metric['result'],
+                    measurements=Metric.pack_measurements(metric['measurements']),
+                )
+                for metric in chunk
+            ])
 
         test_run.data_processed = True
         test_run.save()
 
+    @staticmethod
+    def __link_known_issues__(test_run, issues):
+        through = Test.known_issues.through
+        tests = test_run.tests.filter(has_known_issues=True).values_list('id', 'suite__slug', 'name')
+        links = []
+        for test_id, suite, name in tests.iterator():
+            for issue in issues.get(join_name(suite, name), []):
+                links.append(through(test_id=test_id, knownissue_id=issue.id))
+        through.objects.bulk_create(links, batch_size=BATCH_SIZE)
+
 
 class PostProcessTestRun(object):
 
@@ -269,15 +537,34 @@ def postprocess_test_run(test_run_id):
     PostProcessTestRun()(testrun)
 
 
-def get_suite_version(test_run, suite):
-    if not suite:
-        return None
-    v = test_run.metadata.get('suite_versions', {}).get(suite.slug)
-    if v:
-        suite_version, _ = SuiteVersion.objects.get_or_create(suite=suite, version=v)
-        return suite_version
-    else:
-        return None
+def get_suite_versions(test_run, suite_ids):
+    """
+    Returns a dictionary mapping the ids of the given suites to their
+    SuiteVersion in the test run, for those suites which have a version in
+    the test run metadata. Looks up all of the suite versions at once, and
+    only creates the missing ones.
+    """
+    if not suite_ids:
+        return {}
+    versions = test_run.metadata.get('suite_versions', {})
+    if not versions:
+        return {}
+    suites = {s.id: s for s in Suite.objects.filter(id__in=suite_ids, slug__in=versions.keys())}
+    if not suites:
+        return {}
+
+    result = {}
+    existing = SuiteVersion.objects.filter(
+        suite_id__in=suites.keys(),
+        version__in=set(versions[s.slug] for s in suites.values()),
+    )
+    for suite_version in existing:
+        if suite_version.version == versions[suites[suite_version.suite_id].slug]:
+            result[suite_version.suite_id] = suite_version
+    for sid, suite in suites.items():
+        if sid not in result:
+            result[sid], _ = SuiteVersion.objects.get_or_create(suite=suite, version=versions[suite.slug])
+    return result
 
 
 def update_delayed_report(delayed_report, error_message, status_code, **kwargs):
@@ -360,28 +647,23 @@ class RecordTestRunStatus(object):
 
         status = defaultdict(lambda: Status(test_run=testrun))
 
-        for test in testrun.tests.all():
-            sid = test.suite_id
-            if test.result is True:
-                status[None].tests_pass += 1
-                status[sid].tests_pass += 1
-            elif test.result is False:
-                if test.known_issues.exists():
-                    status[None].tests_xfail += 1
-                    status[sid].tests_xfail += 1
-                else:
-                    status[None].tests_fail += 1
-                    status[sid].tests_fail += 1
-            else:
-                status[None].tests_skip += 1
-                status[sid].tests_skip += 1
+        counts = testrun.tests.order_by().values('suite_id').annotate(
+            tests_pass=Count(Case(When(result=True, then=1))),
+            tests_fail=Count(Case(When(Q(result=False) & ~Q(has_known_issues=True), then=1))),
+            tests_xfail=Count(Case(When(result=False, has_known_issues=True, then=1))),
+            tests_skip=Count(Case(When(result=None, then=1))),
+        )
+        for row in counts:
+            sid = row.pop('suite_id')
+            for field, count in row.items():
+                setattr(status[sid], field, count)
+                setattr(status[None], field, getattr(status[None], field) + count)
 
         metrics = defaultdict(lambda: [])
-        for metric in testrun.metrics.all():
-            sid = metric.suite_id
-            for v in metric.measurement_list:
-                metrics[None].append(v)
-                metrics[sid].append(v)
+        for sid, measurements in testrun.metrics.values_list('suite_id', 'measurements').iterator():
+            values = Metric.parse_measurements(measurements)
+            metrics[None].extend(values)
+            metrics[sid].extend(values)
 
         # One Status has many test suites and each of one of them
         # has their own summary (i.e. geomean).
@@ -391,20 +673,32 @@ class RecordTestRunStatus(object):
             status[sid].metrics_summary = geomean(values)
             status[sid].has_metrics = True
 
+        suite_versions = get_suite_versions(testrun, [sid for sid in status.keys() if sid])
         for sid, s in status.items():
             s.suite_id = sid
-            s.suite_version = get_suite_version(testrun, s.suite)
-            s.save()
+            s.suite_version = suite_versions.get(sid)
+        Status.objects.bulk_create(status.values())
 
         testrun.status_recorded = True
         testrun.save()
 
 
 class UpdateProjectStatus(object):
+    """
+    Updates the status of the build of the given test run. In incremental
+    mode, the test run is assumed to be the only one received since the last
+    update, and only its results are added to the stored status (see
+    ProjectStatus.add_test_run).
+    """
 
-    @staticmethod
-    def __call__(testrun):
-        projectstatus = ProjectStatus.create_or_update(testrun.build)
+    def __init__(self, incremental=False):
+        self.incremental = incremental
+
+    def __call__(self, testrun):
+        if self.incremental:
+            projectstatus = ProjectStatus.add_test_run(testrun)
+        else:
+            projectstatus = ProjectStatus.create_or_update(testrun.build)
         try:
             maybe_notify_project_status.delay(projectstatus.id)
         except OSError as e:
@@ -421,17 +715,136 @@ class UpdateProjectStatus(object):
 
 class UpdateBuildSummary(object):
 
+    def __init__(self, incremental=False):
+        self.incremental = incremental
+
+    def __call__(self, testrun):
+        if self.incremental:
+            BuildSummary.add_test_run(testrun)
+        else:
+            BuildSummary.create_or_update(testrun.build, testrun.environment)
+
+
+class ScheduleStatusUpdate(object):
+    """
+    Makes sure that the status of the build of a test run that has just been
+    received gets updated.
+
+    If SQUAD_STATUS_UPDATE_DELAY is not set, the update is done right away.
+    Otherwise the build is marked as having a pending status update, and the
+    update_build_status task takes care of it once no test runs have arrived
+    for that long, or SQUAD_STATUS_UPDATE_MAX_DELAY seconds after the first
+    test run that was not accounted for. Only the first test run to mark the
+    build schedules the task; if that fails, the update is done right away.
+    Pending updates whose task got lost are picked up by
+    update_overdue_build_statuses.
+    """
+
     @staticmethod
     def __call__(testrun):
-        BuildSummary.create_or_update(testrun.build, testrun.environment)
+        if not settings.SQUAD_STATUS_UPDATE_DELAY:
+            UpdateProjectStatus(incremental=True)(testrun)
+            UpdateBuildSummary(incremental=True)(testrun)
+            return
+
+        now = timezone.now()
+        build = testrun.build
+        if PendingStatusUpdate.objects.filter(build=build).update(last_requested_at=now):
+            return
+        try:
+            with transaction.atomic():
+                PendingStatusUpdate.objects.create(build=build, first_requested_at=now, last_requested_at=now)
+        except IntegrityError:
+            # someone else marked the build in the meantime
+            PendingStatusUpdate.objects.filter(build=build).update(last_requested_at=now)
+            return
+        if not __schedule_build_status_update__(build.id, settings.SQUAD_STATUS_UPDATE_DELAY):
+            update_build_status(build.id, force=True)
+
+
+# how late a pending status update must be for update_overdue_build_statuses
+# to assume that its task was lost
+STATUS_UPDATE_GRACE_PERIOD = timezone.timedelta(minutes=5)
+
+
+def __schedule_build_status_update__(build_id, countdown):
+    try:
+        update_build_status.apply_async(args=[build_id], countdown=countdown)
+        return True
+    except Exception as e:
+        logger.error("Cannot schedule status update: " + str(e) + "\n" + traceback.format_exc())
+        return False
+
+
+@celery.task
+def update_build_status(build_id, force=False):
+    """
+    Recomputes the status of a build that has a pending status update (see
+    ScheduleStatusUpdate), if it is due, or if ``force`` is set. The pending
+    update is only removed once the status has been recomputed, and only if
+    no other test runs arrived in the meantime; otherwise it is kept, and
+    scheduled again.
+    """
+    with transaction.atomic():
+        pending = PendingStatusUpdate.objects.select_for_update().filter(build_id=build_id).first()
+        if pending is None:
+            return
+
+        due = min(
+            pending.last_requested_at + timezone.timedelta(seconds=settings.SQUAD_STATUS_UPDATE_DELAY),
+            pending.first_requested_at + timezone.timedelta(seconds=settings.SQUAD_STATUS_UPDATE_MAX_DELAY),
+        )
+        now = timezone.now()
+        if due > now and not force:
+            __schedule_build_status_update__(build_id, (due - now).total_seconds())
+            return
+        requested_at = pending.last_requested_at
+
+    build = Build.objects.get(pk=build_id)
+    with transaction.atomic():
+        # serializes updates of the same build
+        ProjectStatus.objects.select_for_update().get_or_create(build=build)
+        for environment in Environment.objects.filter(test_runs__build=build).distinct():
+            BuildSummary.create_or_update(build, environment)
+        status = ProjectStatus.create_or_update(build)
+
+    deleted, _ = PendingStatusUpdate.objects.filter(pk=pending.pk, last_requested_at=requested_at).delete()
+    if not deleted:
+        # test runs arrived during the update, and may not be accounted for
+        PendingStatusUpdate.objects.filter(pk=pending.pk).update(first_requested_at=timezone.now())
+        __schedule_build_status_update__(build_id, settings.SQUAD_STATUS_UPDATE_DELAY)
+
+    try:
+        maybe_notify_project_status.delay(status.id)
+    except OSError as e:
+        logger.error("Cannot schedule notification: " + str(e) + "\n" + traceback.format_exc())
+
+
+@celery.task
+def update_overdue_build_statuses():
+    """
+    Runs the status updates that should have been done a while ago, in case
+    their update_build_status task was lost or failed.
+    """
+    now = timezone.now()
+    delay = timezone.timedelta(seconds=settings.SQUAD_STATUS_UPDATE_DELAY)
+    max_delay = timezone.timedelta(seconds=settings.SQUAD_STATUS_UPDATE_MAX_DELAY)
+    quiet = Q(last_requested_at__lt=now - delay - STATUS_UPDATE_GRACE_PERIOD)
+    waited_too_long = Q(first_requested_at__lt=now - max_delay - STATUS_UPDATE_GRACE_PERIOD)
+    overdue = PendingStatusUpdate.objects.filter(quiet | waited_too_long)
+    for build_id in overdue.values_list('build_id', flat=True):
+        try:
+            update_build_status(build_id)
+        except Exception as e:
+            logger.error("Cannot update status of build %d: %s\n%s" % (build_id, str(e), traceback.format_exc()))
 
 
 class ProcessTestRun(object):
 
     @staticmethod
-    def __call__(testrun):
+    def __call__(testrun, data=None):
         with transaction.atomic():
-            ParseTestRunData()(testrun)
+            ParseTestRunData()(testrun, data)
             PostProcessTestRun()(testrun)
             RecordTestRunStatus()(testrun)
 
@@ -468,17 +881,101 @@ class CreateBuild(object):
         return build
 
 
+def expired_builds(project):
+    start = timezone.now() - timezone.timedelta(project.data_retention_days)
+    builds = project.builds.filter(
+        created_at__lt=start
+    ).exclude(
+        keep_data=True
+    )
+    return builds, start
+
+
 @celery.task
 def cleanup_old_builds():
     for project in Project.objects.filter(data_retention_days__gt=0):
-        start = timezone.now() - timezone.timedelta(project.data_retention_days)
-        builds = project.builds.filter(
-            created_at__lt=start
-        ).exclude(
-            keep_data=True
-        ).values('id')
-        for entry in builds:
-            cleanup_build.delay(entry['id'])
+        builds, _ = expired_builds(project)
+        if builds.exists():
+            cleanup_project.delay(project.id)
+
+
+# how long a cleanup can go without reporting progress before it is
+# considered dead, and another one is allowed to start for the same project
+CLEANUP_LEASE = timezone.timedelta(hours=1)
+
+
+@celery.task
+def cleanup_project(project_id):
+    """
+    Removes the expired builds of a project, oldest first, until there are
+    none left or the budget of this run (SQUAD_CLEANUP_TIME_BUDGET seconds,
+    SQUAD_CLEANUP_ROW_BUDGET rows) is exhausted, in which case another run
+    is scheduled SQUAD_CLEANUP_PAUSE seconds later. Whole periods in which
+    all builds have expired are removed together; the remaining builds are
+    removed one by one. The budget is checked between delete batches, and
+    the lease of the run is renewed after each of them. Only one run per
+    project at a time does any work.
+    """
+    now = timezone.now()
+    CleanupProgress.objects.get_or_create(project_id=project_id)
+    acquired = CleanupProgress.objects.filter(
+        Q(running_until__isnull=True) | Q(running_until__lt=now),
+        project_id=project_id,
+    ).update(running_until=now + CLEANUP_LEASE, last_run_at=now)
+    if not acquired:
+        return  # there is already a cleanup running for this project
+
+    progress = CleanupProgress.objects.get(project_id=project_id)
+    budget = retention.Budget(
+        rows=settings.SQUAD_CLEANUP_ROW_BUDGET,
+        deadline=now + timezone.timedelta(seconds=settings.SQUAD_CLEANUP_TIME_BUDGET),
+    )
+
+    def renew_lease(model, count):
+        CleanupProgress.objects.filter(pk=progress.pk).update(running_until=timezone.now() + CLEANUP_LEASE)
+
+    finished = False
+    try:
+        project = Project.objects.get(pk=project_id)
+        while True:
+            oldest = None
+            if project.data_retention_days > 0:
+                builds, start = expired_builds(project)
+                if progress.position:
+                    builds = builds.filter(created_at__gte=progress.position)
+                oldest = builds.order_by('created_at').first()
+            if oldest is None:
+                finished = True
+                break
+
+            period = retention.period_start(oldest.created_at)
+            if period + retention.PERIOD <= start:
+                builds = builds.filter(created_at__lt=period + retention.PERIOD)
+                deleted = retention.delete_builds(builds, progress=renew_lease, budget=budget)
+                position = period + retention.PERIOD
+            else:
+                deleted = retention.delete_build(oldest, progress=renew_lease, budget=budget)
+                position = oldest.created_at
+
+            progress.builds_removed += deleted.get(Build, 0)
+            progress.rows_removed += sum(deleted.values())
+            progress.running_until = timezone.now() + CLEANUP_LEASE
+            if Build in deleted:
+                progress.position = position
+            progress.save()
+
+            if Build not in deleted or budget.exhausted:
+                break
+    finally:
+        if finished:
+            # the next pass starts over, in case builds were unmarked as
+            # keep_data or the retention period was shortened
+            progress.position = None
+        progress.running_until = None
+        progress.save()
+
+    if not finished:
+        cleanup_project.apply_async(args=[project_id], countdown=settings.SQUAD_CLEANUP_PAUSE)
 
 
 @celery.task
@@ -490,8 +987,13 @@ def remove_delayed_reports():
 
 
 @celery.task
-@transaction.atomic
 def cleanup_build(build_id):
-    build = Build.objects.get(pk=build_id)
-    BuildPlaceholder.objects.create(project=build.project, version=build.version)
-    build.delete()
+    try:
+        build = Build.objects.get(pk=build_id)
+    except Build.DoesNotExist:
+        return  # already removed by a previous run
+
+    def progress(model, count):
+        logger.info('Build %d: %d %s rows deleted' % (build_id, count, model._meta.db_table))
+
+    retention.delete_build(build, progress=progress)
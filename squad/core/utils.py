@@ -1,3 +1,4 @@
+import codecs
 import random
 import string
 import yaml
@@ -6,6 +7,63 @@ from django.template.defaultfilters import safe, escape
 from django.core.exceptions import ValidationError
 
 
+def read_bytes(data):
+    """
+    Returns the contents of ``data`` as bytes; ``data`` can be either a
+    string/bytes object, or a binary file-like object.
+    """
+    if hasattr(data, 'read'):
+        data = data.read()
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return data
+
+
+def read_text(data):
+    """
+    Like read_bytes, but returns the contents decoded as UTF-8 text.
+    """
+    if hasattr(data, 'read'):
+        data = data.read()
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return data
+
+
+class NulStrippingReader(object):
+    """
+    Binary file-like wrapper that removes NUL bytes from the data as it is
+    read, a piece at a time, and checks that it is valid UTF-8 text (raising
+    UnicodeDecodeError otherwise), without ever holding all of it in memory.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size=-1):
+        while True:
+            chunk = self.stream.read(size)
+            self.decoder.decode(chunk, final=not chunk)
+            stripped = chunk.replace(b'\x00', b'')
+            # a piece made only of NUL bytes is not the end of the data
+            if stripped or not chunk:
+                return stripped
+
+
+def strip_nul(data):
+    """
+    Removes NUL characters from ``data``, which can be a string/bytes
+    object, or a binary file-like object; in the latter case they are
+    removed as the data is read (see NulStrippingReader).
+    """
+    if hasattr(data, 'read'):
+        return NulStrippingReader(data)
+    if isinstance(data, (bytes, bytearray)):
+        return data.replace(b'\x00', b'')
+    return data.replace('\x00', '')
+
+
 def random_key(length, chars=string.printable):
     return ''.join(random.SystemRandom().choice(chars) for _ in range(length))
 
@@ -37,6 +95,21 @@ def parse_name(input_name):
     return (group_name, name)
 
 
+def split_list(items, chunk_size):
+    """
+    Yields successive lists of at most `chunk_size` elements from `items`,
+    which can be any iterable.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def join_name(group, name):
     if group == '/':
         return name
@@ -17,7 +17,7 @@ def compare_projects(request):
             page = int(request.GET.get('page', '1'))
         except ValueError:
             page = 1
-        paginator = Paginator(tuple(comparison.results.items()), 50)
+        paginator = Paginator(comparison.results.items(), 50)
         comparison.results = paginator.page(page)
     else:
         comparison = None
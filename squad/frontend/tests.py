@@ -51,8 +51,8 @@ class TestResultTable(list):
     # pagination data
     def __count_pages__(self, build_id, search, per_page):
         count = Test.objects.filter(
-            test_run__build_id=build_id, name__icontains=search).values(
-                'suite_id', 'name').distinct().count()
+            build_id=build_id, name__icontains=search).values(
+                'metadata_id').order_by().distinct().count()
         self.num_pages = count // per_page
         if count % per_page > 0:
             self.num_pages += 1
@@ -67,13 +67,12 @@ class TestResultTable(list):
         needed to obtain the data about per-environment test results.
         """
 
-        conditions = {}
         offset = (page - 1) * per_page
 
         mylist = Test.objects.filter(
-            test_run__build_id=build_id,
+            build_id=build_id,
             name__icontains=search).values(
-                'suite_id', 'suite__slug', 'name').annotate(
+                'metadata_id').annotate(
                     skips=Sum(Case(
                         When(result__isnull=True, then=1),
                         default=0,
@@ -92,18 +91,9 @@ class TestResultTable(list):
                         default=0,
                         output_field=IntegerField()))).order_by(
                             '-fails', '-xfails', '-skips', '-passes',
-                            'suite__slug', 'name')[offset:offset + per_page]
+                            'metadata__suite', 'metadata__name')[offset:offset + per_page]
 
-        for item in mylist:
-            conditions.setdefault(item['suite_id'], [])
-            conditions[item['suite_id']].append(item['name'])
-
-        the_filter = Q(id__lt=0)  # always false
-        for suite_id, names in conditions.items():
-            new_filter = (Q(suite_id=suite_id) & Q(name__in=names))
-            the_filter = the_filter | new_filter
-
-        return the_filter
+        return Q(metadata_id__in=[item['metadata_id'] for item in mylist])
 
     @classmethod
     def get(cls, build, page, search, per_page=50):
@@ -114,13 +104,14 @@ class TestResultTable(list):
         table.environments = set([t.environment for t in build.test_runs.prefetch_related('environment').all()])
 
         tests = Test.objects.filter(
-            test_run__build=build
+            build=build
         ).filter(
             table.__get_page_filter__(build.id, page, search, per_page)
         ).prefetch_related(
             'test_run',
             'suite',
-        ).order_by('suite_id', 'name')
+            'metadata',
+        ).order_by('metadata_id')
         memo = {}
         for test in tests:
             memo.setdefault(test.full_name, {})
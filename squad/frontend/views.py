@@ -14,7 +14,7 @@ from squad.core.models import Build
 from squad.core.queries import get_metric_data
 from squad.frontend.queries import get_metrics_list
 from squad.frontend.utils import file_type
-from squad.http import auth
+from squad.http import auth, file_response
 from collections import OrderedDict
 
 
@@ -76,7 +76,8 @@ def __get_statuses__(project, limit=None):
         build__project=project
     ).prefetch_related(
         'build',
-        'build__project'
+        'build__project',
+        'changes',
     ).order_by('-build__datetime')
     if limit:
         statuses = statuses[:limit]
@@ -381,14 +382,19 @@ def test_run_suite_metrics(request, group_slug, project_slug, build_version, job
     return render(request, 'squad/test_run_suite_metrics.jinja2', context)
 
 
-def __download__(filename, data, content_type=None):
+def __download__(request, filename, f, length, digest, content_type=None):
     if not content_type:
         content_type, _ = mimetypes.guess_type(filename)
         if content_type is None:
             content_type = 'application/octet-stream'
-    response = HttpResponse(data, content_type=content_type)
-    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
-    return response
+    return file_response(request, f, content_type, length=length, digest=digest, filename=filename)
+
+
+def __download_test_run_file__(request, test_run, name, filename):
+    length, digest = test_run.file_info(name)
+    if length is None:
+        raise Http404("File not available for this test run")
+    return __download__(request, filename, test_run.open_file(name), length, digest)
 
 
 @auth
@@ -397,10 +403,11 @@ def test_run_log(request, group_slug, project_slug, build_version, job_id):
     build = get_build(project, build_version)
     test_run = get_object_or_404(build.test_runs, job_id=job_id)
 
-    if not test_run.log_file:
+    length, digest = test_run.file_info('log_file')
+    if not length:
         raise Http404("No log file available for this test run")
 
-    return HttpResponse(test_run.log_file, content_type="text/plain")
+    return file_response(request, test_run.open_file('log_file'), "text/plain", length=length, digest=digest)
 
 
 @auth
@@ -411,7 +418,7 @@ def test_run_tests(request, group_slug, project_slug, build_version, job_id):
     test_run = get_object_or_404(build.test_runs, job_id=job_id)
 
     filename = '%s_%s_%s_%s_tests.json' % (group.slug, project.slug, build.version, test_run.job_id)
-    return __download__(filename, test_run.tests_file)
+    return __download_test_run_file__(request, test_run, 'tests_file', filename)
 
 
 @auth
@@ -422,7 +429,7 @@ def test_run_metrics(request, group_slug, project_slug, build_version, job_id):
     test_run = get_object_or_404(build.test_runs, job_id=job_id)
 
     filename = '%s_%s_%s_%s_metrics.json' % (group.slug, project.slug, build.version, test_run.job_id)
-    return __download__(filename, test_run.metrics_file)
+    return __download_test_run_file__(request, test_run, 'metrics_file', filename)
 
 
 @auth
@@ -433,7 +440,7 @@ def test_run_metadata(request, group_slug, project_slug, build_version, job_id):
     test_run = get_object_or_404(build.test_runs, job_id=job_id)
 
     filename = '%s_%s_%s_%s_metadata.json' % (group.slug, project.slug, build.version, test_run.job_id)
-    return __download__(filename, test_run.metadata_file)
+    return __download_test_run_file__(request, test_run, 'metadata_file', filename)
 
 
 @auth
@@ -442,8 +449,9 @@ def attachment(request, group_slug, project_slug, build_version, job_id, fname):
     build = get_build(project, build_version)
     test_run = get_object_or_404(build.test_runs, job_id=job_id)
 
-    attachment = get_object_or_404(test_run.attachments, filename=fname)
-    return __download__(attachment.filename, attachment.data)
+    # the contents are streamed from the database, not loaded here
+    attachment = get_object_or_404(test_run.attachments.defer('data'), filename=fname)
+    return __download__(request, attachment.filename, attachment.open(), attachment.length, attachment.digest)
 
 
 @auth
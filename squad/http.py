@@ -1,5 +1,15 @@
+import gzip
+import lzma
+import os
+import re
+import tempfile
+import zlib
+
+
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotModified
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from enum import Enum
 from rest_framework.authtoken.models import Token
@@ -10,6 +20,14 @@ from rest_framework.exceptions import AuthenticationFailed
 from squad.core import models
 
 
+try:
+    import zstandard
+    ZSTD_ERRORS = (zstandard.ZstdError,)
+except ImportError:  # zstd support is optional
+    zstandard = None
+    ZSTD_ERRORS = ()
+
+
 class AuthMode(Enum):
     READ = 0
     WRITE = 1
@@ -90,8 +108,300 @@ def auth(func, mode=AuthMode.READ):
     return auth_wrapper
 
 
-def read_file_upload(stream):
-    data = bytes()
-    for chunk in stream.chunks():
-        data = data + chunk
-    return data
+class UploadTooLarge(Exception):
+
+    def __init__(self, upload, max_size):
+        message = "%s is too large (maximum size is %d bytes)" % (upload.name, max_size)
+        super(UploadTooLarge, self).__init__(message)
+
+
+class TooManyFiles(UploadTooLarge):
+
+    def __init__(self, upload, max_files):
+        message = "%s has too many files (maximum is %d)" % (upload.name, max_files)
+        Exception.__init__(self, message)
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+# compressed uploads are recognized either by their content type, or by the
+# file name extension. Only the content type counts for uploads that must be
+# kept as they are by default, such as attachments, which can be compressed
+# artifacts in their own right (see open_file_upload).
+COMPRESSED_CONTENT_TYPES = {
+    'application/gzip': 'gzip',
+    'application/x-gzip': 'gzip',
+    'application/x-xz': 'xz',
+    'application/zstd': 'zstd',
+}
+
+COMPRESSED_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.xz': 'xz',
+    '.zst': 'zstd',
+}
+
+# size of the pieces in which compressed uploads are decompressed; this is
+# also the maximum amount of memory taken by a single piece, no matter how
+# well the input compresses.
+DECOMPRESSION_CHUNK_SIZE = 64 * 1024
+
+
+def __max_upload_size__(max_size):
+    if max_size is None:
+        return settings.SQUAD_MAX_UPLOAD_SIZE
+    return max_size
+
+
+def __check_upload_size__(upload, max_size):
+    if max_size and upload.size is not None and upload.size > max_size:
+        raise UploadTooLarge(upload, max_size)
+
+
+def __compression__(upload, by_extension=True):
+    compression = COMPRESSED_CONTENT_TYPES.get(upload.content_type)
+    if compression or not by_extension:
+        return compression
+    _, ext = os.path.splitext(upload.name or '')
+    return COMPRESSED_EXTENSIONS.get(ext.lower())
+
+
+def __decompress__(upload, compression, max_size):
+    """
+    Yields the decompressed contents of a compressed upload, in pieces, and
+    raises UploadTooLarge as soon as the decompressed data gets larger than
+    ``max_size``. Since the output is bounded, so is the damage a
+    decompression bomb can do.
+    """
+    upload.seek(0)
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=upload, mode='rb')
+    elif compression == 'xz':
+        stream = lzma.LZMAFile(upload, mode='rb')
+    elif zstandard is not None:
+        stream = zstandard.ZstdDecompressor().stream_reader(upload)
+    else:
+        raise InvalidUpload("%s: zstd compression is not supported" % upload.name)
+
+    size = 0
+    while True:
+        try:
+            chunk = stream.read(DECOMPRESSION_CHUNK_SIZE)
+        except (OSError, EOFError, lzma.LZMAError) + ZSTD_ERRORS as e:
+            raise InvalidUpload("%s: invalid %s data (%s)" % (upload.name, compression, e))
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_size and size > max_size:
+            raise UploadTooLarge(upload, max_size)
+        yield chunk
+
+
+def file_upload_name(upload, by_extension=True):
+    """
+    Returns the name of an uploaded file, without the extension that
+    indicates its compression if the file is decompressed by
+    open_file_upload with the same ``by_extension``.
+    """
+    name = upload.name
+    root, ext = os.path.splitext(name)
+    if __compression__(upload, by_extension) and ext.lower() in COMPRESSED_EXTENSIONS:
+        return root
+    return name
+
+
+def read_file_upload(stream, max_size=None):
+    """
+    Reads an uploaded file into memory, decompressing it if needed. Raises
+    UploadTooLarge if the (decompressed) file is larger than ``max_size``
+    bytes (by default, SQUAD_MAX_UPLOAD_SIZE), and InvalidUpload if it can't
+    be decompressed.
+    """
+    max_size = __max_upload_size__(max_size)
+    __check_upload_size__(stream, max_size)
+
+    compression = __compression__(stream)
+    if compression:
+        chunks = __decompress__(stream, compression, max_size)
+    else:
+        chunks = stream.chunks()
+
+    data = bytearray()
+    for chunk in chunks:
+        data += chunk
+        if max_size and len(data) > max_size:
+            raise UploadTooLarge(stream, max_size)
+    return bytes(data)
+
+
+def open_file_upload(upload, max_size=None, by_extension=True):
+    """
+    Returns a binary file-like object with the contents of an uploaded file,
+    without reading it into memory, for large files such as logs and
+    attachments. Django already spools uploads larger than
+    FILE_UPLOAD_MAX_MEMORY_SIZE to a temporary file on disk, so that file is
+    handed over as is. Compressed uploads are decompressed into a similar
+    temporary file. Raises the same exceptions as read_file_upload.
+
+    Unless ``by_extension`` is set, only uploads whose content type says they
+    are compressed are decompressed, and a file name like ``rootfs.tar.xz``
+    is not enough; this is what attachments need, since they must be kept
+    byte for byte unless the client asks otherwise.
+    """
+    max_size = __max_upload_size__(max_size)
+    __check_upload_size__(upload, max_size)
+
+    compression = __compression__(upload, by_extension)
+    if not compression:
+        upload.seek(0)
+        return upload
+
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    for chunk in __decompress__(upload, compression, max_size):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+# size of the pieces in which files are sent in streaming responses
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def __parse_range__(header, length):
+    """
+    Returns the first and last positions requested in a Range header, or
+    None if it should be ignored. Only single byte ranges are supported;
+    anything else is ignored, and the whole file is sent.
+    """
+    m = BYTE_RANGE.match(header.strip())
+    if not m or m.groups() == ('', ''):
+        return None
+    first, last = m.groups()
+    if first == '':
+        suffix = int(last)
+        if suffix == 0 or length == 0:
+            raise UnsatisfiableRange()
+        return max(length - suffix, 0), length - 1
+    first = int(first)
+    if first >= length:
+        raise UnsatisfiableRange()
+    last = int(last) if last else length - 1
+    if last < first:
+        return None
+    return first, min(last, length - 1)
+
+
+def __etags__(header):
+    etags = set()
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etags.add(etag.replace('-gzip"', '"'))
+    return etags
+
+
+def __accepts_gzip__(request):
+    for encoding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = encoding.partition(';')
+        if name.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def __compressible__(content_type):
+    return content_type.startswith('text/') or content_type == 'application/json'
+
+
+def __read_chunks__(f, length=None):
+    try:
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = RESPONSE_CHUNK_SIZE
+            if remaining is not None:
+                size = min(size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def __gzip_chunks__(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def file_response(request, f, content_type, length=None, digest=None, filename=None):
+    """
+    Returns a response that streams the contents of the binary file-like
+    object ``f``, in chunks, so that large files are never held in memory.
+
+    If ``digest`` (a hash of the contents) is given, it is used as the ETag
+    and If-None-Match requests are answered with 304. If ``length`` is known,
+    single byte range requests (Range/If-Range) are supported. Text files are
+    compressed on the fly for clients that accept gzip, unless a range was
+    requested.
+    """
+    etag = digest and '"%s"' % digest
+
+    if etag:
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match.strip() == '*' or etag in __etags__(if_none_match)):
+            f.close()
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and length is not None and (not if_range or (etag and if_range.strip() == etag)):
+        try:
+            byte_range = __parse_range__(range_header, length)
+        except UnsatisfiableRange:
+            f.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % length
+            return response
+
+    if byte_range:
+        first, last = byte_range
+        f.seek(first)
+        response = StreamingHttpResponse(__read_chunks__(f, last - first + 1), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, length)
+        response['Content-Length'] = last - first + 1
+    elif __compressible__(content_type) and __accepts_gzip__(request):
+        response = StreamingHttpResponse(__gzip_chunks__(__read_chunks__(f)), content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+        if etag:
+            etag = etag[:-1] + '-gzip"'
+    else:
+        response = StreamingHttpResponse(__read_chunks__(f, length), content_type=content_type)
+        if length is not None:
+            response['Content-Length'] = length
+
+    if length is not None:
+        response['Accept-Ranges'] = 'bytes'
+    if __compressible__(content_type):
+        response['Vary'] = 'Accept-Encoding'
+    if etag:
+        response['ETag'] = etag
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
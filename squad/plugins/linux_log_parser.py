@@ -1,4 +1,5 @@
 from squad.core.plugins import Plugin as BasePlugin
+from squad.core.tasks import get_suite, get_suite_metadata
 
 
 class Issue(object):
@@ -54,14 +55,17 @@ class KernelPanic(Issue):
 class Plugin(BasePlugin):
 
     def postprocess_testrun(self, testrun):
-        if testrun.log_file is not None:
-            project = testrun.build.project
-
-            suite, _ = project.suites.get_or_create(slug='linux-log-parser')
-            for issue in Issue.find(testrun.log_file):
+        log_file = testrun.get_file('log_file')
+        if log_file is not None:
+            suite = get_suite(testrun, 'linux-log-parser')
+            issues = Issue.find(log_file)
+            metadata = get_suite_metadata('test', [(suite.slug, 'check-' + issue.name) for issue in issues])
+            for issue in issues:
+                name = 'check-' + issue.name
                 testrun.tests.create(
                     suite=suite,
-                    name='check-' + issue.name,
+                    metadata=metadata[(suite.slug, name)],
+                    name=name,
                     result=(not issue.found),
                     log=issue.log
                 )
@@ -9,7 +9,7 @@ def main():
         '-A', 'squad',
         'worker',
         '--concurrency=1',
-        '--queues=celery,reporting_queue',
+        '--queues=celery,reporting_queue,submission_queue',
         '--max-tasks-per-child=5000',
         '--max-memory-per-child=1500000',
         '--loglevel=INFO'
@@ -153,6 +153,23 @@ if database_config:
     DATABASES['default'].update(db_from_env)
 
 
+# Cache; it must be shared by all processes (web and workers), e.g. with
+# memcached, since it is used to tell them to drop their in-process caches
+# (see squad.core.cache).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('SQUAD_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+    }
+}
+cache_location = os.getenv('SQUAD_CACHE_LOCATION')
+if cache_location:
+    CACHES['default']['LOCATION'] = cache_location
+shared_cache = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -287,12 +304,49 @@ CELERY_BEAT_SCHEDULE = {
     'report_cleanup': {
         'task': 'squad.core.tasks.remove_delayed_reports',
         'schedule': crontab(hour='7', minute=21),
-    }
+    },
+    'overdue_status_updates': {
+        'task': 'squad.core.tasks.update_overdue_build_statuses',
+        'schedule': crontab(minute='*/10'),
+    },
 }
 CELERY_TASK_ROUTES = {
     'squad.core.tasks.prepare_report': {'queue': 'reporting_queue'},
+    'squad.core.tasks.process_submission': {'queue': 'submission_queue'},
 }
 
+# When set, the status of a build is not updated on every test run received.
+# Instead, it is recomputed once there have been no new test runs for this
+# many seconds, or at most SQUAD_STATUS_UPDATE_MAX_DELAY seconds after the
+# first test run that was not accounted for yet.
+SQUAD_STATUS_UPDATE_DELAY = int(os.getenv('SQUAD_STATUS_UPDATE_DELAY', 0))
+SQUAD_STATUS_UPDATE_MAX_DELAY = int(os.getenv('SQUAD_STATUS_UPDATE_MAX_DELAY', 300))
+
+# Expired builds (see Project.data_retention_days) are removed in runs of at
+# most this many seconds, and this many deleted rows, per project, with a
+# pause of SQUAD_CLEANUP_PAUSE seconds between runs.
+SQUAD_CLEANUP_TIME_BUDGET = int(os.getenv('SQUAD_CLEANUP_TIME_BUDGET', 600))
+SQUAD_CLEANUP_ROW_BUDGET = int(os.getenv('SQUAD_CLEANUP_ROW_BUDGET', 1000000))
+SQUAD_CLEANUP_PAUSE = int(os.getenv('SQUAD_CLEANUP_PAUSE', 60))
+
+# Maximum number of suites, and of suite metadata objects, that each process
+# keeps cached during test data ingestion. Disabled by default unless the
+# cache above is shared, since otherwise changes made by one process would
+# not be seen by the others.
+SQUAD_SUITE_CACHE_SIZE = int(os.getenv('SQUAD_SUITE_CACHE_SIZE', 10000 if shared_cache else 0))
+
+# Maximum size, in bytes, of each file uploaded to the API. 0 means no limit.
+SQUAD_MAX_UPLOAD_SIZE = int(os.getenv('SQUAD_MAX_UPLOAD_SIZE', 512 * 1024 * 1024))
+
+# Maximum number of files in an archive submitted to /api/submitbatch. 0 means
+# no limit.
+SQUAD_MAX_BATCH_FILES = int(os.getenv('SQUAD_MAX_BATCH_FILES', 1000))
+
+# Blob store for logs, raw test data files and attachments (see
+# squad.core.storage). By default they are stored in the database.
+SQUAD_BLOB_STORE = os.getenv('SQUAD_BLOB_STORE')  # e.g. 'squad.core.storage.FileSystemBlobStore'
+SQUAD_BLOB_STORE_DIR = os.getenv('SQUAD_BLOB_STORE_DIR', os.path.join(DATA_DIR, 'blobs'))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
@@ -291,6 +291,34 @@ class RestApiTest(APITestCase):
         self.assertIn('foo/test2', data['regressions'])
         self.assertIn('foo/test1', data['fixes'])
 
+    def test_builds_regressions_and_fixes(self):
+        self.build2.test_jobs.all().delete()
+        self.build3.test_jobs.all().delete()
+        UpdateProjectStatus()(self.testrun2)
+        UpdateProjectStatus()(self.testrun3)
+
+        data = self.hit('/api/builds/%d/regressions/' % self.build3.id)
+        self.assertEqual(['foo/test2', 'foo/test2'], [r['test'] for r in data['results']])
+        self.assertEqual('regression', data['results'][0]['kind'])
+        self.assertTrue(data['results'][0]['build'].endswith('/api/builds/%d/' % self.build3.id))
+        self.assertTrue(data['results'][0]['environment'].endswith('/api/environments/%d/' % self.environment_a.id))
+
+        data = self.hit('/api/builds/%d/fixes/?limit=1' % self.build3.id)
+        self.assertEqual(2, data['count'])
+        self.assertEqual(['foo/test1'], [r['test'] for r in data['results']])
+
+    def test_project_regressions(self):
+        self.build2.test_jobs.all().delete()
+        self.build3.test_jobs.all().delete()
+        UpdateProjectStatus()(self.testrun2)
+        UpdateProjectStatus()(self.testrun3)
+
+        data = self.hit('/api/projects/%d/regressions/' % self.project.id)
+        self.assertIn('foo/test2', [r['test'] for r in data['results']])
+
+        data = self.hit('/api/projects/%d/regressions/?test_name=foo/test1' % self.project.id)
+        self.assertEqual([], data['results'])
+
     def test_builds_email_missing_status(self):
         # this should not happen normally, but let's test it anyway
         self.build3.status.delete()
@@ -1,14 +1,22 @@
+import gzip
+import lzma
 import os
-from io import StringIO
+import tarfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
 
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.test import Client
+from django.test.utils import override_settings
 from test.api import APIClient
 
 
+from squad.api.views import read_batch_archive
 from squad.core import models
+from squad.core.tasks import process_submission
 from rest_framework.authtoken.models import Token
 
 
@@ -298,6 +306,73 @@ class CreateTestRunApiTest(ApiTest):
         self.assertEqual(201, first.status_code)
         self.assertEqual(400, second.status_code)
 
+    def test_receives_compressed_files(self):
+        tests = BytesIO(gzip.compress(b'{"test1": "pass"}'))
+        tests.name = 'tests.json.gz'
+        log = BytesIO(lzma.compress(b'log text'))
+        log.name = 'log.txt.xz'
+        response = self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            {'tests': tests, 'log': log}
+        )
+        self.assertEqual(201, response.status_code)
+
+        testrun = models.TestRun.objects.last()
+        self.assertEqual('{"test1": "pass"}', testrun.tests_file)
+        self.assertEqual('log text', testrun.log_file)
+
+    def test_keeps_compressed_attachments_as_they_are(self):
+        data = gzip.compress(b'CONFIG_FOO=y')
+        attachment = BytesIO(data)
+        attachment.name = 'config.gz'
+        response = self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            {'attachment': attachment}
+        )
+        self.assertEqual(201, response.status_code)
+
+        testrun = models.TestRun.objects.last()
+        self.assertEqual(data, bytes(testrun.attachments.get(filename='config.gz').data))
+
+    def test_decompresses_attachments_by_content_type(self):
+        attachment = BytesIO(gzip.compress(b'attached'))
+        attachment.name = 'foo.txt.gz'
+        attachment.content_type = 'application/gzip'
+        response = self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            {'attachment': attachment}
+        )
+        self.assertEqual(201, response.status_code)
+
+        testrun = models.TestRun.objects.last()
+        self.assertEqual(b'attached', bytes(testrun.attachments.get(filename='foo.txt').data))
+
+    def test_reject_invalid_compressed_file(self):
+        tests = BytesIO(b'not really gzip')
+        tests.name = 'tests.json.gz'
+        response = self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            {'tests': tests}
+        )
+        self.assertEqual(400, response.status_code)
+
+    @override_settings(SQUAD_MAX_UPLOAD_SIZE=10)
+    def test_reject_log_file_too_large(self):
+        response = self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            {'log': StringIO('x' * 11)}
+        )
+        self.assertEqual(413, response.status_code)
+        self.assertEqual(0, models.TestRun.objects.count())
+
+    @override_settings(SQUAD_MAX_UPLOAD_SIZE=10)
+    def test_reject_tests_file_too_large(self):
+        response = self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            {'tests': StringIO('{"test1": "pass"}')}
+        )
+        self.assertEqual(413, response.status_code)
+
     def test_accepts_uppercase_in_slug(self):
         self.group.slug = 'MyGroup'
         self.group.save()
@@ -307,6 +382,220 @@ class CreateTestRunApiTest(ApiTest):
         self.assertEqual(response.status_code, 201)
 
 
+class AsyncSubmissionApiTest(ApiTest):
+
+    def submit(self, data={}, **extra):
+        return self.client.post(
+            '/api/submit/mygroup/myproject/1.0.0/myenvironment',
+            data,
+            **extra
+        )
+
+    def test_async_submission(self):
+        response = self.submit({'async': '1', 'tests': '{"test1": "pass"}'})
+        self.assertEqual(202, response.status_code)
+
+        submission = models.Submission.objects.get(pk=int(response.content))
+        self.assertEqual(models.Submission.DONE, submission.status)
+        self.assertIsNotNone(submission.processed_at)
+        self.assertIsNone(submission.tests_file)
+        self.assertEqual(1, submission.test_run.tests.count())
+
+    def test_async_submission_with_prefer_header(self):
+        response = self.submit({'tests': '{"test1": "pass"}'}, HTTP_PREFER='respond-async')
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(1, models.Submission.objects.count())
+
+    def test_async_submission_with_attachments(self):
+        response = self.submit({'async': 'true', 'attachment': StringIO('hello')})
+        submission = models.Submission.objects.get(pk=int(response.content))
+        attachment = submission.test_run.attachments.get()
+        self.assertEqual(b'hello', bytes(attachment.data))
+        self.assertEqual(0, submission.attachments.count())
+
+    @patch('squad.core.tasks.process_submission.delay')
+    def test_queues_submission(self, process_submission):
+        response = self.submit({'async': '1', 'tests': '{"test1": "pass"}'})
+        submission = models.Submission.objects.get(pk=int(response.content))
+
+        process_submission.assert_called_with(submission.id)
+        self.assertEqual(models.Submission.QUEUED, submission.status)
+        self.assertEqual('{"test1": "pass"}', submission.tests_file)
+        self.assertEqual(0, models.TestRun.objects.count())
+
+    def test_records_invalid_submission(self):
+        response = self.submit({'async': '1', 'tests': invalid_json()})
+        self.assertEqual(202, response.status_code)
+
+        submission = models.Submission.objects.get(pk=int(response.content))
+        self.assertEqual(models.Submission.FAILED, submission.status)
+        self.assertIsNotNone(submission.error_message)
+        self.assertIsNone(submission.test_run)
+
+    @patch('squad.core.tasks.process_submission.delay')
+    def test_submission_is_processed_once(self, delay):
+        response = self.submit({'async': '1', 'tests': '{"test1": "pass"}'})
+        submission_id = int(response.content)
+        process_submission(submission_id)
+        process_submission(submission_id)
+
+        self.assertEqual(1, models.TestRun.objects.count())
+        self.assertEqual(models.Submission.DONE, models.Submission.objects.get(pk=submission_id).status)
+
+    @patch('squad.core.tasks.ReceiveTestRun.__call__')
+    def test_records_unexpected_errors(self, receive):
+        receive.side_effect = RuntimeError('something broke')
+        response = self.submit({'async': '1', 'tests': '{"test1": "pass"}'})
+
+        submission = models.Submission.objects.get(pk=int(response.content))
+        self.assertEqual(models.Submission.FAILED, submission.status)
+        self.assertIn('something broke', submission.error_message)
+        self.assertIsNotNone(submission.processed_at)
+
+    def test_submission_status(self):
+        response = self.submit({'async': '1'})
+        submission = models.Submission.objects.get(pk=int(response.content))
+
+        data = self.client.get_json('/api/submission/%d' % submission.id).data
+        self.assertEqual(submission.id, data['id'])
+        self.assertEqual('done', data['status'])
+        self.assertIsNone(data['error_message'])
+        self.assertTrue(data['testrun'].endswith('/api/testruns/%d/' % submission.test_run_id))
+
+    def test_submission_status_on_private_project(self):
+        self.project.is_public = False
+        self.project.save()
+        response = self.submit({'async': '1'})
+
+        anonymous = Client()
+        status = anonymous.get('/api/submission/%s' % response.content.decode())
+        self.assertEqual(401, status.status_code)
+
+    def test_submission_status_not_found(self):
+        response = self.client.get('/api/submission/999')
+        self.assertEqual(404, response.status_code)
+
+
+def batch_archive(files, mode='w'):
+    data = BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as archive:
+        for name, contents in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            archive.addfile(info, BytesIO(contents))
+    data.seek(0)
+    data.name = 'batch.tar'
+    return data
+
+
+class BatchSubmissionApiTest(ApiTest):
+
+    def submit(self, archive):
+        return self.client.post(
+            '/api/submitbatch/mygroup/myproject/1.0.0',
+            {'archive': archive}
+        )
+
+    def test_submit_batch(self):
+        archive = batch_archive({
+            'env1/1/metadata.json': b'{"job_id": "1"}',
+            'env1/1/tests.json': b'{"test1": "pass"}',
+            'env1/1/log.txt': b'log text',
+            'env1/1/screenshot.png': b'PNG',
+            'env1/2/metrics.json': b'{"metric1": 1}',
+            'env2/3/tests.json': b'{"test1": "fail"}',
+        })
+        response = self.submit(archive)
+        self.assertEqual(201, response.status_code)
+
+        build = self.project.builds.get(version='1.0.0')
+        self.assertEqual(3, build.test_runs.count())
+        self.assertEqual(['env1', 'env2'], sorted(e.slug for e in self.project.environments.all()))
+
+        testrun = build.test_runs.get(job_id='1')
+        self.assertEqual('log text', testrun.log_file)
+        self.assertEqual(1, testrun.tests.count())
+        self.assertEqual(b'PNG', bytes(testrun.attachments.get(filename='screenshot.png').data))
+
+        # job directory name is used as job_id when there is no metadata
+        self.assertEqual(1, build.test_runs.get(job_id='2').metrics.count())
+
+        self.assertEqual(2, build.metrics_summary.count())
+        self.assertEqual(1, build.status.tests_pass)
+        self.assertEqual(1, build.status.tests_fail)
+
+    def test_submit_compressed_batch(self):
+        archive = batch_archive({'env1/1/tests.json': b'{"test1": "pass"}'}, mode='w:gz')
+        archive.name = 'batch.tar.gz'
+        response = self.submit(archive)
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(1, models.TestRun.objects.count())
+
+    def test_invalid_test_run_rejects_whole_batch(self):
+        archive = batch_archive({
+            'env1/1/tests.json': b'{"test1": "pass"}',
+            'env1/2/tests.json': b'{',
+        })
+        response = self.submit(archive)
+        self.assertEqual(400, response.status_code)
+        self.assertIn(b'env1', response.content)
+        self.assertEqual(0, models.TestRun.objects.count())
+
+    def test_invalid_environment_name(self):
+        archive = batch_archive({'../1/tests.json': b'{}'})
+        response = self.submit(archive)
+        self.assertEqual(400, response.status_code)
+
+    def test_invalid_archive(self):
+        archive = BytesIO(b'not an archive')
+        archive.name = 'batch.tar'
+        response = self.submit(archive)
+        self.assertEqual(400, response.status_code)
+
+    @override_settings(SQUAD_MAX_BATCH_FILES=2)
+    def test_too_many_files(self):
+        archive = batch_archive({
+            'env1/1/tests.json': b'{"test1": "pass"}',
+            'env1/2/tests.json': b'{"test1": "pass"}',
+            'env1/3/tests.json': b'{"test1": "pass"}',
+        })
+        response = self.submit(archive)
+        self.assertEqual(413, response.status_code)
+        self.assertEqual(0, models.TestRun.objects.count())
+
+    @override_settings(SQUAD_MAX_UPLOAD_SIZE=100)
+    def test_total_size_is_limited(self):
+        archive = batch_archive({
+            'env1/1/log.txt': b'x' * 60,
+            'env1/2/log.txt': b'x' * 60,
+        })
+        response = self.submit(archive)
+        self.assertEqual(413, response.status_code)
+        self.assertEqual(0, models.TestRun.objects.count())
+
+    def test_logs_and_attachments_are_passed_as_files(self):
+        archive = batch_archive({
+            'env1/1/log.txt': b'log text',
+            'env1/1/screenshot.png': b'PNG',
+        })
+        test_runs = read_batch_archive(SimpleUploadedFile('batch.tar', archive.getvalue()))
+
+        self.assertEqual(b'log text', test_runs[0]['log_file'].read())
+        self.assertEqual(b'PNG', test_runs[0]['attachments']['screenshot.png'].read())
+
+    def test_archive_is_required(self):
+        response = self.client.post('/api/submitbatch/mygroup/myproject/1.0.0')
+        self.assertEqual(400, response.status_code)
+
+    def test_unauthorized(self):
+        client = Client()
+        response = client.post(
+            '/api/submitbatch/mygroup/myproject/1.0.0',
+            {'archive': batch_archive({})}
+        )
+        self.assertEqual(403, response.status_code)
+
+
 class CreateBuildApiTest(ApiTest):
 
     def setUp(self):
@@ -0,0 +1,39 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from squad.core.models import Group, Test, Metric
+
+
+class BackfillTestKeysTest(TestCase):
+
+    def setUp(self):
+        self.group = Group.objects.create(slug='mygroup')
+        self.project = self.group.projects.create(slug='myproject')
+        self.environment = self.project.environments.create(slug='myenv')
+        self.suite = self.project.suites.create(slug='mysuite')
+        self.build = self.project.builds.create(version='1')
+        self.testrun = self.build.test_runs.create(environment=self.environment)
+
+    def test_backfill(self):
+        self.testrun.tests.create(suite=self.suite, name='foo', result=True)
+        self.testrun.metrics.create(suite=self.suite, name='bar', result=1)
+        # simulate data received before the keys were stored
+        Test.objects.update(build=None, environment=None, project=None)
+        Metric.objects.update(build=None, environment=None, project=None)
+
+        output = StringIO()
+        call_command('backfill_test_keys', '--batch-size', '1', stdout=output)
+        self.assertIn('Updated 1 tests and 1 metrics', output.getvalue())
+
+        for obj in (Test.objects.get(), Metric.objects.get()):
+            self.assertEqual(self.build.id, obj.build_id)
+            self.assertEqual(self.environment.id, obj.environment_id)
+            self.assertEqual(self.project.id, obj.project_id)
+
+    def test_already_filled(self):
+        self.testrun.tests.create(suite=self.suite, name='foo', result=True)
+        output = StringIO()
+        call_command('backfill_test_keys', stdout=output)
+        self.assertIn('Updated 0 tests and 0 metrics', output.getvalue())
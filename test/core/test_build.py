@@ -139,6 +139,46 @@ class BuildTest(TestCase):
         finished, _ = build.finished
         self.assertFalse(finished)
 
+    def test_finished_reasons(self):
+        build = self.project.builds.create(version='1')
+        env1 = self.project.environments.create(slug='env1', expected_test_runs=2)
+        self.project.environments.create(slug='env2', name='Environment 2')
+        self.project.environments.create(slug='env3', expected_test_runs=0)
+        build.test_runs.create(environment=env1)
+        finished, reasons = build.finished
+        self.assertFalse(finished)
+        self.assertEqual(
+            [
+                "2 test runs expected for env1, but only 1 received so far",
+                "No test runs for Environment 2 received so far",
+            ],
+            reasons
+        )
+
+    def test_finished_number_of_queries(self):
+        build = self.project.builds.create(version='1')
+        for i in range(5):
+            env = self.project.environments.create(slug='env%d' % i)
+            build.test_runs.create(environment=env)
+        build = Build.objects.select_related('project').get(pk=build.pk)
+        with self.assertNumQueries(1):
+            finished, _ = build.finished
+        self.assertTrue(finished)
+
+    def test_not_finished_with_pending_ci_jobs_and_no_environments(self):
+        build = self.project.builds.create(version='1')
+        backend = Backend.objects.create(name='foobar', implementation_type='null')
+        TestJob.objects.create(
+            backend=backend,
+            definition='blablabla',
+            target=build.project,
+            target_build=build,
+            environment='env1',
+        )
+        finished, reasons = build.finished
+        self.assertFalse(finished)
+        self.assertEqual(["There are unfinished CI jobs"], reasons)
+
     @patch('squad.ci.backend.null.Backend.job_url', return_value="http://example.com/123")
     @patch('squad.ci.backend.null.Backend.fetch')
     def test_not_finished_with_pending_ci_jobs(self, fetch, job_url):
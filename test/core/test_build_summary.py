@@ -3,6 +3,7 @@ from django.test import TestCase
 
 from squad.core.models import Group, BuildSummary
 from squad.core.statistics import geomean
+from squad.core.tasks import RecordTestRunStatus
 
 
 PRECISION_ERROR = 10e-9
@@ -96,3 +97,32 @@ class BuildSummaryTest(TestCase):
         self.assertEqual(1, summary2.tests_fail)
         self.assertEqual(1, summary2.tests_skip)
         self.assertEqual(0, summary2.tests_xfail)
+
+    def test_add_test_run(self):
+        summary = BuildSummary.create_or_update(self.build1, self.env1)
+        self.assertEqual(4, summary.metrics_count)
+
+        new_test_run = self.build1.test_runs.create(environment=self.env1, completed=False)
+        new_test_run.metrics.create(name='new_foo', suite=self.suite1, result=5)
+        new_test_run.tests.create(name='new_foo', suite=self.suite1, result=True)
+        RecordTestRunStatus()(new_test_run)
+
+        summary = BuildSummary.add_test_run(new_test_run)
+        self.assertTrue(eq(geomean([1, 2, 3, 4, 5]), summary.metrics_summary))
+        self.assertEqual(5, summary.metrics_count)
+        self.assertEqual(5, summary.tests_total)
+        self.assertEqual(2, summary.tests_pass)
+        self.assertEqual(2, summary.test_runs_total)
+        self.assertEqual(1, summary.test_runs_incomplete)
+
+    def test_add_test_run_with_repeated_tests(self):
+        BuildSummary.create_or_update(self.build1, self.env1)
+
+        new_test_run = self.build1.test_runs.create(environment=self.env1)
+        new_test_run.tests.create(name='bar', suite=self.suite1, result=True)
+        RecordTestRunStatus()(new_test_run)
+
+        summary = BuildSummary.add_test_run(new_test_run)
+        self.assertEqual(4, summary.tests_total)
+        self.assertEqual(2, summary.tests_pass)
+        self.assertEqual(0, summary.tests_fail)
@@ -0,0 +1,137 @@
+from django.test import TestCase
+from unittest.mock import patch
+
+
+from squad.core import cache
+from squad.core.cache import ModelCache
+from squad.core.models import Group, Suite, SuiteMetadata
+from squad.core.tasks import get_suite, get_suite_metadata
+
+
+def run_immediately(func):
+    func()
+
+
+@patch('squad.core.cache.transaction.on_commit', run_immediately)
+class ModelCacheTest(TestCase):
+
+    def setUp(self):
+        group = Group.objects.create(slug='mygroup')
+        self.project = group.projects.create(slug='myproject')
+        self.suite1 = self.project.suites.create(slug='suite1')
+        self.suite2 = self.project.suites.create(slug='suite2')
+
+    def test_get_and_add(self):
+        c = ModelCache(10)
+        self.assertIsNone(c.get('suite1'))
+        c.add('suite1', self.suite1)
+        self.assertEqual(self.suite1, c.get('suite1'))
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10}, c.info())
+
+    def test_least_recently_used_is_evicted(self):
+        suite3 = self.project.suites.create(slug='suite3')
+        c = ModelCache(2)
+        c.add('suite1', self.suite1)
+        c.add('suite2', self.suite2)
+        c.get('suite1')
+        c.add('suite3', suite3)
+        self.assertEqual(2, len(c))
+        self.assertIsNone(c.get('suite2'))
+        self.assertEqual(self.suite1, c.get('suite1'))
+        self.assertEqual(suite3, c.get('suite3'))
+
+    def test_invalidate(self):
+        c = ModelCache(10)
+        c.add('suite1', self.suite1)
+        c.invalidate(self.suite1)
+        self.assertIsNone(c.get('suite1'))
+
+    def test_disabled(self):
+        c = ModelCache(0)
+        c.add('suite1', self.suite1)
+        self.assertEqual(0, len(c))
+
+
+@patch('squad.core.cache.transaction.on_commit', run_immediately)
+@patch.object(cache.suites, 'maxsize', 100)
+@patch.object(cache.suite_metadata, 'maxsize', 100)
+class SuiteCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        group = Group.objects.create(slug='mygroup')
+        self.project = group.projects.create(slug='myproject')
+        build = self.project.builds.create(version='1')
+        environment = self.project.environments.create(slug='myenv')
+        self.testrun = build.test_runs.create(environment=environment)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_get_suite_is_cached(self):
+        suite = get_suite(self.testrun, 'foo')
+        with self.assertNumQueries(0):
+            self.assertEqual(suite, get_suite(self.testrun, 'foo'))
+
+    def test_suite_metadata_is_cached(self):
+        metadata = get_suite_metadata('test', [('foo', 'bar')])
+        with self.assertNumQueries(0):
+            self.assertEqual(metadata, get_suite_metadata('test', [('foo', 'bar')]))
+
+    def test_deleted_suite_is_evicted(self):
+        suite = get_suite(self.testrun, 'foo')
+        suite.delete()
+        self.assertNotEqual(suite.id, get_suite(self.testrun, 'foo').id)
+
+    def test_moved_suite_is_evicted(self):
+        suite = get_suite(self.testrun, 'foo')
+        other_project = self.project.group.projects.create(slug='otherproject')
+        suite.project = other_project
+        suite.save()
+        self.assertNotEqual(suite.id, get_suite(self.testrun, 'foo').id)
+
+    def test_deleted_suite_metadata_is_evicted(self):
+        metadata = get_suite_metadata('test', [('foo', 'bar')])[('foo', 'bar')]
+        SuiteMetadata.objects.get(pk=metadata.pk).delete()
+        self.assertNotEqual(metadata.id, get_suite_metadata('test', [('foo', 'bar')])[('foo', 'bar')].id)
+
+    def test_evicted_on_changes_by_other_processes(self):
+        suite = get_suite(self.testrun, 'foo')
+        # another process deletes the suite, which only invalidates its own
+        # cache but bumps the shared generation
+        Suite.objects.filter(pk=suite.pk).delete()
+        cache.__next_generation__()
+        self.assertNotEqual(suite.id, get_suite(self.testrun, 'foo').id)
+
+    def test_changes_bump_generation(self):
+        suite = get_suite(self.testrun, 'foo')
+        generation = cache.generation()
+        suite.name = 'Foo'
+        suite.save()
+        self.assertNotEqual(generation, cache.generation())
+
+    def test_invalidate_all(self):
+        get_suite(self.testrun, 'foo')
+        generation = cache.generation()
+        cache.invalidate_all()
+        self.assertNotEqual(generation, cache.generation())
+        self.assertEqual(0, len(cache.suites))
+
+    def test_generation_is_read_once_per_batch(self):
+        with patch('squad.core.cache.generation', return_value=0) as generation:
+            get_suite_metadata('test', [('foo', 'test%d' % i) for i in range(100)])
+            get_suite_metadata('test', [('foo', 'test%d' % i) for i in range(100)])
+        self.assertEqual(2, generation.call_count)
+
+    def test_evicted_on_refresh_only(self):
+        suite = get_suite(self.testrun, 'foo')
+        cache.__next_generation__()
+        self.assertEqual(suite, cache.suites.get((self.project.id, 'foo')))
+        cache.refresh()
+        self.assertIsNone(cache.suites.get((self.project.id, 'foo')))
+
+    def test_not_cached_before_commit(self):
+        with patch('squad.core.cache.transaction.on_commit'):
+            get_suite(self.testrun, 'foo')
+        self.assertEqual(0, len(cache.suites))
+        self.assertEqual(1, Suite.objects.filter(slug='foo').count())
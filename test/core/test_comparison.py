@@ -1,4 +1,5 @@
 import json
+from unittest.mock import patch
 
 
 from django.test import TestCase
@@ -178,3 +179,130 @@ class TestComparisonTest(TestCase):
         comparison = TestComparison.compare_builds(self.build1, self.build2)
         fixes = comparison.fixes
         self.assertEqual({}, fixes)
+
+    def test_regressions_and_fixes_match_results_table(self):
+        from_database = TestComparison.compare_builds(self.build1, self.build2)
+        from_table = TestComparison.compare_builds(self.build1, self.build2)
+        from_table.results  # load the table first
+        self.assertEqual(from_table.regressions, from_database.regressions)
+        self.assertEqual(from_table.fixes, from_database.fixes)
+        self.assertEqual(from_table.regressions_grouped_by_suite, from_database.regressions_grouped_by_suite)
+        self.assertEqual(from_table.fixes_grouped_by_suite, from_database.fixes_grouped_by_suite)
+
+    def test_regressions_only_load_changed_tests(self):
+        self.receive_test_run(self.project1, '2', 'myenv', {'test%d' % i: 'pass' for i in range(20)})
+        self.receive_test_run(self.project1, '3', 'myenv', {'test%d' % i: ('fail' if i == 5 else 'pass') for i in range(20)})
+        builds = self.project1.builds.order_by('-id')[:2]
+
+        comparison = TestComparison(builds[1], builds[0])
+        with self.assertNumQueries(4):  # test runs, environments, changed tests, names
+            self.assertEqual({'myenv': ['test5']}, comparison.regressions)
+
+    def test_latest_test_run_wins(self):
+        self.receive_test_run(self.project1, '2', 'myenv', {'a': 'pass'})
+        self.receive_test_run(self.project1, '3', 'myenv', {'a': 'fail'})
+        self.receive_test_run(self.project1, '3', 'myenv', {'a': 'pass'})
+        build2 = self.project1.builds.get(version='2')
+        build3 = self.project1.builds.get(version='3')
+
+        comparison = TestComparison.compare_builds(build2, build3)
+        self.assertEqual({}, comparison.regressions)
+        self.assertEqual({}, TestComparison.compare_builds(build3, build2).fixes)
+
+    def test_results_can_be_sliced(self):
+        comp = compare(self.build0, self.build1)
+        rows = comp.results.items()
+        self.assertEqual(5, len(rows))
+        self.assertEqual(['c', 'd/e'], [name for name, _ in rows[2:4]])
+        self.assertEqual('fail', rows[2][1][self.build1, 'myenv'])
+        self.assertEqual('z', rows[-1][0])
+
+    def test_results_of_unknown_test(self):
+        comp = compare(self.build0, self.build1)
+        self.assertNotIn('nonexistent', comp.results)
+        self.assertIn('d/e', comp.results)
+
+    def test_results_of_tests_without_metadata(self):
+        models.Test.objects.filter(build=self.build1, name='c').update(metadata=None)
+        comp = TestComparison(self.build0, self.build1)
+        self.assertEqual('fail', comp.results['c'][self.build1, 'myenv'])
+        self.assertEqual('pass', comp.results['a'][self.build1, 'myenv'])
+
+    def test_results_latest_test_run_wins(self):
+        self.receive_test_run(self.project1, '2', 'myenv', {'a': 'fail'})
+        self.receive_test_run(self.project1, '2', 'myenv', {'a': 'pass'})
+        build2 = self.project1.builds.get(version='2')
+
+        comp = compare(self.build1, build2)
+        self.assertEqual('pass', comp.results['a'][build2, 'myenv'])
+
+    def test_intermittent_issues_are_looked_up_once(self):
+        tests = models.Test.objects.filter(test_run__build=self.build1, name='c')
+        tests.update(has_known_issues=True)
+        intermittent = models.KnownIssue.objects.create(title='intermittent', intermittent=True)
+        other = models.KnownIssue.objects.create(title='not intermittent')
+        for test in tests:
+            test.known_issues.add(intermittent, other)
+
+        comparison = TestComparison(self.build1, self.build2)
+        comparison.diff  # load the table, so fixes are computed from it
+        # known issues, test names, environments
+        with self.assertNumQueries(3):
+            self.assertEqual({}, comparison.fixes)
+
+    def test_stored_comparison_is_reused(self):
+        first = TestComparison.between(self.build1, self.build2)
+        regressions, fixes, diff = first.regressions, first.fixes, first.diff
+
+        # build comparison, statuses of both builds
+        with self.assertNumQueries(2):
+            second = TestComparison.between(self.build1, self.build2)
+        with self.assertNumQueries(0):
+            self.assertEqual(regressions, second.regressions)
+            self.assertEqual(fixes, second.fixes)
+            self.assertEqual(diff, second.diff)
+        self.assertEqual(1, models.BuildComparison.objects.count())
+
+    def test_stored_comparison_is_not_written_when_up_to_date(self):
+        TestComparison.between(self.build1, self.build2).regressions
+        stored = models.BuildComparison.objects.get()
+
+        with patch.object(models.BuildComparison, 'save') as save:
+            TestComparison.between(self.build1, self.build2).regressions
+        save.assert_not_called()
+        self.assertEqual(stored.computed_at, models.BuildComparison.objects.get().computed_at)
+
+    def test_ad_hoc_comparison_is_not_stored(self):
+        comparison = TestComparison.compare_builds(self.build1, self.build2)
+        comparison.regressions, comparison.fixes, comparison.diff
+        self.assertFalse(models.BuildComparison.objects.exists())
+
+    def test_build_without_status_is_not_stored(self):
+        models.ProjectStatus.objects.filter(build=self.build1).delete()
+        comparison = TestComparison.between(self.build1, self.build2)
+        self.assertEqual(TestComparison(self.build1, self.build2).diff, comparison.diff)
+        self.assertFalse(models.BuildComparison.objects.exists())
+
+    def test_stored_comparison_has_same_results(self):
+        stored = TestComparison.between(self.build1, self.build2)
+        stored.regressions, stored.fixes, stored.diff
+        stored = TestComparison.between(self.build1, self.build2)
+        computed = TestComparison(self.build1, self.build2)
+
+        self.assertEqual(computed.regressions, stored.regressions)
+        self.assertEqual(computed.fixes, stored.fixes)
+        self.assertEqual(computed.diff, stored.diff)
+        self.assertEqual(computed.regressions_grouped_by_suite, stored.regressions_grouped_by_suite)
+        self.assertEqual(list(computed.diff.keys()), list(stored.diff.keys()))
+
+    def test_stored_comparison_is_discarded_when_status_is_updated(self):
+        TestComparison.between(self.build0, self.build1).regressions
+        stored = models.BuildComparison.objects.get(baseline=self.build0, target=self.build1)
+        self.assertIsNotNone(stored.regressions)
+
+        self.receive_test_run(self.project1, '1', 'myenv', {'z': 'fail'})
+
+        comparison = TestComparison.between(self.build0, self.build1)
+        self.assertEqual({'myenv': ['z']}, comparison.regressions)
+        stored.refresh_from_db()
+        self.assertEqual({'myenv': ['z']}, json.loads(stored.regressions))
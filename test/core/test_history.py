@@ -80,6 +80,13 @@ class TestHistoryTest(TestCase):
         self.assertEqual('pass', history.results[build2][env1].status)
         self.assertEqual('fail', history.results[build2][env2].status)
 
+    def test_unknown_test(self):
+        history = TestHistory(self.project1, 'foo/unknown')
+        build1 = self.project1.builds.get(version='1')
+
+        self.assertEqual([], history.environments)
+        self.assertEqual({}, history.results[build1])
+
     def test_displays_all_builds(self):
         build0 = self.project1.builds.get(version='0')
         history = TestHistory(self.project1, 'root')
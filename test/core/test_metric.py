@@ -1,8 +1,9 @@
+import struct
 from django.test import TestCase
 from unittest.mock import patch
 
 
-from squad.core.models import Metric, Suite
+from squad.core.models import Group, Metric, Suite
 
 
 class MetricTest(TestCase):
@@ -12,13 +13,33 @@ class MetricTest(TestCase):
         self.assertEqual([], m.measurement_list)
 
     def test_measuremens_list_empty(self):
-        m = Metric(measurements='')
+        m = Metric(measurements=b'')
         self.assertEqual([], m.measurement_list)
 
     def test_measuremens_list(self):
-        m = Metric(measurements='1,2.5,3')
+        m = Metric(measurements=Metric.pack_measurements([1, 2.5, 3]))
         self.assertEqual([1, 2.5, 3], m.measurement_list)
 
+    def test_measurements_packed_as_float64(self):
+        data = Metric.pack_measurements([1, 2.5, 3])
+        self.assertEqual(24, len(data))
+        self.assertEqual((1.0, 2.5, 3.0), struct.unpack('<3d', data))
+
+    def test_measurement_array(self):
+        m = Metric(measurements=Metric.pack_measurements([1, 2.5, 3]))
+        self.assertEqual(3, len(m.measurement_array))
+        self.assertEqual(2.5, m.measurement_array[1])
+
+    def test_measurements_stored(self):
+        project = Group.objects.create(slug='mygroup').projects.create(slug='myproject')
+        build = project.builds.create(version='1')
+        test_run = build.test_runs.create(environment=project.environments.create(slug='env'))
+        suite = project.suites.create(slug='suite')
+        test_run.metrics.create(name='foo', suite=suite, result=2, measurements=Metric.pack_measurements([1, 2, 3]))
+
+        m = Metric.objects.get(name='foo')
+        self.assertEqual([1, 2, 3], m.measurement_list)
+
     @patch("squad.core.models.join_name", lambda x, y: 'woooops')
     def test_full_name(self):
         s = Suite()
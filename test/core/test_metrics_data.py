@@ -24,12 +24,20 @@ class JSONMetricDataParserTest(TestCase):
         self.assertEqual([], parser(None))
         self.assertEqual([], parser(''))
         self.assertEqual([], parser('{}'))
+        self.assertEqual([], parser({}))
 
     def test_basics(self):
         data = parser(TEST_DATA)
         self.assertEqual(5, len(data))
         self.assertIsInstance(data, list)
 
+    def test_decoded_data(self):
+        data = parser({"group1/var": 50, "multiple": [1, 2]})
+        self.assertEqual(
+            [('group1', 'var', 50.0, [50.0]), ('/', 'multiple', 1.5, [1, 2])],
+            [(m['group_name'], m['name'], m['result'], m['measurements']) for m in data]
+        )
+
     def test_metric_name(self):
         data = parser(TEST_DATA)
         names = [t['name'] for t in data]
@@ -2,7 +2,8 @@ from django.utils import timezone
 from django.test import TestCase
 from dateutil.relativedelta import relativedelta
 
-from squad.core.models import Group, ProjectStatus, MetricThreshold
+from squad.core.models import Group, ProjectStatus, MetricThreshold, StatusChange
+from squad.core.tasks import RecordTestRunStatus
 
 
 def h(n):
@@ -201,8 +202,8 @@ class ProjectStatusTest(TestCase):
         test_run2.tests.create(name='foo', suite=self.suite, result=False)
         status = ProjectStatus.create_or_update(build2)
 
-        self.assertIsNotNone(status.regressions)
-        self.assertIsNone(status.fixes)
+        self.assertTrue(status.get_regressions())
+        self.assertEqual({}, status.get_fixes())
 
     def test_cache_regressions_update(self):
         build1 = self.create_build('1', datetime=h(10))
@@ -215,16 +216,16 @@ class ProjectStatusTest(TestCase):
         test_run2.tests.create(name='foo', suite=self.suite, result=True)
         status1 = ProjectStatus.create_or_update(build2)
 
-        self.assertIsNone(status1.regressions)
-        self.assertIsNone(status1.fixes)
+        self.assertEqual({}, status1.get_regressions())
+        self.assertEqual({}, status1.get_fixes())
 
         build3 = self.create_build('3', datetime=h(8))
         test_run3 = build3.test_runs.first()
         test_run3.tests.create(name='foo', suite=self.suite, result=False)
         status2 = ProjectStatus.create_or_update(build3)
 
-        self.assertIsNotNone(status2.regressions)
-        self.assertIsNone(status2.fixes)
+        self.assertTrue(status2.get_regressions())
+        self.assertEqual({}, status2.get_fixes())
 
     def test_cache_fixes(self):
         build1 = self.create_build('1', datetime=h(10))
@@ -237,8 +238,8 @@ class ProjectStatusTest(TestCase):
         test_run2.tests.create(name='foo', suite=self.suite, result=True)
         status = ProjectStatus.create_or_update(build2)
 
-        self.assertIsNotNone(status.fixes)
-        self.assertIsNone(status.regressions)
+        self.assertTrue(status.get_fixes())
+        self.assertEqual({}, status.get_regressions())
 
     def test_cache_fixes_update(self):
         build1 = self.create_build('1', datetime=h(10))
@@ -251,16 +252,16 @@ class ProjectStatusTest(TestCase):
         test_run2.tests.create(name='foo', suite=self.suite, result=False)
         status1 = ProjectStatus.create_or_update(build2)
 
-        self.assertIsNone(status1.fixes)
-        self.assertIsNone(status1.regressions)
+        self.assertEqual({}, status1.get_fixes())
+        self.assertEqual({}, status1.get_regressions())
 
         build3 = self.create_build('3', datetime=h(8))
         test_run3 = build3.test_runs.first()
         test_run3.tests.create(name='foo', suite=self.suite, result=True)
         status2 = ProjectStatus.create_or_update(build3)
 
-        self.assertIsNotNone(status2.fixes)
-        self.assertIsNone(status2.regressions)
+        self.assertTrue(status2.get_fixes())
+        self.assertEqual({}, status2.get_regressions())
 
     def test_get_exceeded_thresholds(self):
         build = self.create_build('1')
@@ -303,3 +304,121 @@ class ProjectStatusTest(TestCase):
         fixes3 = status3.get_fixes()
         self.assertEqual(len(fixes3['theenvironment']), 1)
         self.assertEqual(fixes3['theenvironment'][0], 'foo')
+
+
+class ProjectStatusIncrementalUpdateTest(TestCase):
+
+    def setUp(self):
+        self.group = Group.objects.create(slug='mygroup')
+        self.project = self.group.projects.create(slug='myproject')
+        self.env1 = self.project.environments.create(slug='env1')
+        self.env2 = self.project.environments.create(slug='env2')
+        self.suite = self.project.suites.create(slug='suite')
+
+        self.build1 = self.project.builds.create(version='1', datetime=h(10))
+        self.receive(self.build1, self.env1, {'foo': True, 'bar': False})
+        self.receive(self.build1, self.env2, {'foo': True, 'bar': False})
+        ProjectStatus.create_or_update(self.build1)
+
+        self.build2 = self.project.builds.create(version='2', datetime=h(9))
+
+    def receive(self, build, environment, tests, metrics={}, completed=True):
+        testrun = build.test_runs.create(environment=environment, completed=completed)
+        for name, result in tests.items():
+            testrun.tests.create(name=name, suite=self.suite, result=result)
+        for name, result in metrics.items():
+            testrun.metrics.create(name=name, suite=self.suite, result=result)
+        RecordTestRunStatus()(testrun)
+        return ProjectStatus.add_test_run(testrun)
+
+    def assertSameAsFullUpdate(self, status):
+        status.refresh_from_db()
+        full = ProjectStatus.create_or_update(self.build2)
+        for field in ('tests_pass', 'tests_fail', 'tests_xfail', 'tests_skip',
+                      'has_metrics', 'metrics_count', 'test_runs_total',
+                      'test_runs_completed', 'test_runs_incomplete',
+                      'finished', 'baseline_id'):
+            self.assertEqual(getattr(full, field), getattr(status, field), field)
+        self.assertAlmostEqual(full.metrics_summary, status.metrics_summary)
+        self.assertEqual(full.get_regressions(), status.get_regressions())
+        self.assertEqual(full.get_fixes(), status.get_fixes())
+
+    def test_adds_test_run_results(self):
+        self.receive(self.build2, self.env1, {'foo': True}, {'m1': 2})
+        self.receive(self.build2, self.env1, {'baz': None}, {'m2': 8, 'm3': 0})
+        status = self.receive(self.build2, self.env2, {'foo': False, 'bar': True}, completed=False)
+
+        self.assertEqual(2, status.tests_pass)
+        self.assertEqual(1, status.tests_fail)
+        self.assertEqual(1, status.tests_skip)
+        self.assertEqual(3, status.test_runs_total)
+        self.assertEqual(2, status.test_runs_completed)
+        self.assertEqual(1, status.test_runs_incomplete)
+        self.assertTrue(status.has_metrics)
+        self.assertEqual(2, status.metrics_count)
+        self.assertAlmostEqual(4.0, status.metrics_summary)
+        self.assertSameAsFullUpdate(status)
+
+    def test_regressions_and_fixes_per_environment(self):
+        status = self.receive(self.build2, self.env1, {'foo': False, 'bar': True})
+        self.assertEqual({'env1': ['suite/foo']}, status.get_regressions())
+        self.assertEqual({'env1': ['suite/bar']}, status.get_fixes())
+        self.assertEqual(self.build1, status.baseline)
+
+        status = self.receive(self.build2, self.env2, {'foo': False})
+        self.assertEqual(['env1', 'env2'], list(status.get_regressions().keys()))
+        self.assertEqual({'env1': ['suite/bar']}, status.get_fixes())
+        self.assertSameAsFullUpdate(status)
+
+    def test_repeated_tests_fall_back_to_full_update(self):
+        self.receive(self.build2, self.env1, {'foo': False})
+        status = self.receive(self.build2, self.env1, {'foo': True})
+
+        self.assertEqual(1, status.tests_pass)
+        self.assertEqual(0, status.tests_fail)
+        self.assertEqual({}, status.get_regressions())
+        self.assertSameAsFullUpdate(status)
+
+    def test_regressions_and_fixes_are_stored_as_rows(self):
+        status = self.receive(self.build2, self.env1, {'foo': False, 'bar': True})
+        self.receive(self.build2, self.env2, {'foo': False})
+
+        changes = StatusChange.objects.filter(status=status).order_by('kind', 'environment_id')
+        self.assertEqual(
+            [(StatusChange.FIX, self.env1, 'suite/bar'), (StatusChange.REGRESSION, self.env1, 'suite/foo'), (StatusChange.REGRESSION, self.env2, 'suite/foo')],
+            [(c.kind, c.environment, c.full_name) for c in changes]
+        )
+        self.assertEqual({self.project.id}, set(c.project_id for c in changes))
+
+    def test_regression_feed(self):
+        self.receive(self.build2, self.env1, {'foo': False, 'bar': False, 'baz': True})
+        ProjectStatus.objects.filter(build=self.build2).update(finished=True)
+        build3 = self.project.builds.create(version='3', datetime=h(8))
+        self.receive(build3, self.env1, {'foo': True, 'bar': False, 'baz': False})
+
+        feed = StatusChange.objects.feed(self.project)
+        self.assertEqual(
+            [(build3, self.env1, 'suite/baz'), (self.build2, self.env1, 'suite/foo')],
+            [(c.status.build, c.environment, c.full_name) for c in feed]
+        )
+        fixes = StatusChange.objects.feed(self.project, StatusChange.FIX)
+        self.assertEqual([(build3, 'suite/foo')], [(c.status.build, c.full_name) for c in fixes])
+
+    def test_same_test_in_another_environment(self):
+        self.receive(self.build2, self.env1, {'foo': False})
+        status = self.receive(self.build2, self.env2, {'foo': True})
+
+        self.assertEqual(1, status.tests_pass)
+        self.assertEqual(1, status.tests_fail)
+        self.assertSameAsFullUpdate(status)
+
+    def test_missed_test_run_falls_back_to_full_update(self):
+        missed = self.build2.test_runs.create(environment=self.env1)
+        missed.tests.create(name='foo', suite=self.suite, result=True)
+        RecordTestRunStatus()(missed)
+
+        status = self.receive(self.build2, self.env2, {'foo': True})
+
+        self.assertEqual(2, status.tests_pass)
+        self.assertEqual(2, status.test_runs_total)
+        self.assertSameAsFullUpdate(status)
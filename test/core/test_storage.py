@@ -0,0 +1,238 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.test import Client
+from django.test.utils import override_settings
+
+
+from squad.core import storage
+from squad.core.models import Group, TestRun
+from squad.core.storage import FileSystemBlobStore
+from squad.core.tasks import ReceiveTestRun
+
+
+class FileSystemBlobStoreTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FileSystemBlobStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_and_read(self):
+        key, length = self.store.put(b'hello world')
+        self.assertEqual(11, length)
+        self.assertEqual(b'hello world', self.store.read(key))
+
+    def test_content_addressed(self):
+        key1, _ = self.store.put(b'hello world')
+        key2, _ = self.store.put(BytesIO(b'hello world'))
+        self.assertEqual(key1, key2)
+        self.assertEqual([key1], list(self.store.keys()))
+
+    def test_stored_compressed(self):
+        key, _ = self.store.put(b'x' * 100000)
+        path = os.path.join(self.directory, key[0:2], key[2:4], key + '.gz')
+        self.assertLess(os.path.getsize(path), 1000)
+        self.assertEqual(b'x' * 100000, gzip.open(path).read())
+
+    def test_size(self):
+        key, _ = self.store.put(b'x' * 100000)
+        self.assertEqual(100000, self.store.size(key))
+
+    def test_size_of_large_blobs(self):
+        with patch('squad.core.storage.GZIP_MAX_SIZE', 10):
+            key, _ = self.store.put(b'hello world')
+        size_path = os.path.join(self.directory, key[0:2], key[2:4], key + '.size')
+        self.assertTrue(os.path.exists(size_path))
+        with open(size_path, 'w') as f:
+            f.write(str(2 ** 32 + 11))
+        self.assertEqual(2 ** 32 + 11, self.store.size(key))
+        self.assertEqual([key], list(self.store.keys()))
+
+        self.store.delete(key)
+        self.assertFalse(os.path.exists(size_path))
+
+    def test_stream(self):
+        key, _ = self.store.put(b'x' * 100000)
+        with self.store.open(key) as f:
+            self.assertEqual(b'x' * 10, f.read(10))
+
+    def test_delete(self):
+        key, _ = self.store.put(b'hello world')
+        self.store.delete(key)
+        self.assertFalse(self.store.exists(key))
+        self.store.delete(key)  # no error
+
+    def test_keys_older_than(self):
+        self.store.put(b'hello world')
+        self.assertEqual([], list(self.store.keys(older_than=3600)))
+
+
+class BlobStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(
+            SQUAD_BLOB_STORE='squad.core.storage.FileSystemBlobStore',
+            SQUAD_BLOB_STORE_DIR=self.directory,
+        )
+        self.settings.enable()
+
+        group = Group.objects.create(slug='mygroup')
+        self.project = group.projects.create(slug='myproject')
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def receive(self, job_id, **kwargs):
+        return ReceiveTestRun(self.project)(
+            version='1',
+            environment_slug='myenv',
+            metadata_file='{"job_id": "%s"}' % job_id,
+            **kwargs
+        )
+
+
+class TestRunBlobsTest(BlobStoreTestCase):
+
+    def test_files_go_to_blob_store(self):
+        testrun = self.receive('1', tests_file='{"test1": "pass"}', log_file='boot log')
+        testrun = TestRun.objects.get(pk=testrun.pk)
+
+        self.assertIsNone(testrun.tests_file)
+        self.assertIsNone(testrun.log_file)
+        self.assertIsNone(testrun.metadata_file)
+        self.assertIsNone(testrun.metrics_file_blob)
+        self.assertEqual('boot log', testrun.get_file('log_file'))
+        self.assertEqual(b'boot log', testrun.open_file('log_file').read())
+        self.assertEqual({"job_id": "1"}, testrun.metadata)
+        self.assertTrue(testrun.has_file('tests_file'))
+        self.assertFalse(testrun.has_file('metrics_file'))
+        self.assertEqual(1, testrun.tests.count())
+
+    def test_log_file_is_streamed(self):
+        log = b'boot\x00 log' + (b'x' * storage.CHUNK_SIZE) + b'\x00\x00end'
+        reads = []
+
+        class Upload(BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return super(Upload, self).read(size)
+
+        testrun = self.receive('1', log_file=Upload(log))
+        testrun = TestRun.objects.get(pk=testrun.pk)
+
+        self.assertEqual(log.replace(b'\x00', b''), testrun.open_file('log_file').read())
+        self.assertNotIn(-1, reads)
+        self.assertTrue(all(size <= storage.CHUNK_SIZE for size in reads))
+
+    def test_log_file_must_be_text(self):
+        with self.assertRaises(UnicodeDecodeError):
+            self.receive('1', log_file=BytesIO(b'\xff\xfe'))
+        self.assertEqual([], list(storage.get_store().keys()))
+
+    def test_duplicates_stored_once(self):
+        t1 = self.receive('1', log_file='same boot log')
+        t2 = self.receive('2', log_file='same boot log')
+        self.assertEqual(t1.log_file_blob, t2.log_file_blob)
+
+    def test_attachments(self):
+        testrun = self.receive('1', attachments={'foo.txt': b'foo', 'bar.txt': BytesIO(b'barbar')})
+        foo = testrun.attachments.get(filename='foo.txt')
+        bar = testrun.attachments.get(filename='bar.txt')
+        self.assertIsNone(foo.data)
+        self.assertEqual(3, foo.length)
+        self.assertEqual(6, bar.length)
+        self.assertEqual(b'barbar', bar.open().read())
+
+    def test_legacy_data_in_database(self):
+        testrun = self.receive('1')
+        testrun.log_file = 'old log'
+        testrun.log_file_blob = None
+        testrun.save()
+        self.assertEqual('old log', TestRun.objects.get(pk=testrun.pk).get_file('log_file'))
+
+    def test_download_views(self):
+        testrun = self.receive('1', log_file='boot log', attachments={'foo.txt': b'foo'})
+        client = Client()
+        client.force_login(User.objects.create(username='theuser'))
+
+        response = client.get('/mygroup/myproject/build/1/testrun/1/log')
+        self.assertEqual(b'boot log', b''.join(response.streaming_content))
+
+        response = client.get('/mygroup/myproject/build/1/testrun/1/attachments/foo.txt')
+        self.assertEqual(b'foo', b''.join(response.streaming_content))
+
+        response = client.get('/api/testruns/%d/log_file/' % testrun.id)
+        self.assertEqual(b'boot log', b''.join(response.streaming_content))
+
+        response = client.get('/api/testruns/%d/log_file/' % testrun.id, HTTP_RANGE='bytes=5-')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b'log', b''.join(response.streaming_content))
+        self.assertEqual('"%s"' % testrun.log_file_blob, response['ETag'])
+
+
+class MigrateBlobsTest(BlobStoreTestCase):
+
+    def test_migrate(self):
+        with override_settings(SQUAD_BLOB_STORE=None):
+            testrun = self.receive('1', log_file='boot log', attachments={'foo.txt': b'foo'})
+        testrun = TestRun.objects.get(pk=testrun.pk)
+        self.assertEqual('boot log', testrun.log_file)
+
+        call_command('migrate_blobs', stdout=StringIO())
+
+        testrun = TestRun.objects.get(pk=testrun.pk)
+        self.assertIsNone(testrun.log_file)
+        self.assertEqual('boot log', testrun.get_file('log_file'))
+        self.assertEqual({"job_id": "1"}, testrun.metadata)
+        attachment = testrun.attachments.get()
+        self.assertIsNone(attachment.data)
+        self.assertEqual(b'foo', attachment.open().read())
+
+
+class CleanupBlobsTest(BlobStoreTestCase):
+
+    def test_cleanup(self):
+        testrun = self.receive('1', log_file='boot log')
+        store = storage.get_store()
+        orphan, _ = store.put(b'orphan')
+
+        call_command('cleanup_blobs', '--min-age=0', stdout=StringIO())
+
+        self.assertFalse(store.exists(orphan))
+        self.assertTrue(store.exists(testrun.log_file_blob))
+        self.assertTrue(store.exists(testrun.metadata_file_blob))
+
+    def test_keeps_blobs_stored_again_after_listing(self):
+        store = storage.get_store()
+        orphan, _ = store.put(b'orphan')
+        keys = store.keys
+
+        def keys_then_store_again(*args, **kwargs):
+            listed = list(keys(*args, **kwargs))
+            later = time.time() + 10
+            os.utime(store.__path__(orphan), (later, later))
+            return listed
+
+        with patch.object(store, 'keys', keys_then_store_again):
+            call_command('cleanup_blobs', '--min-age=0', stdout=StringIO())
+        self.assertTrue(store.exists(orphan))
+
+    def test_keeps_recent_blobs(self):
+        store = storage.get_store()
+        orphan, _ = store.put(b'orphan')
+        call_command('cleanup_blobs', stdout=StringIO())
+        self.assertTrue(store.exists(orphan))
@@ -1,28 +1,37 @@
 import datetime
 import json
 import re
+from io import BytesIO
 import yaml
 
 
 from dateutil.relativedelta import relativedelta
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from unittest.mock import patch
 
 
-from squad.core.models import Group, TestRun, Status, Build, ProjectStatus, SuiteVersion, PatchSource, KnownIssue, EmailTemplate
+from squad.core import retention
+from squad.core.models import Group, TestRun, Status, Build, ProjectStatus, SuiteVersion, SuiteMetadata, PatchSource, KnownIssue, EmailTemplate, PendingStatusUpdate, Metric, Test, Attachment, CleanupProgress, BuildSummary
 from squad.core.tasks import ParseTestRunData
 from squad.core.tasks import PostProcessTestRun
 from squad.core.tasks import RecordTestRunStatus
 from squad.core.tasks import UpdateProjectStatus
+from squad.core.tasks import ScheduleStatusUpdate
+from squad.core.tasks import update_build_status
+from squad.core.tasks import update_overdue_build_statuses
 from squad.core.tasks import ProcessTestRun
 from squad.core.tasks import ProcessAllTestRuns
 from squad.core.tasks import ReceiveTestRun
+from squad.core.tasks import ReceiveTestRunBatch
 from squad.core.tasks import ValidateTestRun
 from squad.core.tasks import CreateBuild
 from squad.core.tasks import exceptions
 from squad.core.tasks import cleanup_old_builds
 from squad.core.tasks import cleanup_build
+from squad.core.tasks import cleanup_project
 from squad.core.tasks import prepare_report
 from squad.core.tasks import update_delayed_report
 
@@ -317,6 +326,46 @@ class ParseTestRunDataTest(CommonTestCase):
         self.assertEqual(metric.suite.slug, metadata.suite)
         self.assertEqual('metric', metadata.kind)
 
+    def test_reuses_existing_metadata(self):
+        ParseTestRunData()(self.testrun)
+        count = SuiteMetadata.objects.count()
+
+        build = self.testrun.build.project.builds.create(version='2.0.0')
+        testrun = build.test_runs.create(
+            environment=self.environment,
+            tests_file=self.testrun.tests_file,
+            metrics_file=self.testrun.metrics_file,
+        )
+        ParseTestRunData()(testrun)
+
+        self.assertEqual(count, SuiteMetadata.objects.count())
+        self.assertEqual(5, testrun.tests.count())
+
+    def test_links_known_issues(self):
+        issue = KnownIssue.objects.create(title='some known issue', test_name='foobar/test1')
+        issue.environments.add(self.environment)
+        ParseTestRunData()(self.testrun)
+
+        test = self.testrun.tests.get(suite__slug='foobar', name='test1')
+        self.assertTrue(test.has_known_issues)
+        self.assertEqual([issue], list(test.known_issues.all()))
+        self.assertEqual(1, self.testrun.tests.filter(has_known_issues=True).count())
+
+    def count_queries(self, ntests):
+        tests = {'suite%d/test%d-%d' % (i % 3, ntests, i): 'pass' for i in range(ntests)}
+        build = self.testrun.build.project.builds.create(version=str(ntests))
+        testrun = build.test_runs.create(environment=self.environment, tests_file=json.dumps(tests))
+        with CaptureQueriesContext(connection) as queries:
+            ParseTestRunData()(testrun)
+        self.assertEqual(ntests, testrun.tests.count())
+        return len(queries)
+
+    def test_number_of_queries_does_not_depend_on_number_of_tests(self):
+        self.count_queries(3)  # create suites
+        # stay below the number of rows per INSERT that SQLite accepts, above
+        # which Django splits bulk inserts by itself
+        self.assertEqual(self.count_queries(10), self.count_queries(50))
+
 
 class ProcessAllTestRunsTest(CommonTestCase):
 
@@ -415,6 +464,32 @@ class RecordTestRunStatusTest(CommonTestCase):
         self.assertEqual(1, SuiteVersion.objects.filter(version='5', suite__slug='special').count())
         self.assertIsNotNone(self.testrun.status.by_suite().first().suite_version)
 
+    def test_existing_suite_version(self):
+        self.set_suite_versions()
+        project = self.testrun.build.project
+        SuiteVersion.objects.create(suite=project.suites.create(slug='foobar'), version='2')
+        ParseTestRunData()(self.testrun)
+        RecordTestRunStatus()(self.testrun)
+
+        self.assertEqual(1, SuiteVersion.objects.filter(suite__slug='foobar').count())
+        status = self.testrun.status.get(suite__slug='foobar')
+        self.assertEqual('2', status.suite_version.version)
+
+    def test_number_of_queries_does_not_depend_on_number_of_tests(self):
+        suite = self.testrun.build.project.suites.create(slug='many')
+        for i in range(50):
+            self.testrun.tests.create(suite=suite, name='test%d' % i, result=(i % 2 == 0))
+            self.testrun.metrics.create(suite=suite, name='metric%d' % i, result=i + 1, measurements=Metric.pack_measurements([i + 1]))
+
+        # tests, metrics, Status, and TestRun
+        with self.assertNumQueries(4):
+            RecordTestRunStatus()(self.testrun)
+
+        status = self.testrun.status.get(suite=suite)
+        self.assertEqual(25, status.tests_pass)
+        self.assertEqual(25, status.tests_fail)
+        self.assertTrue(status.has_metrics)
+
 
 class UpdateProjectStatusTest(CommonTestCase):
 
@@ -428,6 +503,131 @@ class UpdateProjectStatusTest(CommonTestCase):
         maybe_notify_project_status.delay.assert_called_with(status.id)
 
 
+@override_settings(SQUAD_STATUS_UPDATE_DELAY=60, SQUAD_STATUS_UPDATE_MAX_DELAY=300)
+class ScheduleStatusUpdateTest(CommonTestCase):
+
+    def setUp(self):
+        super(ScheduleStatusUpdateTest, self).setUp()
+        ProcessTestRun()(self.testrun)
+        self.build = self.testrun.build
+
+    @override_settings(SQUAD_STATUS_UPDATE_DELAY=0)
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_update_right_away_by_default(self, apply_async):
+        ScheduleStatusUpdate()(self.testrun)
+        apply_async.assert_not_called()
+        self.assertEqual(5, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_schedule_once(self, apply_async):
+        ScheduleStatusUpdate()(self.testrun)
+        ScheduleStatusUpdate()(self.testrun)
+        ScheduleStatusUpdate()(self.testrun)
+
+        apply_async.assert_called_once_with(args=[self.build.id], countdown=60)
+        self.assertEqual(1, PendingStatusUpdate.objects.filter(build=self.build).count())
+        self.assertEqual(0, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    @patch('squad.core.tasks.maybe_notify_project_status')
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_update_after_quiet_period(self, apply_async, maybe_notify_project_status):
+        ago = timezone.now() - relativedelta(seconds=61)
+        PendingStatusUpdate.objects.create(build=self.build, first_requested_at=ago, last_requested_at=ago)
+
+        update_build_status(self.build.id)
+
+        apply_async.assert_not_called()
+        self.assertFalse(PendingStatusUpdate.objects.filter(build=self.build).exists())
+        status = ProjectStatus.objects.get(build=self.build)
+        self.assertEqual(5, status.tests_total)
+        self.assertEqual(5, self.build.metrics_summary.get(environment=self.environment).tests_total)
+        maybe_notify_project_status.delay.assert_called_once_with(status.id)
+
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_postpone_while_test_runs_arrive(self, apply_async):
+        now = timezone.now()
+        PendingStatusUpdate.objects.create(
+            build=self.build,
+            first_requested_at=now - relativedelta(seconds=100),
+            last_requested_at=now - relativedelta(seconds=10),
+        )
+
+        update_build_status(self.build.id)
+
+        args, kwargs = apply_async.call_args
+        self.assertEqual([self.build.id], kwargs['args'])
+        self.assertAlmostEqual(50, kwargs['countdown'], delta=5)
+        self.assertTrue(PendingStatusUpdate.objects.filter(build=self.build).exists())
+        self.assertEqual(0, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_maximum_delay(self, apply_async):
+        now = timezone.now()
+        PendingStatusUpdate.objects.create(
+            build=self.build,
+            first_requested_at=now - relativedelta(seconds=301),
+            last_requested_at=now,
+        )
+
+        update_build_status(self.build.id)
+
+        apply_async.assert_not_called()
+        self.assertEqual(5, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    def test_nothing_pending(self):
+        update_build_status(self.build.id)
+        self.assertEqual(0, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    @patch('squad.core.tasks.update_build_status.apply_async', side_effect=OSError('Connection refused'))
+    def test_update_right_away_when_scheduling_fails(self, apply_async):
+        ScheduleStatusUpdate()(self.testrun)
+
+        self.assertFalse(PendingStatusUpdate.objects.filter(build=self.build).exists())
+        self.assertEqual(5, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    @patch('squad.core.tasks.ProjectStatus.create_or_update', side_effect=RuntimeError('failed'))
+    def test_keep_pending_update_when_update_fails(self, create_or_update):
+        ago = timezone.now() - relativedelta(seconds=61)
+        PendingStatusUpdate.objects.create(build=self.build, first_requested_at=ago, last_requested_at=ago)
+
+        with self.assertRaises(RuntimeError):
+            update_build_status(self.build.id)
+
+        self.assertTrue(PendingStatusUpdate.objects.filter(build=self.build).exists())
+
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_schedule_again_when_test_runs_arrive_during_update(self, apply_async):
+        ago = timezone.now() - relativedelta(seconds=61)
+        PendingStatusUpdate.objects.create(build=self.build, first_requested_at=ago, last_requested_at=ago)
+        create_or_update = BuildSummary.create_or_update
+
+        def test_run_arrives(*args):
+            PendingStatusUpdate.objects.filter(build=self.build).update(last_requested_at=timezone.now())
+            return create_or_update(*args)
+
+        with patch('squad.core.tasks.BuildSummary.create_or_update', side_effect=test_run_arrives):
+            update_build_status(self.build.id)
+
+        self.assertTrue(PendingStatusUpdate.objects.filter(build=self.build).exists())
+        apply_async.assert_called_once_with(args=[self.build.id], countdown=60)
+        self.assertEqual(5, ProjectStatus.objects.get(build=self.build).tests_total)
+
+    @patch('squad.core.tasks.update_build_status.apply_async')
+    def test_update_overdue_build_statuses(self, apply_async):
+        other_build = self.build.project.builds.create(version='2')
+        long_ago = timezone.now() - relativedelta(minutes=30)
+        PendingStatusUpdate.objects.create(build=self.build, first_requested_at=long_ago, last_requested_at=long_ago)
+        now = timezone.now()
+        PendingStatusUpdate.objects.create(build=other_build, first_requested_at=now, last_requested_at=now)
+
+        update_overdue_build_statuses()
+
+        self.assertFalse(PendingStatusUpdate.objects.filter(build=self.build).exists())
+        self.assertEqual(5, ProjectStatus.objects.get(build=self.build).tests_total)
+        self.assertTrue(PendingStatusUpdate.objects.filter(build=other_build).exists())
+        apply_async.assert_not_called()
+
+
 class ProcessTestRunTest(CommonTestCase):
 
     def test_basics(self):
@@ -523,6 +723,17 @@ class ReceiveTestRunTest(TestCase):
 
         self.assertEqual(LOG_FILE_PROPER_CONTENT, testrun.log_file)
 
+    def test_logfile_upload_with_null_bytes(self):
+        receive = ReceiveTestRun(self.project)
+        metadata_in = {
+            'job_id': '12345'
+        }
+
+        receive('199', 'myenv', metadata_file=json.dumps(metadata_in), log_file=BytesIO(b"\x00ab\x00c"))
+        testrun = TestRun.objects.last()
+
+        self.assertEqual("abc", testrun.log_file)
+
     def test_build_datetime(self):
         receive = ReceiveTestRun(self.project)
 
@@ -541,6 +752,18 @@ class ReceiveTestRunTest(TestCase):
 
         self.assertEqual(yesterday, build.datetime)
 
+    @patch('squad.core.data.json')
+    def test_decodes_data_files_only_once(self, data_json):
+        receive = ReceiveTestRun(self.project)
+        testrun = receive(
+            '199', 'myenv',
+            tests_file='{"test1": "pass", "test2": "fail"}',
+            metrics_file='{"metric1": 1.5}',
+        )
+        data_json.loads.assert_not_called()
+        self.assertEqual(2, testrun.tests.count())
+        self.assertEqual(1, testrun.metrics.count())
+
     @patch('squad.core.tasks.ValidateTestRun.__call__')
     def test_should_validate_test_run(self, validator_mock):
         validator_mock.side_effect = RuntimeError('crashed')
@@ -583,6 +806,51 @@ class ReceiveTestRunTest(TestCase):
         UpdateProjectStatus.assert_not_called()
 
 
+class ReceiveTestRunBatchTest(TestCase):
+
+    def setUp(self):
+        group = Group.objects.create(slug='mygroup')
+        self.project = group.projects.create(slug='mygroup')
+
+    @patch('squad.core.tasks.UpdateProjectStatus.__call__')
+    def test_receive_batch(self, UpdateProjectStatus):
+        receive = ReceiveTestRunBatch(self.project)
+        testruns = receive('1', [
+            {'environment_slug': 'env1', 'tests_file': '{"test1": "pass"}'},
+            {'environment_slug': 'env1', 'tests_file': '{"test2": "pass"}'},
+            {'environment_slug': 'env2', 'tests_file': '{"test1": "fail"}'},
+        ])
+        self.assertEqual(3, len(testruns))
+        self.assertEqual(3, Build.objects.get(version='1').test_runs.count())
+        UpdateProjectStatus.assert_called_once_with(testruns[-1])
+
+    def test_build_summaries(self):
+        receive = ReceiveTestRunBatch(self.project)
+        receive('1', [
+            {'environment_slug': 'env1', 'tests_file': '{"test1": "pass"}'},
+            {'environment_slug': 'env1', 'tests_file': '{"test2": "pass"}'},
+            {'environment_slug': 'env2', 'tests_file': '{"test1": "fail"}'},
+        ])
+        build = Build.objects.get(version='1')
+        summaries = {s.environment.slug: s for s in build.metrics_summary.all()}
+        self.assertEqual(2, summaries['env1'].tests_pass)
+        self.assertEqual(1, summaries['env2'].tests_fail)
+        self.assertEqual(2, build.status.tests_pass)
+
+    def test_all_or_nothing(self):
+        receive = ReceiveTestRunBatch(self.project)
+        with self.assertRaises(exceptions.InvalidTestsDataJSON):
+            receive('1', [
+                {'environment_slug': 'env1', 'tests_file': '{"test1": "pass"}'},
+                {'environment_slug': 'env1', 'tests_file': '{'},
+            ])
+        self.assertEqual(0, TestRun.objects.count())
+
+    def test_empty_batch(self):
+        receive = ReceiveTestRunBatch(self.project)
+        self.assertEqual([], receive('1', []))
+
+
 class TestValidateTestRun(TestCase):
 
     # ~~~~~~~~~~~~ TESTS FOR METADATA ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -637,6 +905,24 @@ class TestValidateTestRun(TestCase):
     def test_invalid_tests_type(self):
         self.assertInvalidTests('[]')
 
+    # ~~~~~~~~~~~~ TESTS FOR DECODED DATA ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def test_returns_decoded_data(self):
+        validate = ValidateTestRun()
+        data = validate(
+            metadata_file='{"job_id": "1"}',
+            metrics_file='{"foo": 1}',
+            tests_file='{"bar": "pass"}',
+        )
+        self.assertEqual({"job_id": "1"}, data.metadata)
+        self.assertEqual({"foo": 1}, data.metrics)
+        self.assertEqual({"bar": "pass"}, data.tests)
+
+    def test_returns_no_data_for_missing_files(self):
+        data = ValidateTestRun()()
+        self.assertIsNone(data.metadata)
+        self.assertIsNone(data.metrics)
+        self.assertIsNone(data.tests)
+
 
 class CreateBuildTest(TestCase):
 
@@ -692,32 +978,32 @@ class CleanupOldBuildsTest(TestCase):
             build.save()
         return build
 
-    @patch('squad.core.tasks.cleanup_build')
-    def test_cleanup_old_builds(self, cleanup_build):
+    @patch('squad.core.tasks.cleanup_project')
+    def test_cleanup_old_builds(self, cleanup_project):
         seven_months_ago = timezone.now() - timezone.timedelta(210)
-        old_build = self.create_build('1', seven_months_ago)
+        self.create_build('1', seven_months_ago)
         self.create_build('2')  # new build, should be kept
         cleanup_old_builds()
-        cleanup_build.delay.assert_called_once_with(old_build.id)
+        cleanup_project.delay.assert_called_once_with(self.project.id)
 
-    @patch('squad.core.tasks.cleanup_build')
-    def test_cleanup_old_builds_does_not_delete_builds_from_other_projects(self, cleanup_build):
+    @patch('squad.core.tasks.cleanup_project')
+    def test_cleanup_old_builds_does_not_delete_builds_from_other_projects(self, cleanup_project):
         seven_months_ago = timezone.now() - timezone.timedelta(210)
 
         other_project = self.group.projects.create(slug='otherproject')
         self.create_build('1', created_at=seven_months_ago, project=other_project)
         cleanup_old_builds()
-        cleanup_build.delay.assert_not_called()
+        cleanup_project.delay.assert_not_called()
 
-    @patch('squad.core.tasks.cleanup_build')
-    def test_cleanup_old_builds_respects_data_retention_policy(self, cleanup_build):
-        build = self.create_build('1', timezone.now() - timezone.timedelta(90))
+    @patch('squad.core.tasks.cleanup_project')
+    def test_cleanup_old_builds_respects_data_retention_policy(self, cleanup_project):
+        self.create_build('1', timezone.now() - timezone.timedelta(90))
         cleanup_old_builds()
-        cleanup_build.delay.assert_not_called()
+        cleanup_project.delay.assert_not_called()
         self.project.data_retention_days = 60
         self.project.save()
         cleanup_old_builds()
-        cleanup_build.delay.assert_called_once_with(build.id)
+        cleanup_project.delay.assert_called_once_with(self.project.id)
 
     def test_cleanup_build(self):
         build_id = self.create_build('1').id
@@ -730,21 +1016,243 @@ class CleanupOldBuildsTest(TestCase):
         cleanup_build(build_id)
         self.assertTrue(self.project.build_placeholders.filter(version='1').exists())
 
-    @patch('squad.core.tasks.cleanup_build')
-    def test_no_cleanup_with_non_positive_data_retention_days(self, cleanup_build):
+    @patch('squad.core.tasks.cleanup_project')
+    def test_no_cleanup_with_non_positive_data_retention_days(self, cleanup_project):
         self.project.data_retention_days = 0
         self.project.save()
         self.create_build('1', timezone.now() - timezone.timedelta(210))
         cleanup_old_builds()
-        cleanup_build.delay.assert_not_called()
+        cleanup_project.delay.assert_not_called()
 
-    @patch('squad.core.tasks.cleanup_build')
-    def test_no_cleanup_when_build_has_keep_data_checked(self, cleanup_build):
+    @patch('squad.core.tasks.cleanup_project')
+    def test_no_cleanup_when_build_has_keep_data_checked(self, cleanup_project):
         build = self.create_build('1', timezone.now() - timezone.timedelta(210))
         build.keep_data = True
         build.save()
         cleanup_old_builds()
-        cleanup_build.delay.assert_not_called()
+        cleanup_project.delay.assert_not_called()
+
+
+class CleanupTestCase(TestCase):
+
+    def setUp(self):
+        self.group = Group.objects.create(slug='mygroup')
+        self.project = self.group.projects.create(slug='myproject', data_retention_days=180)
+        self.environment = self.project.environments.create(slug='myenv')
+        self.suite = self.project.suites.create(slug='mysuite')
+        self.created_at = timezone.make_aware(datetime.datetime(2019, 12, 17, 18, 0, 0))
+
+    def create_build(self, version, created_at=None, project=None):
+        project = project or self.project
+        build = project.builds.create(version=version)
+        build.created_at = created_at or self.created_at
+        build.save()
+        testrun = build.test_runs.create(environment=project.environments.get_or_create(slug='myenv')[0])
+        suite = project.suites.get_or_create(slug='mysuite')[0]
+        test = testrun.tests.create(suite=suite, name='foo', result=False)
+        issue = KnownIssue.objects.create(title='foo', test_name='mysuite/foo')
+        test.known_issues.add(issue)
+        testrun.metrics.create(suite=suite, name='bar', result=1)
+        testrun.attachments.create(filename='foo.txt', data=b'foo', length=3)
+        RecordTestRunStatus()(testrun)
+        UpdateProjectStatus()(testrun)
+        return build
+
+    def assertAllDataRemoved(self):
+        self.assertEqual(0, TestRun.objects.count())
+        self.assertEqual(0, Test.objects.count())
+        self.assertEqual(0, Test.known_issues.through.objects.count())
+        self.assertEqual(0, Metric.objects.count())
+        self.assertEqual(0, Status.objects.count())
+        self.assertEqual(0, Attachment.objects.count())
+        self.assertEqual(0, ProjectStatus.objects.count())
+
+
+class CleanupProjectTest(CleanupTestCase):
+
+    def test_removes_all_expired_builds(self):
+        build1 = self.create_build('1')
+        build2 = self.create_build('2', self.created_at + timezone.timedelta(days=3))
+        cleanup_project(self.project.id)
+
+        self.assertFalse(Build.objects.filter(id__in=[build1.id, build2.id]).exists())
+        self.assertAllDataRemoved()
+        self.assertEqual(['1', '2'], sorted(self.project.build_placeholders.values_list('version', flat=True)))
+
+        progress = self.project.cleanup_progress
+        self.assertEqual(2, progress.builds_removed)
+        self.assertIsNone(progress.position)
+        self.assertIsNone(progress.running_until)
+        self.assertIsNotNone(progress.last_run_at)
+
+    def test_keeps_other_builds(self):
+        self.create_build('1')
+        kept = self.create_build('2')
+        kept.keep_data = True
+        kept.save()
+        recent = self.create_build('3', timezone.now())
+        other_project = self.group.projects.create(slug='otherproject', data_retention_days=180)
+        other = self.create_build('1', project=other_project)
+
+        cleanup_project(self.project.id)
+
+        self.assertEqual(
+            sorted([kept.id, recent.id, other.id]),
+            sorted(Build.objects.values_list('id', flat=True)),
+        )
+        self.assertEqual(3, Test.objects.count())
+        self.assertEqual(['1'], list(self.project.build_placeholders.values_list('version', flat=True)))
+
+    def test_removes_whole_periods_at_once_and_edge_builds_one_by_one(self):
+        now = timezone.make_aware(datetime.datetime(2020, 6, 15, 12, 0, 0))
+        # 180 days before now is 2019-12-18 12:00
+        self.create_build('1')
+        self.create_build('2', self.created_at + timezone.timedelta(hours=1))
+        edge = self.create_build('3', timezone.make_aware(datetime.datetime(2019, 12, 18, 6, 0, 0)))
+        kept = self.create_build('4', timezone.make_aware(datetime.datetime(2019, 12, 18, 18, 0, 0)))
+
+        with patch('squad.core.tasks.retention.delete_build', wraps=retention.delete_build) as delete_build:
+            with patch('django.utils.timezone.now', return_value=now):
+                cleanup_project(self.project.id)
+
+        self.assertEqual(1, delete_build.call_count)
+        self.assertEqual(edge, delete_build.call_args[0][0])
+        self.assertEqual([kept.id], list(Build.objects.values_list('id', flat=True)))
+
+    def test_does_not_duplicate_placeholders(self):
+        self.project.build_placeholders.create(version='1')
+        self.create_build('1')
+        cleanup_project(self.project.id)
+        self.assertEqual(1, self.project.build_placeholders.count())
+
+    @override_settings(SQUAD_CLEANUP_ROW_BUDGET=1, SQUAD_CLEANUP_PAUSE=30)
+    def test_continues_later_when_budget_is_exhausted(self):
+        build1 = self.create_build('1')
+        build2 = self.create_build('2', self.created_at + timezone.timedelta(days=1))
+
+        with patch.object(cleanup_project, 'apply_async') as apply_async:
+            cleanup_project(self.project.id)
+
+        # the budget ran out after the first batch, halfway through the period
+        apply_async.assert_called_once_with(args=[self.project.id], countdown=30)
+        self.assertTrue(Build.objects.filter(id=build1.id).exists())
+        progress = self.project.cleanup_progress
+        self.assertEqual(0, progress.builds_removed)
+        self.assertIsNone(progress.position)
+        self.assertIsNone(progress.running_until)
+
+        runs = 1
+        while apply_async.called:
+            apply_async.reset_mock()
+            with patch.object(cleanup_project, 'apply_async', apply_async):
+                cleanup_project(self.project.id)
+            runs += 1
+
+        self.assertGreater(runs, 2)
+        self.assertFalse(Build.objects.filter(id__in=[build1.id, build2.id]).exists())
+        self.assertAllDataRemoved()
+        progress.refresh_from_db()
+        self.assertEqual(2, progress.builds_removed)
+
+    def test_renews_lease_on_each_batch(self):
+        self.create_build('1')
+        leases = []
+        original = retention.delete_builds
+
+        def delete_builds(builds, progress=None, budget=None):
+            CleanupProgress.objects.filter(project=self.project).update(running_until=None)
+            progress(Test, 1)
+            leases.append(CleanupProgress.objects.get(project=self.project).running_until)
+            return original(builds, budget=budget)
+
+        with patch('squad.core.tasks.retention.delete_builds', side_effect=delete_builds):
+            cleanup_project(self.project.id)
+
+        self.assertEqual(1, len(leases))
+        self.assertGreater(leases[0], timezone.now())
+
+    def test_only_one_cleanup_per_project_at_a_time(self):
+        build = self.create_build('1')
+        CleanupProgress.objects.create(project=self.project, running_until=timezone.now() + timezone.timedelta(minutes=5))
+        cleanup_project(self.project.id)
+        self.assertTrue(Build.objects.filter(id=build.id).exists())
+
+    def test_takes_over_a_dead_cleanup(self):
+        build = self.create_build('1')
+        CleanupProgress.objects.create(project=self.project, running_until=timezone.now() - timezone.timedelta(minutes=5))
+        cleanup_project(self.project.id)
+        self.assertFalse(Build.objects.filter(id=build.id).exists())
+
+
+class CleanupBuildInBatchesTest(CleanupTestCase):
+
+    def setUp(self):
+        super(CleanupBuildInBatchesTest, self).setUp()
+        self.build = self.create_build('1')
+        testrun = self.build.test_runs.get()
+        for i in range(4):
+            testrun.tests.create(suite=self.suite, name='test%d' % i, result=True)
+
+    def test_deletes_everything_in_batches(self):
+        batches = []
+        deleted = retention.delete_build(self.build, batch_size=2, progress=lambda model, count: batches.append((model, count)))
+
+        self.assertFalse(Build.objects.filter(id=self.build.id).exists())
+        self.assertAllDataRemoved()
+        self.assertTrue(self.project.build_placeholders.filter(version='1').exists())
+        self.assertEqual(5, deleted[Test])
+        self.assertEqual([(Test, 2), (Test, 4), (Test, 5)], [b for b in batches if b[0] is Test])
+
+    def test_resumes_after_interruption(self):
+        def interrupt(model, count):
+            raise RuntimeError('interrupted')
+
+        with self.assertRaises(RuntimeError):
+            retention.delete_build(self.build, batch_size=2, progress=interrupt)
+
+        # the first batch is gone, but the build is still there
+        self.assertTrue(Build.objects.filter(id=self.build.id).exists())
+        self.assertFalse(self.project.build_placeholders.exists())
+
+        cleanup_build(self.build.id)
+        self.assertFalse(Build.objects.filter(id=self.build.id).exists())
+        self.assertAllDataRemoved()
+        self.assertEqual(1, self.project.build_placeholders.count())
+
+    def test_stops_between_batches_when_budget_is_exhausted(self):
+        budget = retention.Budget(rows=1)
+        deleted = retention.delete_build(self.build, batch_size=2, budget=budget)
+
+        self.assertTrue(budget.exhausted)
+        self.assertNotIn(Build, deleted)
+        self.assertLessEqual(sum(deleted.values()), 2)
+        self.assertTrue(Build.objects.filter(id=self.build.id).exists())
+        self.assertFalse(self.project.build_placeholders.exists())
+
+        retention.delete_build(self.build, batch_size=2)
+        self.assertFalse(Build.objects.filter(id=self.build.id).exists())
+        self.assertAllDataRemoved()
+
+    def test_build_already_removed(self):
+        cleanup_build(self.build.id)
+        cleanup_build(self.build.id)
+        self.assertEqual(1, self.project.build_placeholders.count())
+
+    def test_deletes_whole_periods_in_batches(self):
+        other = self.create_build('2')
+        batches = []
+        deleted = retention.delete_builds(
+            self.project.builds.all(),
+            batch_size=2,
+            progress=lambda model, count: batches.append((model, count)),
+        )
+
+        self.assertFalse(Build.objects.filter(id__in=[self.build.id, other.id]).exists())
+        self.assertAllDataRemoved()
+        self.assertEqual(['1', '2'], sorted(self.project.build_placeholders.values_list('version', flat=True)))
+        self.assertEqual(6, deleted[Test])
+        self.assertEqual(2, deleted[Build])
+        self.assertEqual([(Test, 2), (Test, 4), (Test, 6)], [b for b in batches if b[0] is Test])
 
 
 class PrepareDelayedReport(TestCase):
@@ -3,7 +3,7 @@ from django.test import TestCase
 from django.utils import timezone
 
 from unittest.mock import patch
-from squad.core.models import Group, Test, Suite
+from squad.core.models import Group, Test, Suite, SuiteMetadata
 
 
 def test(**kwargs):
@@ -41,6 +41,16 @@ class TestTest(TestCase):
         t = test(result=False, has_known_issues=True)
         self.assertEqual('xfail', t.status)
 
+    def test_metadata_set_on_save(self):
+        t = test(name='foo')
+        self.assertEqual(('test', 'the-suite', 'foo'), (t.metadata.kind, t.metadata.suite, t.metadata.name))
+
+    def test_metadata_shared_by_the_same_test(self):
+        t1 = test(name='foo')
+        t2 = Test.objects.create(test_run=t1.test_run, suite=t1.suite, name='foo')
+        self.assertEqual(t1.metadata_id, t2.metadata_id)
+        self.assertEqual(1, SuiteMetadata.objects.filter(kind='test').count())
+
 
 class TestFailureHistoryTest(TestCase):
 
@@ -118,3 +128,17 @@ class TestFailureHistoryTest(TestCase):
         self.assertEqual(first, current.history.since)
         self.assertEqual(1, current.history.count)
         self.assertEqual(last_pass, current.history.last_different)
+
+    def test_test_from_another_suite_is_not_considered(self):
+        last_pass = self.previous_test("mytest", True)
+        first = self.previous_test("mytest", False)
+
+        othersuite = self.project.suites.create(slug='othersuite')
+        build = self.project.builds.create(datetime=self.date, version='other')
+        build.test_runs.create(environment=self.environment).tests.create(suite=othersuite, name='mytest', result=True)
+        self.date = self.date + relativedelta(days=1)
+
+        current = self.previous_test("mytest", False)
+        self.assertEqual(first, current.history.since)
+        self.assertEqual(1, current.history.count)
+        self.assertEqual(last_pass, current.history.last_different)
@@ -24,11 +24,19 @@ class JSONTestDataParserTest(TestCase):
         self.assertEqual([], json_parser(None))
         self.assertEqual([], json_parser(''))
         self.assertEqual([], json_parser('{}'))
+        self.assertEqual([], json_parser({}))
 
     def test_basic(self):
         data = json_parser(TEST_DATA)
         self.assertEqual(6, len(data))
 
+    def test_decoded_data(self):
+        data = json_parser({"group1/pass": "pass", "fail": "fail"})
+        self.assertEqual(
+            [('group1', 'pass', True), ('/', 'fail', False)],
+            [(t['group_name'], t['test_name'], t['pass']) for t in data]
+        )
+
     def test_test_name(self):
         test_names = [t['test_name'] for t in json_parser(TEST_DATA)]
         self.assertIn("ungrouped_pass", test_names)
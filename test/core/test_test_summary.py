@@ -88,3 +88,42 @@ class TestSummaryTest(TestCase):
         self.assertEqual(1, summary.tests_total)
         self.assertEqual(1, summary.tests_pass)
         self.assertEqual(0, summary.tests_fail)
+
+    def test_same_test_in_different_suites(self):
+        build = Build.objects.create(project=self.project, version='1.1')
+        env = self.project.environments.create(slug='env')
+        suite1 = self.project.suites.create(slug='suite1')
+        suite2 = self.project.suites.create(slug='suite2')
+        test_run = build.test_runs.create(environment=env)
+
+        test_run.tests.create(name='foo', suite=suite1, result=True)
+        test_run.tests.create(name='foo', suite=suite2, result=False)
+
+        summary = build.test_summary
+        self.assertEqual(2, summary.tests_total)
+
+    def test_failures_of_later_test_runs_only(self):
+        build = Build.objects.create(project=self.project, version='1.1')
+        env = self.project.environments.create(slug='env')
+        suite = self.project.suites.create(slug='tests')
+        test_run1 = build.test_runs.create(environment=env)
+        test_run2 = build.test_runs.create(environment=env)
+
+        test_run1.tests.create(name='foo', suite=suite, result=False)
+        test_run1.tests.create(name='bar', suite=suite, result=False)
+        test_run2.tests.create(name='foo', suite=suite, result=True)
+
+        summary = build.test_summary
+        self.assertEqual(['tests/bar'], [t.full_name for t in summary.failures['env']])
+
+    def test_failing_tests_paginated(self):
+        build = Build.objects.create(project=self.project, version='1.1')
+        env = self.project.environments.create(slug='env')
+        suite = self.project.suites.create(slug='tests')
+        test_run = build.test_runs.create(environment=env)
+        for i in range(5):
+            test_run.tests.create(name='test%d' % i, suite=suite, result=False)
+
+        summary = build.test_summary
+        self.assertEqual(5, summary.failing_tests.count())
+        self.assertEqual(['test2', 'test3'], [t.name for t in summary.failing_tests[2:4]])
@@ -4,7 +4,7 @@ from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
-from squad.core.models import Group, ProjectStatus
+from squad.core.models import Group, ProjectStatus, StatusChange, SuiteMetadata
 
 
 class UpdateStatusesTest(TestCase):
@@ -21,26 +21,27 @@ class UpdateStatusesTest(TestCase):
             build.test_runs.create(environment=self.environment)
         return build
 
+    def add_fix(self, status):
+        metadata, _ = SuiteMetadata.objects.get_or_create(kind='test', suite='/', name='foo')
+        status.changes.create(project=self.project, environment=self.environment, metadata=metadata, kind=StatusChange.FIX)
+
     def test_update_status(self):
         build1 = self.create_build('1')
         build1.datetime = timezone.make_aware(datetime(2018, 6, 1))
         build1.save()
 
         status1 = ProjectStatus.objects.first()
-        status1.fixes = "fixes1"
         status1.finished = True
         status1.save()
+        self.add_fix(status1)
 
         self.create_build('2')
         status2 = ProjectStatus.objects.last()
-        status2.fixes = "fixes2"
         status2.finished = True
         status2.save()
+        self.add_fix(status2)
 
         call_command('update_project_statuses', "--date-start", "2018-07-01")
 
-        status1.refresh_from_db()
-        status2.refresh_from_db()
-
-        self.assertEqual(status1.fixes, "fixes1")
-        self.assertNotEqual(status2.fixes, "fixes2")
+        self.assertEqual({'theenvironment': ['foo']}, status1.get_fixes())
+        self.assertEqual({}, status2.get_fixes())
@@ -1,5 +1,6 @@
 from django.test import TestCase
-from squad.core.utils import join_name, parse_name
+from io import BytesIO
+from squad.core.utils import join_name, parse_name, split_list, read_bytes, read_text
 
 
 class TestParseName(TestCase):
@@ -44,3 +45,25 @@ class TestJoinName(TestCase):
 
     def test_join_group(self):
         self.assertEqual('foo/bar', join_name('foo', 'bar'))
+
+
+class TestSplitList(TestCase):
+
+    def test_split(self):
+        self.assertEqual([[1, 2], [3, 4], [5]], list(split_list(range(1, 6), 2)))
+
+    def test_empty(self):
+        self.assertEqual([], list(split_list([], 2)))
+
+
+class TestReadData(TestCase):
+
+    def test_read_bytes(self):
+        self.assertEqual(b'foo', read_bytes(b'foo'))
+        self.assertEqual(b'foo', read_bytes('foo'))
+        self.assertEqual(b'foo', read_bytes(BytesIO(b'foo')))
+
+    def test_read_text(self):
+        self.assertEqual('foo', read_text('foo'))
+        self.assertEqual('foo', read_text(b'foo'))
+        self.assertEqual('ação', read_text(BytesIO('ação'.encode('utf-8'))))
@@ -1,7 +1,9 @@
 import re
 from django.test import TestCase
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.db import connection
 
 
 from squad.core import models
@@ -124,11 +126,58 @@ class FrontendTest(TestCase):
         self.test_run.attachments.create(filename='foo.txt', data=data, length=len(data))
         response = self.hit('/mygroup/myproject/build/1.0/testrun/1/attachments/foo.txt')
         self.assertEqual('text/plain', response['Content-Type'])
+        self.assertEqual(b'text file', b''.join(response.streaming_content))
 
     def test_log(self):
         response = self.hit('/mygroup/myproject/build/1.0/testrun/1/log')
         self.assertEqual('text/plain', response['Content-Type'])
 
+    def test_log_range(self):
+        response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log', HTTP_RANGE='bytes=-3')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b'...', b''.join(response.streaming_content))
+
+    def test_log_etag(self):
+        response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log')
+        response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+    def assertColumnNotLoaded(self, queries, column):
+        for query in queries:
+            # the column may only be read by LENGTH()/SUBSTR(), as bytes
+            sql = query['sql'].replace('CAST(%s AS BLOB)' % column, '')
+            self.assertNotIn(column, sql)
+
+    def test_log_range_does_not_load_log(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log', HTTP_RANGE='bytes=4-7')
+            self.assertEqual(b'file', b''.join(response.streaming_content))
+        self.assertEqual(206, response.status_code)
+        self.assertColumnNotLoaded(queries, '"core_testrun"."log_file"')
+
+    def test_log_etag_does_not_load_log(self):
+        response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+        self.assertColumnNotLoaded(queries, '"core_testrun"."log_file"')
+
+    def test_log_range_counts_bytes(self):
+        self.test_run.log_file = 'ção ...'
+        self.test_run.save()
+        response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/log', HTTP_RANGE='bytes=0-4')
+        self.assertEqual('bytes 0-4/9', response['Content-Range'])
+        self.assertEqual('ção'.encode('utf-8'), b''.join(response.streaming_content))
+
+    def test_attachment_range_does_not_load_data(self):
+        data = b'x' * 100000 + b'end'
+        self.test_run.attachments.create(filename='big.bin', data=data, length=len(data))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/mygroup/myproject/build/1.0/testrun/1/attachments/big.bin', HTTP_RANGE='bytes=-3')
+            self.assertEqual(b'end', b''.join(response.streaming_content))
+        self.assertEqual(206, response.status_code)
+        self.assertColumnNotLoaded(queries, '"core_attachment"."data"')
+
     def test_no_log(self):
         self.test_run.log_file = None
         self.test_run.save()
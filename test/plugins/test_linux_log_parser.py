@@ -34,6 +34,15 @@ class TestLinuxLogParser(TestCase):
         self.assertIn('Internal error: Oops - BUG: 0 [#1] PREEMPT SMP', test.log)
         self.assertNotIn('Kernel panic', test.log)
 
+    def test_creates_test_metadata(self):
+        testrun = self.new_test_run('oops.log')
+        self.plugin.postprocess_testrun(testrun)
+
+        test = testrun.tests.get(suite__slug='linux-log-parser', name='check-oops')
+        self.assertEqual('check-oops', test.metadata.name)
+        self.assertEqual('test', test.metadata.kind)
+        self.assertEqual('suite', test.suite.metadata.kind)
+
     def test_detects_kernel_panic(self):
         testrun = self.new_test_run('kernelpanic.log')
         self.plugin.postprocess_testrun(testrun)
@@ -0,0 +1,168 @@
+import gzip
+import lzma
+from io import BytesIO
+
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+
+
+from squad.http import read_file_upload, open_file_upload, file_upload_name
+from squad.http import InvalidUpload, UploadTooLarge
+from squad.http import file_response
+
+
+class ReadFileUploadTest(TestCase):
+
+    def test_read(self):
+        upload = SimpleUploadedFile('foo.txt', b'x' * 10000)
+        self.assertEqual(b'x' * 10000, read_file_upload(upload))
+
+    def test_too_large(self):
+        upload = SimpleUploadedFile('foo.txt', b'x' * 11)
+        with self.assertRaises(UploadTooLarge):
+            read_file_upload(upload, max_size=10)
+
+    @override_settings(SQUAD_MAX_UPLOAD_SIZE=10)
+    def test_default_max_size(self):
+        upload = SimpleUploadedFile('foo.txt', b'x' * 11)
+        with self.assertRaises(UploadTooLarge):
+            read_file_upload(upload)
+
+    @override_settings(SQUAD_MAX_UPLOAD_SIZE=0)
+    def test_no_limit(self):
+        upload = SimpleUploadedFile('foo.txt', b'x' * 11)
+        self.assertEqual(b'x' * 11, read_file_upload(upload))
+
+
+class OpenFileUploadTest(TestCase):
+
+    def test_open(self):
+        upload = SimpleUploadedFile('foo.txt', b'hello')
+        upload.read()
+        self.assertEqual(b'hello', open_file_upload(upload).read())
+
+    def test_too_large(self):
+        upload = SimpleUploadedFile('foo.txt', b'x' * 11)
+        with self.assertRaises(UploadTooLarge):
+            open_file_upload(upload, max_size=10)
+
+
+class CompressedFileUploadTest(TestCase):
+
+    def test_gzip_by_extension(self):
+        upload = SimpleUploadedFile('tests.json.gz', gzip.compress(b'{"foo": "pass"}'))
+        self.assertEqual(b'{"foo": "pass"}', read_file_upload(upload))
+
+    def test_gzip_by_content_type(self):
+        upload = SimpleUploadedFile('tests.json', gzip.compress(b'{}'), content_type='application/gzip')
+        self.assertEqual(b'{}', read_file_upload(upload))
+
+    def test_xz(self):
+        upload = SimpleUploadedFile('log.xz', lzma.compress(b'log text'))
+        self.assertEqual(b'log text', open_file_upload(upload).read())
+
+    def test_uncompressed_name(self):
+        self.assertEqual('log.txt', file_upload_name(SimpleUploadedFile('log.txt.gz', b'')))
+        self.assertEqual('log.txt', file_upload_name(SimpleUploadedFile('log.txt', b'')))
+
+    def test_not_by_extension(self):
+        data = gzip.compress(b'config')
+        upload = SimpleUploadedFile('config.gz', data, content_type='application/octet-stream')
+        self.assertEqual(data, open_file_upload(upload, by_extension=False).read())
+        self.assertEqual('config.gz', file_upload_name(upload, by_extension=False))
+
+        upload = SimpleUploadedFile('config.gz', data, content_type='application/gzip')
+        self.assertEqual(b'config', open_file_upload(upload, by_extension=False).read())
+        self.assertEqual('config', file_upload_name(upload, by_extension=False))
+
+    def test_decompression_bomb(self):
+        upload = SimpleUploadedFile('log.gz', gzip.compress(b'x' * 1000000))
+        self.assertLess(upload.size, 10000)
+        with self.assertRaises(UploadTooLarge):
+            open_file_upload(upload, max_size=10000)
+        with self.assertRaises(UploadTooLarge):
+            read_file_upload(upload, max_size=10000)
+
+    def test_invalid_compressed_data(self):
+        upload = SimpleUploadedFile('log.gz', b'this is not gzip')
+        with self.assertRaises(InvalidUpload):
+            read_file_upload(upload)
+
+
+class FileResponseTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.data = b'0123456789' * 10000
+
+    def get(self, content_type='application/octet-stream', **headers):
+        request = self.factory.get('/', **headers)
+        return file_response(request, BytesIO(self.data), content_type, length=len(self.data), digest='abc')
+
+    def test_full(self):
+        response = self.get()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.data, b''.join(response.streaming_content))
+        self.assertEqual(str(len(self.data)), response['Content-Length'])
+        self.assertEqual('bytes', response['Accept-Ranges'])
+        self.assertEqual('"abc"', response['ETag'])
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE='bytes=10-14')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b'01234', b''.join(response.streaming_content))
+        self.assertEqual('bytes 10-14/100000', response['Content-Range'])
+        self.assertEqual('5', response['Content-Length'])
+
+    def test_open_ended_range(self):
+        response = self.get(HTTP_RANGE='bytes=99995-')
+        self.assertEqual(b'56789', b''.join(response.streaming_content))
+
+    def test_suffix_range(self):
+        response = self.get(HTTP_RANGE='bytes=-3')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(b'789', b''.join(response.streaming_content))
+        self.assertEqual('bytes 99997-99999/100000', response['Content-Range'])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=100000-')
+        self.assertEqual(416, response.status_code)
+        self.assertEqual('bytes */100000', response['Content-Range'])
+
+    def test_multiple_ranges_ignored(self):
+        response = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(200, response.status_code)
+
+    def test_if_range(self):
+        self.assertEqual(206, self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"abc"').status_code)
+        self.assertEqual(200, self.get(HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"other"').status_code)
+
+    def test_if_none_match(self):
+        response = self.get(HTTP_IF_NONE_MATCH='"abc"')
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('"abc"', response['ETag'])
+        self.assertEqual(200, self.get(HTTP_IF_NONE_MATCH='"other"').status_code)
+
+    def test_gzip(self):
+        response = self.get('text/plain', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('gzip', response['Content-Encoding'])
+        self.assertEqual('"abc-gzip"', response['ETag'])
+        self.assertEqual('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.data, gzip.decompress(b''.join(response.streaming_content)))
+        self.assertFalse(response.has_header('Content-Length'))
+
+        self.assertEqual(304, self.get('text/plain', HTTP_IF_NONE_MATCH='"abc-gzip"').status_code)
+
+    def test_no_gzip_for_binary_files(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_no_gzip_when_not_accepted(self):
+        response = self.get('text/plain', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_no_gzip_for_ranges(self):
+        response = self.get('text/plain', HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=0-1')
+        self.assertEqual(b'01', b''.join(response.streaming_content))